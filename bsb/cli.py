@@ -154,6 +154,11 @@ def start_cli():
     parser_sim.add_argument(
         "-rc", "--reconfigure", help="Specify the path of the new configuration file."
     )
+    parser_sim.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the simulation from its last checkpoint.",
+    )
 
     # Create config subparser
     parser_config.add_argument(
@@ -243,7 +248,11 @@ def start_cli():
         if (
             cl_args.task == "run" or cl_args.task == "simulate"
         ):  # Do we need to run a simulation?
-            scaffoldInstance.run_simulation(cl_args.simulation, quit=True)
+            scaffoldInstance.run_simulation(
+                cl_args.simulation,
+                quit=True,
+                resume=getattr(cl_args, "resume", False),
+            )
 
 
 def cli_plot(args):
@@ -633,8 +642,7 @@ def repl_voxelize(morphology_repository, args):
     Callback function that handles ``voxelize`` command in the *base_mr* state.
     """
     m = morphology_repository.get_morphology(args.name)
-    m.voxelize(args.voxels)
-    morphology_repository.store_voxel_cloud(m, overwrite=True)
+    morphology_repository.get_voxel_cloud(m, args.voxels)
 
 
 def repl_view_hdf5(handle, args):
@@ -0,0 +1,160 @@
+"""
+Compose connectivity over intermediate cells, e.g. Golgi cells to granule cells via
+the glomeruli, by indexing connection matrices as sparse matrices.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from ..exceptions import ConnectivityError
+from ..functions import group_ranks
+
+
+class ConnectivityMatrix:
+    """
+    Index of a connection matrix in a CSR structure: the connections are grouped by
+    presynaptic cell, so that they can be joined onto and composed with other
+    connectivity. The compartments of the connections are carried along.
+
+    :param connections: Pre- and postsynaptic cell id of each connection.
+    :param compartments: Pre- and postsynaptic compartment id of each connection.
+    """
+
+    def __init__(self, connections, compartments=None):
+        self.connections = np.asarray(connections).reshape(-1, 2)
+        if compartments is not None:
+            compartments = np.asarray(compartments).reshape(-1, 2)
+            if len(compartments) != len(self.connections):
+                raise ConnectivityError(
+                    "{} compartments given for {} connections.".format(
+                        len(compartments), len(self.connections)
+                    )
+                )
+        self.compartments = compartments
+        # Map the cell ids onto the rows and columns of the matrix.
+        self.from_ids, self._rows = np.unique(self.connections[:, 0], return_inverse=True)
+        self.to_ids, self._cols = np.unique(self.connections[:, 1], return_inverse=True)
+        # Sort the connections by row, keeping the order of the connections of a row.
+        self._order = np.argsort(self._rows, kind="stable")
+        self._indptr = np.searchsorted(
+            self._rows[self._order], np.arange(len(self.from_ids) + 1)
+        )
+
+    @classmethod
+    def from_tag(cls, scaffold, tag, compartments=False):
+        """
+        Index the connections of a connection tag of the scaffold.
+
+        :param compartments: Carry the connection compartments of the tag along.
+        :type compartments: bool
+        """
+        try:
+            connections = scaffold.cell_connections_by_tag[tag]
+        except KeyError:
+            raise ConnectivityError(f"Missing the '{tag}' connections.") from None
+        if compartments:
+            try:
+                compartments = scaffold.connection_compartments[tag]
+            except KeyError:
+                raise ConnectivityError(
+                    f"Missing the '{tag}' connection compartments."
+                ) from None
+        else:
+            compartments = None
+        return cls(connections, compartments)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def outgoing(self, ids):
+        """
+        Return the indices of the connections of the given presynaptic cells, in the
+        order of the cells and then of the connections.
+        """
+        return self._gather(*self._slices(ids))[1]
+
+    def join_edges(self, other):
+        """
+        Join the connections of this matrix onto those of another matrix that start
+        from the postsynaptic cells of this matrix.
+
+        :returns: For each path over 2 connections, the index of the first connection
+          in this matrix and of the second connection in the other matrix.
+        :rtype: tuple of numpy.ndarray
+        """
+        return other._gather(*other._slices(self.connections[:, 1]))
+
+    def join(self, other):
+        """
+        Compose this matrix with another matrix into a matrix with a connection for
+        every path over a connection of this matrix and then one of the other matrix.
+        The presynaptic compartments are those of this matrix, the postsynaptic
+        compartments those of the other matrix, or -1 when they are not carried.
+
+        :rtype: :class:`.ConnectivityMatrix`
+        """
+        first, second = self.join_edges(other)
+        connections = np.column_stack(
+            (self.connections[first, 0], other.connections[second, 1])
+        )
+        compartments = None
+        if self.compartments is not None or other.compartments is not None:
+            compartments = np.full((len(first), 2), -1, dtype=int)
+            if self.compartments is not None:
+                compartments[:, 0] = self.compartments[first, 0]
+            if other.compartments is not None:
+                compartments[:, 1] = other.compartments[second, 1]
+        return ConnectivityMatrix(connections, compartments)
+
+    def to_sparse(self):
+        """
+        Return the number of connections between each pair of cells as a sparse
+        matrix with a row per ``from_ids`` and a column per ``to_ids`` cell.
+
+        :rtype: :class:`scipy.sparse.csr_matrix`
+        """
+        return csr_matrix(
+            (np.ones(len(self), dtype=int), (self._rows, self._cols)),
+            shape=(len(self.from_ids), len(self.to_ids)),
+        )
+
+    def compose(self, other):
+        """
+        Count the paths from the presynaptic cells of this matrix over the
+        intermediate cells to the postsynaptic cells of the other matrix, as the
+        product of both sparse matrices.
+
+        :returns: The presynaptic ids, postsynaptic ids and the sparse matrix of path
+          counts between them.
+        """
+        # Align the columns of this matrix with the rows of the other matrix.
+        rows, known = other._rows_of(self.to_ids)
+        align = csr_matrix(
+            (
+                np.ones(np.count_nonzero(known), dtype=int),
+                (np.nonzero(known)[0], rows[known]),
+            ),
+            shape=(len(self.to_ids), len(other.from_ids)),
+        )
+        return self.from_ids, other.to_ids, self.to_sparse() @ align @ other.to_sparse()
+
+    def _rows_of(self, ids):
+        # The row of each cell id, and whether the cell has any connections at all.
+        ids = np.asarray(ids).reshape(-1)
+        if not len(self.from_ids):
+            return np.zeros(len(ids), dtype=int), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.from_ids, ids), len(self.from_ids) - 1)
+        return rows, self.from_ids[rows] == ids
+
+    def _slices(self, ids):
+        # The start and length of the CSR slice of the connections of each cell id.
+        rows, known = self._rows_of(ids)
+        if not len(self.from_ids):
+            return rows, rows
+        starts = self._indptr[rows]
+        return starts, np.where(known, self._indptr[rows + 1] - starts, 0)
+
+    def _gather(self, starts, counts):
+        # Expand the CSR slices into the index of the slice and the connection index.
+        slices = np.repeat(np.arange(len(starts)), counts)
+        positions = np.repeat(starts, counts) + group_ranks(slices)
+        return slices, self._order[positions]
@@ -1,5 +1,6 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ...functions import window_join
 
 
 class ConnectomeAscAxonPurkinje(ConnectionStrategy):
@@ -11,55 +12,46 @@ class ConnectomeAscAxonPurkinje(ConnectionStrategy):
         pass
 
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         granule_cell_type = self.from_cell_types[0]
         purkinje_cell_type = self.to_cell_types[0]
         granules = self.scaffold.cells_by_type[granule_cell_type.name]
         purkinjes = self.scaffold.cells_by_type[purkinje_cell_type.name]
-        first_granule = int(granules[0, 0])
-        OoB_value = (
-            self.scaffold.configuration.X * 1000.0
-        )  # Any arbitrarily large value outside of simulation volume
         purkinje_extension_x = purkinje_cell_type.placement.extension_x
         purkinje_extension_z = purkinje_cell_type.placement.extension_z
+        result = self.connect_ascending_axons(
+            granules, purkinjes, purkinje_extension_x, purkinje_extension_z
+        )
+        self.scaffold.connect_cells(self, result)
 
-        def connectome_aa_pc(first_granule, granules, purkinjes, x_pc, z_pc, OoB_value):
-            aa_pc = np.zeros((0, 2))
-            new_granules = np.copy(granules)
-
-            # for all Purkinje cells: calculate and choose which granules fall into the area of PC dendritic tree, then delete them from successive computations, since 1 ascending axon is connected to only 1 PC
-            for i in purkinjes:
-                # ascending axon falls into the z range of values?
-                bool_vector = (new_granules[:, 4]).__ge__(i[4] - z_pc / 2.0) & (
-                    new_granules[:, 4]
-                ).__le__(i[4] + z_pc / 2.0)
-                # ascending axon falls into the x range of values?
-                bool_vector = bool_vector & (
-                    (new_granules[:, 2]).__ge__(i[2] - x_pc / 2.0)
-                    & (new_granules[:, 2]).__le__(i[2] + x_pc / 2.0)
-                )
-                good_aa = np.where(bool_vector)[
-                    0
-                ]  # finds indexes of ascending axons that, on the selected axis, have the correct sum value
-
-                # construction of the output matrix: the first column has the GrC id, while the second column has the PC id
-                matrix = np.zeros((len(good_aa), 2))
-                matrix[:, 1] = i[0]
-                matrix[:, 0] = good_aa + first_granule
-                aa_pc = np.vstack((aa_pc, matrix))
-
-                new_granules[
-                    good_aa, :
-                ] = OoB_value  # update the granules matrix used for computation by deleting the coordinates of connected ones
-
-            return aa_pc
+    def connect_ascending_axons(self, granules, purkinjes, x_pc, z_pc):
+        """
+        Connect the ascending axon of each granule cell to the first Purkinje cell,
+        in order, whose dendritic tree area of ``x_pc`` by ``z_pc`` it falls into.
 
-        result = connectome_aa_pc(
-            first_granule,
-            granules,
-            purkinjes,
-            purkinje_extension_x,
-            purkinje_extension_z,
-            OoB_value,
+        :returns: The granule cell and Purkinje cell id of each connection.
+        """
+        # Ascending axon falls into the x range of values?
+        pairs = window_join(
+            granules[:, 2], purkinjes[:, 2] - x_pc / 2.0, purkinjes[:, 2] + x_pc / 2.0
         )
-        self.scaffold.connect_cells(self, result)
+        grc, pc = pairs[:, 0], pairs[:, 1]
+        # Ascending axon falls into the z range of values?
+        good = np.absolute(granules[grc, 4] - purkinjes[pc, 4]) <= z_pc / 2.0
+        grc, pc = grc[good], pc[good]
+        order = np.lexsort((grc, pc))
+        grc, pc = grc[order], pc[order]
+        bounds = np.searchsorted(pc, np.arange(len(purkinjes) + 1))
+        # Purkinje cells take turns, so that an ascending axon connects to only 1 PC.
+        taken = np.zeros(len(granules), dtype=bool)
+        connections = []
+        for p in range(len(purkinjes)):
+            candidates = grc[bounds[p] : bounds[p + 1]]
+            chosen = candidates[~taken[candidates]]
+            taken[chosen] = True
+            connections.append(
+                np.column_stack(
+                    (granules[chosen, 0], np.full(len(chosen), purkinjes[p, 0]))
+                )
+            )
+        return np.concatenate(connections + [np.empty((0, 2))])
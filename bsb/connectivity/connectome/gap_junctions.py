@@ -1,5 +1,6 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ...functions import query_radius_pairs, group_ranks
 
 
 class ConnectomeGapJunctions(ConnectionStrategy):
@@ -15,65 +16,47 @@ class ConnectomeGapJunctions(ConnectionStrategy):
         pass
 
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         from_cell_type = self.from_cell_types[0]
         from_cells = self.scaffold.cells_by_type[from_cell_type.name]
-        first_cell = int(from_cells[0, 0])
-        limit_xy = self.limit_xy
-        limit_z = self.limit_z
-        divergence = self.divergence
-
-        def gap_junctions(cells, d_xy, d_z, dc_gj):
-            gj_sc = np.zeros((cells.shape[0] * dc_gj, 2))
-            gj_i = 0
-            cells_x = cells[:, 2]
-            cells_y = cells[:, 3]
-            cells_z = cells[:, 4]
-
-            for (
-                id,
-                type,
-                x,
-                y,
-                z,
-            ) in (
-                cells
-            ):  # for each stellate cell calculate the distance with every other cell of the same type in the volume, then choose 4 of them
-
-                idx = 1
-
-                # find all cells that satisfy the distance condition
-                constraint_vector = (
-                    (np.absolute(cells_z - z)).__lt__(d_z)
-                    & (np.absolute(cells_z - z)).__ne__(0)
-                    & (np.sqrt((cells_x - x) ** 2 + (cells_y - y) ** 2)).__lt__(d_xy)
-                )
-                good_sc = np.where(constraint_vector)[
-                    0
-                ]  # indexes of stellate cells that can potentially be connected
-                chosen_rand = np.random.permutation(good_sc)
-                candidates = cells[chosen_rand]
-
-                for j in candidates:
-
-                    if idx <= dc_gj:
-
-                        ra = np.random.random()
-                        if (ra).__gt__((np.absolute(j[4] - z)) / float(d_z)) & (
-                            ra
-                        ).__gt__(
-                            (np.sqrt((j[2] - x) ** 2 + (j[3] - y) ** 2)) / float(d_xy)
-                        ):
-                            idx += 1
-                            gj_sc[gj_i, 0] = id
-                            gj_sc[gj_i, 1] = j[0]
-                            gj_i += 1
-
-            return gj_sc[0:gj_i]
-
-        result = gap_junctions(from_cells, limit_xy, limit_z, divergence)
+        result = self.connect_gap_junctions(
+            self.get_cell_tree(from_cell_type),
+            from_cells,
+            self.limit_xy,
+            self.limit_z,
+            self.divergence,
+        )
         self.scaffold.connect_cells(self, result)
 
+    def connect_gap_junctions(self, tree, cells, d_xy, d_z, dc_gj):
+        """
+        Connect each cell to at most ``dc_gj`` randomly visited cells within ``d_z``
+        vertically (but not at the same height) and ``d_xy`` horizontally. Each
+        candidate is accepted with a probability that decreases with its distance.
+
+        :param tree: Tree of the cell positions.
+        :type tree: :class:`sklearn.neighbors.KDTree`
+        :returns: The pre- and postsynaptic cell id of each gap junction.
+        """
+        # The cylinder of candidates fits in a sphere of this radius.
+        pre, post = query_radius_pairs(tree, cells[:, 2:5], np.sqrt(d_xy ** 2 + d_z ** 2))
+        dz = np.absolute(cells[post, 4] - cells[pre, 4])
+        dxy = np.sqrt(
+            (cells[post, 2] - cells[pre, 2]) ** 2 + (cells[post, 3] - cells[pre, 3]) ** 2
+        )
+        # find all cells that satisfy the distance condition
+        good = (dz < d_z) & (dz != 0) & (dxy < d_xy)
+        pre, post, dz, dxy = pre[good], post[good], dz[good], dxy[good]
+        # Visit the candidates of each cell in a random order and accept them with a
+        # probability that decreases with distance, until `dc_gj` are accepted.
+        visit = np.lexsort((np.random.random(len(pre)), pre))
+        pre, post, dz, dxy = pre[visit], post[visit], dz[visit], dxy[visit]
+        ra = np.random.random(len(pre))
+        accepted = (ra > dz / float(d_z)) & (ra > dxy / float(d_xy))
+        pre, post = pre[accepted], post[accepted]
+        chosen = group_ranks(pre) < dc_gj
+        return np.column_stack((cells[pre[chosen], 0], cells[post[chosen], 0]))
+
 
 class ConnectomeGapJunctionsGolgi(ConnectionStrategy):
     """
@@ -84,54 +67,32 @@ class ConnectomeGapJunctionsGolgi(ConnectionStrategy):
         pass
 
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         golgi_cell_type = self.from_cell_types[0]
         golgis = self.scaffold.cells_by_type[golgi_cell_type.name]
-        first_golgi = int(golgis[0, 0])
         r_goc_vol = golgi_cell_type.morphology.dendrite_radius
-        GoCaxon_x = golgi_cell_type.morphology.axon_x
-        GoCaxon_y = golgi_cell_type.morphology.axon_y
-        GoCaxon_z = golgi_cell_type.morphology.axon_z
-
-        def connectome_gj_goc(
-            r_goc_vol, GoCaxon_x, GoCaxon_y, GoCaxon_z, golgicells, first_golgi
-        ):
-            gj_goc = np.zeros((golgis.shape[0] ** 2, 2))
-            start_index = 0
-            golgi_x = golgicells[:, 2]
-            golgi_y = golgicells[:, 3]
-            golgi_z = golgicells[:, 4]
-            self_index = 0
-            for (
-                i
-            ) in (
-                golgicells
-            ):  # for each Golgi find all cells of the same type that, through their dendritic tree, fall into its axonal tree
-
-                bool_vector = (np.absolute(golgi_x - i[2])).__le__(
-                    r_goc_vol + (GoCaxon_x / 2.0)
-                )
-                bool_vector[self_index] = False  # Don't connect a golgi cell to itself
-                bool_vector = bool_vector & (np.absolute(golgi_y - i[3])).__le__(
-                    r_goc_vol + (GoCaxon_y / 2.0)
-                )
-                bool_vector = bool_vector & (np.absolute(golgi_z - i[4])).__le__(
-                    r_goc_vol + (GoCaxon_z / 2.0)
-                )
-
-                good_goc = np.where(bool_vector)[
-                    0
-                ]  # finds indexes of Golgi cells that satisfy all conditions
-
-                end_index = start_index + len(good_goc)
-                gj_goc[start_index:end_index, 0] = i[0]
-                gj_goc[start_index:end_index, 1] = golgicells[good_goc][:, 0]
-                start_index = end_index
-                self_index += 1
-
-            return gj_goc[0:end_index]
-
-        result = connectome_gj_goc(
-            r_goc_vol, GoCaxon_x, GoCaxon_y, GoCaxon_z, golgis, first_golgi
-        )
+        # Half the size of the box around each Golgi cell axon that the dendrites of the
+        # other Golgi cells must reach into.
+        morphology = golgi_cell_type.morphology
+        axon = np.array([morphology.axon_x, morphology.axon_y, morphology.axon_z])
+        box = r_goc_vol + axon / 2.0
+        result = self.connect_golgi(self.get_cell_tree(golgi_cell_type), golgis, box)
         self.scaffold.connect_cells(self, result)
+
+    def connect_golgi(self, tree, golgis, box):
+        """
+        Connect each Golgi cell to all other Golgi cells in the box around it.
+
+        :param tree: Tree of the Golgi cell positions.
+        :type tree: :class:`sklearn.neighbors.KDTree`
+        :param box: Half the size of the box along each axis.
+        :returns: The pre- and postsynaptic cell id of each gap junction.
+        """
+        # The box fits in a sphere with a radius of the half diagonal.
+        pre, post = query_radius_pairs(tree, golgis[:, 2:5], np.linalg.norm(box))
+        # Don't connect a golgi cell to itself
+        inside = np.all(np.absolute(golgis[post, 2:5] - golgis[pre, 2:5]) <= box, axis=1)
+        inside &= pre != post
+        pre, post = pre[inside], post[inside]
+        order = np.lexsort((post, pre))
+        return np.column_stack((golgis[pre[order], 0], golgis[post[order], 0]))
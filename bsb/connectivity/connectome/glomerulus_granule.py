@@ -1,6 +1,7 @@
 import numpy as np, random
 from ..strategy import ConnectionStrategy
 from ...exceptions import ConfigurationError, ConnectivityError
+from ...functions import query_radius_pairs, group_ranks
 
 
 class ConnectomeGlomerulusGranule(ConnectionStrategy):
@@ -34,75 +35,66 @@ class ConnectomeGlomerulusGranule(ConnectionStrategy):
             self.dendritic_claws = [c.id for c in dendrites.values()]
             self.morphology = morphology
 
+    def connect_glomeruli(
+        self, tree, glomeruli, granules, dend_len, n_conn_glom, mf_to_glom
+    ):
+        """
+        Connect each granule cell to at most ``n_conn_glom`` of the closest glomeruli
+        within its dendrite length, with at most one glomerulus per mossy fibre.
+
+        :param tree: Tree of the glomerulus positions.
+        :type tree: :class:`sklearn.neighbors.KDTree`
+        :param mf_to_glom: Mossy fibre to glomerulus connections.
+        :returns: Glomerulus and granule cell id of each connection.
+        """
+        # Find all glomeruli within the dendrite length of each granule cell.
+        grc, glom = query_radius_pairs(tree, granules[:, 2:5], dend_len)
+        distance = (
+            np.sum((glomeruli[glom, 2:5] - granules[grc, 2:5]) ** 2, axis=1)
+            - dend_len ** 2
+        )
+        within = distance < 0.0
+        grc, glom, distance = grc[within], glom[within], distance[within]
+        # Look up the mossy fibre of each candidate glomerulus.
+        mf_to_glom = np.array(mf_to_glom).reshape(-1, 2)
+        by_glom = np.argsort(mf_to_glom[:, 1], kind="stable")
+        glom_ids = glomeruli[glom, 0]
+        found = np.searchsorted(mf_to_glom[by_glom, 1], glom_ids, side="right") - 1
+        if np.any(found < 0) or np.any(mf_to_glom[by_glom[found], 1] != glom_ids):
+            raise ConnectivityError(
+                "Attempt to connect a glomerulus without a mossy fibre."
+            )
+        mf = mf_to_glom[by_glom[found], 0]
+        # Visit the candidates of each granule cell in a random order, and keep the
+        # first glomerulus of each mossy fibre.
+        visit = np.lexsort((np.random.random(len(grc)), grc))
+        visit = visit[np.lexsort((mf[visit], grc[visit]))]
+        first = np.ones(len(visit), dtype=bool)
+        first[1:] = (np.diff(grc[visit]) != 0) | (np.diff(mf[visit]) != 0)
+        candidates = visit[first]
+        # Select the closest candidates, if there are more than enough of them.
+        candidates = candidates[np.lexsort((distance[candidates], grc[candidates]))]
+        candidates = candidates[group_ranks(grc[candidates]) < n_conn_glom]
+        return np.column_stack(
+            (glomeruli[glom[candidates], 0], granules[grc[candidates], 0])
+        )
+
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         from_cell_type = self.from_cell_types[0]
         to_cell_type = self.to_cell_types[0]
         glomeruli = self.scaffold.cells_by_type[from_cell_type.name]
         granules = self.scaffold.cells_by_type[to_cell_type.name]
         dend_len = to_cell_type.morphology.dendrite_length
         n_conn_glom = self.convergence
-        first_glomerulus = int(glomeruli[0, 0])
         mf_to_glom = self.scaffold.cell_connections_by_tag["mossy_to_glomerulus"]
-        glom_mf_map = {v: k for k, v in mf_to_glom}
-
-        def connectome_glom_grc(
-            first_glomerulus, glomeruli, granules, dend_len, n_conn_glom
-        ):
-            """
-            Legacy code block to connect glomeruli to granule cells
-            """
-            glom_x = glomeruli[:, 2]
-            glom_y = glomeruli[:, 3]
-            glom_z = glomeruli[:, 4]
-            results = np.empty((granules.shape[0] * n_conn_glom, 2))
-            next_index = 0
-            # Find glomeruli to connect to each granule cell
-            for gran_id, gran_type, gran_x, gran_y, gran_z in granules:
-                # Use a naive approach to find all glomeruli at a maximum distance of `dendrite_length`
-                distance_vector = (
-                    ((glom_x - gran_x) ** 2)
-                    + ((glom_y - gran_y) ** 2)
-                    + ((glom_z - gran_z) ** 2)
-                    - (dend_len ** 2)
-                )
-                # Indices of glomeruli that can potentially be connected
-                good_gloms = np.where((distance_vector < 0.0) == True)[0]
-                had_mf = set()
-                candidates = []
-                for g in np.random.permutation(good_gloms):
-                    mf = glom_mf_map[g + first_glomerulus]
-                    if mf in had_mf:
-                        continue
-                    had_mf.add(mf)
-                    candidates.append(g)
-                good_gloms = np.array(candidates)
-                good_gloms_len = len(good_gloms)
-                # Do we find more than enough candidates?
-                if good_gloms_len > n_conn_glom:  # Yes: select the closest ones
-                    # Get the distances of the glomeruli within range
-                    gloms_distance = distance_vector[good_gloms]
-                    # Sort the good glomerulus id vector by the good glomerulus distance vector
-                    connected_gloms = good_gloms[gloms_distance.argsort()]
-                    connected_glom_len = n_conn_glom
-                else:  # No: select all of them
-                    connected_gloms = good_gloms
-                    connected_glom_len = good_gloms_len
-                # Connect the selected glomeruli to the current gran_id
-                for i in range(connected_glom_len):
-                    # Add the first_glomerulus id to convert their local id to their real simulation id
-                    results[next_index + i] = [
-                        connected_gloms[i] + first_glomerulus,
-                        gran_id,
-                    ]
-                # Move up the internal array pointer
-                next_index += connected_glom_len
-            # Truncate the pre-allocated array to the internal array pointer.
-            return results[:next_index, :]
-
-        # Execute legacy code and add the connection matrix it returns to the scaffold.
-        connectome = connectome_glom_grc(
-            first_glomerulus, glomeruli, granules, dend_len, n_conn_glom
+        connectome = self.connect_glomeruli(
+            self.get_cell_tree(from_cell_type),
+            glomeruli,
+            granules,
+            dend_len,
+            n_conn_glom,
+            mf_to_glom,
         )
         if self.detailed:
             # Add morphology & compartment information
@@ -1,5 +1,6 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ...functions import window_join
 
 
 class ConnectomeGolgiGlomerulus(ConnectionStrategy):
@@ -14,104 +15,72 @@ class ConnectomeGolgiGlomerulus(ConnectionStrategy):
         pass
 
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         golgi_cell_type = self.from_cell_types[0]
         glomerulus_cell_type = self.to_cell_types[0]
         glomeruli = self.scaffold.cells_by_type[glomerulus_cell_type.name]
         golgis = self.scaffold.cells_by_type[golgi_cell_type.name]
-        first_glomerulus = int(glomeruli[0, 0])
-        GoCaxon_x = golgi_cell_type.morphology.axon_x
-        GoCaxon_y = golgi_cell_type.morphology.axon_y
-        GoCaxon_z = golgi_cell_type.morphology.axon_z
+        axon = np.array(
+            [
+                golgi_cell_type.morphology.axon_x,
+                golgi_cell_type.morphology.axon_y,
+                golgi_cell_type.morphology.axon_z,
+            ]
+        )
         r_glom = glomerulus_cell_type.placement.radius
         n_conn_goc = self.divergence
         layer_thickness = self.scaffold.configuration.get_layer(
             name=golgi_cell_type.placement.layer
         ).thickness
-        # An arbitrarily large value that will be used to exclude cells from geometric constraints
-        oob = self.scaffold.configuration.X * 1000.0
-
-        def connectome_goc_glom(
-            first_glomerulus,
-            glomeruli,
-            golgicells,
-            GoCaxon_x,
-            GoCaxon_y,
-            GoCaxon_z,
-            r_glom,
-            n_conn_goc,
-            layer_thickness,
-            oob,
-        ):
-            glom_x = glomeruli[:, 2]
-            glom_y = glomeruli[:, 3]
-            glom_z = glomeruli[:, 4]
-            new_glomeruli = np.copy(glomeruli)
-            new_golgicells = np.random.permutation(golgicells)
-            connections = np.zeros((golgis.shape[0] * n_conn_goc, 2))
-            new_connection_index = 0
-
-            # for all Golgi cells: calculate which glomeruli fall into the area of GoC
-            # axon, then choose 40 of them for the connection and delete them from
-            # successive computations, since 1 glomerulus must be connected to only 1 GoC
-            for golgi_id, golgi_type, golgi_x, golgi_y, golgi_z in new_golgicells:
-                # Check geometrical constraints
-                # glomerulus falls into the x range of values?
-                bool_vector = ((glom_x + r_glom).__ge__(golgi_x - GoCaxon_x / 2.0)) & (
-                    (glom_x - r_glom).__le__(golgi_x + GoCaxon_x / 2.0)
-                )
-                # glomerulus falls into the y range of values?
-                bool_vector = bool_vector & (
-                    ((glom_y + r_glom) > (golgi_y - GoCaxon_y / 2.0))
-                    & ((glom_y - r_glom) < (golgi_y + GoCaxon_y / 2.0))
-                )
-                # glomerulus falls into the z range of values?
-                bool_vector = bool_vector & (
-                    ((glom_z + r_glom).__ge__(golgi_z - GoCaxon_z / 2.0))
-                    & ((glom_z - r_glom).__le__(golgi_z + GoCaxon_z / 2.0))
-                )
-
-                # Make a permutation of all candidate glomeruli
-                good_gloms = np.where(bool_vector)[0]
-                chosen_rand = np.random.permutation(good_gloms)
-                good_gloms_matrix = new_glomeruli[chosen_rand]
-                # Calculate the distance between the golgi cell and all glomerulus candidates, normalize distance by layer thickness
-                normalized_distance_vector = (
-                    np.sqrt(
-                        (good_gloms_matrix[:, 2] - golgi_x) ** 2
-                        + (good_gloms_matrix[:, 3] - golgi_y) ** 2
-                    )
-                    / layer_thickness
-                )
-                sorting_map = normalized_distance_vector.argsort()
-                # Sort the candidate glomerulus matrix and distance vector by the distance vector
-                good_gloms_matrix = good_gloms_matrix[sorting_map]
-                # Use the normalized distance vector as a probability treshold for connecting glomeruli
-                probability_treshold = normalized_distance_vector[sorting_map]
+        result = self.connect_glomeruli(
+            golgis, glomeruli, axon, r_glom, n_conn_goc, layer_thickness
+        )
+        self.scaffold.connect_cells(self, result)
 
-                idx = 1
-                for candidate_index, glomerulus in enumerate(good_gloms_matrix):
-                    if idx <= n_conn_goc:
-                        ra = np.random.random()
-                        if ra.__gt__(probability_treshold[candidate_index]):
-                            glomerulus_id = glomerulus[0]
-                            connections[new_connection_index, 0] = golgi_id
-                            connections[new_connection_index, 1] = glomerulus_id
-                            new_glomeruli[int(glomerulus_id - first_glomerulus), :] = oob
-                            new_connection_index += 1
-                            idx += 1
-            return connections[0:new_connection_index]
+    def connect_glomeruli(
+        self, golgis, glomeruli, axon, r_glom, n_conn_goc, layer_thickness
+    ):
+        """
+        Connect each Golgi cell, in a random order, to at most ``n_conn_goc`` of the
+        glomeruli that fall into the area of its axon, preferring nearby glomeruli. A
+        glomerulus is connected to only 1 Golgi cell.
 
-        result = connectome_goc_glom(
-            first_glomerulus,
-            glomeruli,
-            golgis,
-            GoCaxon_x,
-            GoCaxon_y,
-            GoCaxon_z,
-            r_glom,
-            n_conn_goc,
-            layer_thickness,
-            oob,
+        :param axon: Size of the axon along each axis.
+        :returns: The Golgi cell and glomerulus id of each connection.
+        """
+        reach = axon / 2.0 + r_glom
+        # Check geometrical constraints: glomerulus falls into the x range of values?
+        pairs = window_join(
+            glomeruli[:, 2], golgis[:, 2] - reach[0], golgis[:, 2] + reach[0]
         )
-        self.scaffold.connect_cells(self, result)
+        glom, golgi = pairs[:, 0], pairs[:, 1]
+        offset = np.absolute(glomeruli[glom, 2:5] - golgis[golgi, 2:5])
+        # glomerulus falls into the y and z range of values?
+        good = (offset[:, 1] < reach[1]) & (offset[:, 2] <= reach[2])
+        glom, golgi, offset = glom[good], golgi[good], offset[good]
+        # Calculate the distance between the golgi cell and all glomerulus candidates,
+        # normalized by layer thickness, and use it as a probability treshold for
+        # connecting glomeruli
+        normalized_distance = np.sqrt(offset[:, 0] ** 2 + offset[:, 1] ** 2) / (
+            layer_thickness
+        )
+        # Sort the candidates of each Golgi cell by distance, in a random order for
+        # candidates at the same distance.
+        order = np.lexsort((np.random.random(len(glom)), normalized_distance, golgi))
+        glom, golgi = glom[order], golgi[order]
+        accepted = np.random.random(len(glom)) > normalized_distance[order]
+        glom, golgi = glom[accepted], golgi[accepted]
+        bounds = np.searchsorted(golgi, np.arange(len(golgis) + 1))
+        # Golgi cells take turns, so that a glomerulus connects to only 1 Golgi cell.
+        taken = np.zeros(len(glomeruli), dtype=bool)
+        connections = []
+        for g in np.random.permutation(len(golgis)):
+            candidates = glom[bounds[g] : bounds[g + 1]]
+            chosen = candidates[~taken[candidates]][:n_conn_goc]
+            taken[chosen] = True
+            connections.append(
+                np.column_stack(
+                    (np.full(len(chosen), golgis[g, 0]), glomeruli[chosen, 0])
+                )
+            )
+        return np.concatenate(connections + [np.empty((0, 2))])
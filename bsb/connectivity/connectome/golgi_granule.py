@@ -1,5 +1,7 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ..composition import ConnectivityMatrix
+from ...exceptions import ConfigurationError
 
 
 class ConnectomeGolgiGranule(ConnectionStrategy):
@@ -29,71 +31,20 @@ class ConnectomeGolgiGranule(ConnectionStrategy):
             self.morphology = morphology
 
     def connect(self):
-        # Gather information for the legacy code block below.
-        glom_grc = self.scaffold.cell_connections_by_tag["glomerulus_to_granule"]
-        glom_ids = self.scaffold.get_placement_set("glomerulus").identifiers
-        goc_glom = self.scaffold.cell_connections_by_tag["golgi_to_glomerulus"]
-        golgi_type = self.from_cell_types[0]
-        golgis = self.scaffold.cells_by_type[golgi_type.name]
-        if self.detailed:
-            # Fetch the connection compartments of glomerulus to granule connections.
-            try:
-                glom_grc_compartments = self.scaffold.connection_compartments[
-                    "glomerulus_to_granule"
-                ]
-            except KeyError:
-                raise RuntimeError(
-                    "Missing the glomerulus to granule connection compartments."
-                )
-        # Index the glom to granule dense matrix to an adjacency list
-        glom_target_map = {gid: [] for gid in glom_ids}
-        for glom, grc in glom_grc:
-            glom_target_map[glom].append(grc)
-
-        if self.detailed:
-            # Lookup the grc compartments associated with each glom-grc conn
-            glom_comp_map = {gid: [] for gid in glom_ids}
-            for i, glom in enumerate(glom_grc[:, 0]):
-                glom_comp_map[glom].append(glom_grc_compartments[i, 1])
-
-        # Lookup the grc targets of each golgi-glom in the order they appear.
-        grc_via_glom = np.vectorize(glom_target_map.get, otypes=[np.ndarray])(
-            goc_glom[:, 1]
+        # Compose the Golgi to glomerulus connections with the glomerulus to granule
+        # connections: each Golgi cell connects to the granule cells of its glomeruli.
+        goc_glom = ConnectivityMatrix.from_tag(self.scaffold, "golgi_to_glomerulus")
+        glom_grc = ConnectivityMatrix.from_tag(
+            self.scaffold, "glomerulus_to_granule", compartments=self.detailed
         )
+        goc_grc = goc_glom.join(glom_grc)
+        connections = goc_grc.connections
 
         if self.detailed:
-            comp_via_glom = np.vectorize(glom_comp_map.get, otypes=[np.ndarray])(
-                goc_glom[:, 1]
-            )
-
-        # Sum the targets to preallocate total size
-        malloc = sum(map(len, grc_via_glom))
-        connections = np.empty((malloc, 2))
-        ptr = 0
-        # Iterate over the golgis and their grc targets (as lookup up in order
-        # via the gloms) and fill them into the connections array
-        for goc, grcs in zip(goc_glom[:, 0], grc_via_glom):
-            s = len(grcs)
-            if not s:
-                # Skip any weird slicing of empty target sets
-                continue
-            connections[ptr : (ptr + s), 0] = goc
-            connections[ptr : (ptr + s), 1] = grcs
-            ptr += s
-
-        if self.detailed:
-            compartments = np.empty((malloc, 2))
+            # The glom associated dendrites are carried along by the composition.
+            compartments = goc_grc.compartments
             # Assign random axonal segments
-            compartments[:, 0] = np.random.choice(self.axon, malloc)
-            ptr = 0
-            # Assign the glom associated dendrites
-            for comps in comp_via_glom:
-                s = len(comps)
-                if not s:
-                    # Skip any weird slicing of empty target sets
-                    continue
-                compartments[ptr : (ptr + s), 1] = comps
-                ptr += s
+            compartments[:, 0] = np.random.choice(self.axon, len(compartments))
             # Make a bad map ignoring all but the first (only) morphologies
             # of each type. Sorry future me <3
             morpho_map = [
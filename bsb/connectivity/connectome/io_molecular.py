@@ -1,5 +1,6 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ..composition import ConnectivityMatrix
 
 
 class ConnectomeIOMolecular(ConnectionStrategy):
@@ -48,34 +49,10 @@ class ConnectomeIOMolecular(ConnectionStrategy):
             return
         io_to_common_matrix = cache[1]
 
-        # Make a dictionary of which Purkinje cell is contacted by which molecular cells.
-        purkinje_dict = {}
-        for conn in range(len(mli_to_common_matrix)):
-            purkinje_id = mli_to_common_matrix[conn][1]
-            if not purkinje_id in purkinje_dict:
-                purkinje_dict[purkinje_id] = []
-            purkinje_dict[purkinje_id].append(mli_to_common_matrix[conn][0])
-
-        # Use the above dictionary to connect each IO cell to the molecular cells that
+        # Join the IO to Purkinje connections onto the transposed molecular layer to
+        # Purkinje connections: each IO cell connects to the molecular cells that
         # contact the Purkinje cells this IO cell contacts.
-        io_molecular = []
-        # Loop over all IO-Purkinje connections
-        for io_conn in range(len(io_to_common_matrix)):
-            io_id = io_to_common_matrix[io_conn][0]
-            purkinje_id = io_to_common_matrix[io_conn][1]
-            # No molecular cells contact this Purkinje cell
-            if not purkinje_id in purkinje_dict:
-                continue
-            target_molecular_cells = purkinje_dict[purkinje_id]
-            # Make a matrix that connects this IO cell to the target molecular cells
-            matrix = np.column_stack(
-                (
-                    np.repeat(io_id, len(target_molecular_cells)),
-                    target_molecular_cells,
-                )
-            )
-            # Add the matrix to the output dataset.
-            io_molecular.extend(matrix)
+        common_to_mli = ConnectivityMatrix(np.asarray(mli_to_common_matrix)[:, ::-1])
+        io_molecular = ConnectivityMatrix(io_to_common_matrix).join(common_to_mli)
         # Store the connections.
-        results = np.array(io_molecular or np.empty((0, 2)))
-        self.scaffold.connect_cells(self, results)
+        self.scaffold.connect_cells(self, io_molecular.connections)
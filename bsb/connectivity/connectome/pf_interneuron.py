@@ -1,5 +1,6 @@
 import numpy as np
 from ..strategy import ConnectionStrategy
+from ...functions import window_join
 
 
 class ConnectomePFInterneuron(ConnectionStrategy):
@@ -11,36 +12,27 @@ class ConnectomePFInterneuron(ConnectionStrategy):
         pass
 
     def connect(self):
-        # Gather information for the legacy code block below.
+        # Gather information for the connectome.
         granule_cell_type = self.from_cell_types[0]
         interneuron_cell_type = self.to_cell_types[0]
         granules = self.scaffold.cells_by_type[granule_cell_type.name]
         interneurons = self.scaffold.cells_by_type[interneuron_cell_type.name]
-        first_granule = int(granules[0, 0])
         dendrite_radius = interneuron_cell_type.morphology.dendrite_radius
         # Spoof fixed pf height of 150 µm
         pf_heights = 150 + granules[:, 3]
-
-        def connectome_pf_inter(first_granule, interneurons, granules, r_sb, h_pf):
-            pf_interneuron = np.zeros((0, 2))
-            # for each interneuron find all the parallel fibers that fall into the sphere with centre the cell soma and appropriate radius
-            for i in interneurons:
-
-                # find all cells that satisfy the condition
-                interneuron_matrix = (
-                    ((granules[:, 2] - i[2]) ** 2) + ((h_pf - i[3]) ** 2) - (r_sb ** 2)
-                ).__le__(0)
-                # indexes of interneurons that can potentially be connected
-                good_pf = np.where(interneuron_matrix)[0]
-
-                matrix = np.zeros((len(good_pf), 2))
-                matrix[:, 1] = i[0]
-                matrix[:, 0] = good_pf + first_granule
-                pf_interneuron = np.vstack((pf_interneuron, matrix))
-
-            return pf_interneuron
-
-        result = connectome_pf_inter(
-            first_granule, interneurons, granules, dendrite_radius, pf_heights
+        # For each interneuron find all the parallel fibers that fall into the sphere
+        # with centre the cell soma and appropriate radius: first those in its x range.
+        pairs = window_join(
+            granules[:, 2],
+            interneurons[:, 2] - dendrite_radius,
+            interneurons[:, 2] + dendrite_radius,
         )
+        pf, inter = pairs[:, 0], pairs[:, 1]
+        good_pf = (
+            (granules[pf, 2] - interneurons[inter, 2]) ** 2
+            + (pf_heights[pf] - interneurons[inter, 3]) ** 2
+            - dendrite_radius ** 2
+        ) <= 0
+        pf, inter = pf[good_pf], inter[good_pf]
+        result = np.column_stack((granules[pf, 0], interneurons[inter, 0]))
         self.scaffold.connect_cells(self, result)
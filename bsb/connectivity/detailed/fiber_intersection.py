@@ -1,12 +1,12 @@
 import numpy as np
 import math
-from ..strategy import ConnectionStrategy
+from ..strategy import ConnectionStrategy, ParallelStrategy
 from .shared import MorphologyStrategy
 from ...helpers import DistributionConfiguration
 from ...models import MorphologySet
 from ...exceptions import *
 from ...helpers import ConfigurableClass
-from ...networks import FiberMorphology, Branch
+from ...networks import FiberMorphology, flatten_branches
 from ...plotting import plot_fiber_morphology
 from ...reporting import report, warn
 import abc
@@ -16,7 +16,7 @@ from rtree import index
 from rtree.index import Rtree
 
 
-class FiberIntersection(ConnectionStrategy, MorphologyStrategy):
+class FiberIntersection(ConnectionStrategy, MorphologyStrategy, ParallelStrategy):
     """
     FiberIntersection connection strategies voxelize a fiber and find its intersections with postsynaptic cells.
     It's a specific case of VoxelIntersection.
@@ -34,6 +34,7 @@ class FiberIntersection(ConnectionStrategy, MorphologyStrategy):
     """
 
     casts = {
+        **ParallelStrategy.casts,
         "affinity": float,
         "contacts": DistributionConfiguration.cast,
         "resolution": float,
@@ -41,6 +42,7 @@ class FiberIntersection(ConnectionStrategy, MorphologyStrategy):
     }
 
     defaults = {
+        **ParallelStrategy.defaults,
         "affinity": 1.0,
         "contacts": DistributionConfiguration.cast(1),
         "resolution": 20.0,
@@ -93,173 +95,183 @@ class FiberIntersection(ConnectionStrategy, MorphologyStrategy):
             to_box = morphology.cloud.get_voxel_box()
             to_cell_tree.insert(i, tuple(to_box + to_offset))
 
-        connections_out = []
-        compartments_out = []
-        morphologies_out = []
-
         fig = None
-        fiber_cut_num = 0
-        for c, (from_cell, from_morpho) in enumerate(from_morphology_set):
-            # (1) Extract the FiberMorpho object for each branch in the from_compartments
-            # of the presynaptic morphology
-            compartments = from_morpho.get_compartments(from_compartments)
-            morpho_rotation = from_cell.rotation
-            fm = FiberMorphology(compartments, morpho_rotation)
-
-            # (2) Interpolate all branches recursively
-            self.interpolate_branches(fm.root_branches)
-
-            if c in self.to_plot:
-                fig = plot_fiber_morphology(
-                    fm, fig=fig, offset=from_cell.position, show=False
-                )
+        # Fibers are built once per morphology, and copied for each cell.
+        fibers = {}
+
+        def intersect(presynaptic):
+            nonlocal fig
+            connections_out = []
+            compartments_out = []
+            morphologies_out = []
+            fiber_cut_num = 0
+            cells = [from_morphology_set[c] for c in presynaptic]
+            fms = []
+            for c, (from_cell, from_morpho) in zip(presynaptic, cells):
+                # (1) Extract the FiberMorpho object for each branch in the from_compartments
+                # of the presynaptic morphology
+                if from_morpho._set_index not in fibers:
+                    compartments = from_morpho.get_compartments(from_compartments)
+                    fibers[from_morpho._set_index] = FiberMorphology(compartments, None)
+                fm = fibers[from_morpho._set_index].copy()
+                fm.orient(from_cell.rotation)
+
+                # (2) Interpolate all branches recursively
+                self.interpolate_branches(fm.root_branches)
+
+                if c in self.to_plot:
+                    fig = plot_fiber_morphology(
+                        fm, fig=fig, offset=from_cell.position, show=False
+                    )
+                fms.append(fm)
 
-            # (3) Transform the fiber if present.
-            # It requires the from_cell position that will be
+            # (3) Transform the fibers if present, all at once.
+            # It requires the from_cell positions that will be
             # used for example in QuiverTransform to get the orientation value
             # in the voxel where the cell is located, while still keeping the
             # morphology in its local reference frame.
-            if self.transformation is not None:
-                self.transformation.transform_branches(
-                    fm.root_branches, from_cell.position
+            if self.transformation is not None and fms:
+                cut_branches = self.transformation.transform_fibers(
+                    fms, [from_cell.position for from_cell, _ in cells]
                 )
-                if self.transformation._branch_cut_num > 0:
-                    fiber_cut_num += 1
-
-            if c in self.to_plot:
-                fig = plot_fiber_morphology(fm, fig=fig, offset=from_cell.position)
-
-            # (4) Interpolate again
-            self.interpolate_branches(fm.root_branches)
-
-            # (5) Voxelize all branches of the transformed fiber morphology
-            p = index.Property(dimension=3)
-            # The bounding box is incrementally expanded, these initial bounds are a point
-            # at the start of the first root branch.
-            from_bounding_box = [
-                fm.root_branches[0]._compartments[0].start + from_cell.position
-            ] * 2
-            from_voxel_tree = index.Index(properties=p)
-            from_map = []
-            (
-                from_bounding_box,
-                from_voxel_tree,
-                from_map,
-                voxel_list,
-            ) = self.voxelize_branches(
-                fm.root_branches,
-                from_cell.position,
-                from_bounding_box,
-                from_voxel_tree,
-                from_map,
-            )
+                fiber_cut_num += np.count_nonzero(cut_branches)
 
-            # (6) Check for intersections of the postsyn tree with the bounding box
+            for c, (from_cell, from_morpho), fm in zip(presynaptic, cells, fms):
+                if c in self.to_plot:
+                    fig = plot_fiber_morphology(fm, fig=fig, offset=from_cell.position)
 
-            ## TODO: Check if bounding box intersection is convenient
+                # (4) Interpolate again
+                self.interpolate_branches(fm.root_branches)
 
-            # Bounding box intersection to identify possible connected candidates, using
-            # the bounding box of the point cloud. Query the Rtree for intersections of
-            # to_cell boxes with our from_cell box
-            cell_intersections = list(
-                to_cell_tree.intersection(
-                    tuple(np.concatenate(from_bounding_box)), objects=False
+                # (5) Voxelize all branches of the transformed fiber morphology
+                from_bounding_box, from_voxel_tree, from_map = self.voxelize_fiber(
+                    fm, from_cell.position
                 )
-            )
 
-            # (7) For each hit on the box intersection between pre- and postsynaptic
-            # cells, perform voxel cloud intersection to identify actually connected cell
-            # pairs and select compartments from their intersecting voxels to form
-            # connections with.
-            for partner in cell_intersections:
-                # Same as in VoxelIntersection, only select a fraction of the total
-                # possible matches, based on how much affinity there is between the cell
-                # types.
-                if np.random.rand() >= self.affinity:
-                    continue
-                # Get the precise morphology of the to_cell we collided with
-                to_cell, to_morpho = to_morphology_set[partner]
-                # Get the map from voxel id to list of compartments in that voxel.
-                to_map = to_morpho.cloud.map
-                # Find which voxels inside the bounding box of the fiber and the cell box
-                # actually intersect with eachother.
-                voxel_intersections = self.intersect_voxel_tree(
-                    from_voxel_tree, to_morpho.cloud, to_cell.position
+                # (6) Check for intersections of the postsyn tree with the bounding box
+
+                ## TODO: Check if bounding box intersection is convenient
+
+                # Bounding box intersection to identify possible connected candidates, using
+                # the bounding box of the point cloud. Query the Rtree for intersections of
+                # to_cell boxes with our from_cell box
+                cell_intersections = list(
+                    to_cell_tree.intersection(
+                        tuple(np.concatenate(from_bounding_box)), objects=False
+                    )
                 )
-                # Returns a list of lists: the elements in the inner lists are the indices
-                # of the voxels in the from point cloud, the indices of the lists inside
-                # of the outer list are the to voxel indices.
-                #
-                # Find non-empty lists: these voxels actually have intersections
-                intersecting_to_voxels = np.nonzero(voxel_intersections)[0]
-                if not len(intersecting_to_voxels):
-                    # No intersections found? Do nothing, continue to next partner.
-                    continue
-                # Dictionary that stores the target compartments for each to_voxel.
-                target_comps_per_to_voxel = {}
-
-                # Iterate over each to_voxel index.
-                for to_voxel_id in intersecting_to_voxels:
-                    # Get the list of voxels that the to_voxel intersects with.
-                    intersecting_voxels = voxel_intersections[to_voxel_id]
-                    target_compartments = []
-
-                    for from_voxel_id in intersecting_voxels:
-                        # Store all of the compartments in the from_voxel as
-                        # possible candidates for these cells' connections
-                        target_compartments.extend([from_map[from_voxel_id]])
-                    target_comps_per_to_voxel[to_voxel_id] = target_compartments
-                # Weigh the random sampling by the amount of compartments so
-                # that voxels with more compartments have a higher chance of
-                # having one of their many compartments randomly picked.
-                voxel_weights = [
-                    len(to_map[to_voxel_id]) * len(from_targets)
-                    for to_voxel_id, from_targets in target_comps_per_to_voxel.items()
-                ]
-                weight_sum = sum(voxel_weights)
-                voxel_weights = [w / weight_sum for w in voxel_weights]
-                contacts = round(self.contacts.sample())
-                # Pick a random voxel and its targets
-                candidates = list(target_comps_per_to_voxel.items())
-                while contacts > 0:
-                    contacts -= 1
-                    # Pick a random voxel and its targets
-                    random_candidate_id = np.random.choice(
-                        range(len(candidates)), 1, p=voxel_weights
-                    )[0]
-                    # Pick a to_voxel_id and its target compartments from the list of candidates
-                    random_to_voxel_id, random_compartments = candidates[
-                        random_candidate_id
-                    ]
-                    # Pick a random from and to compartment of the chosen voxel pair
-                    from_compartment = np.random.choice(random_compartments, 1)[0]
-                    to_compartment = np.random.choice(to_map[random_to_voxel_id], 1)[0]
-                    compartments_out.append([from_compartment.id, to_compartment])
-                    morphologies_out.append(
-                        [from_morpho._set_index, joined_map_offset + to_morpho._set_index]
+
+                # (7) For each hit on the box intersection between pre- and postsynaptic
+                # cells, perform voxel cloud intersection to identify actually connected cell
+                # pairs and select compartments from their intersecting voxels to form
+                # connections with.
+                for partner in cell_intersections:
+                    # Same as in VoxelIntersection, only select a fraction of the total
+                    # possible matches, based on how much affinity there is between the cell
+                    # types.
+                    if np.random.rand() >= self.affinity:
+                        continue
+                    # Get the precise morphology of the to_cell we collided with
+                    to_cell, to_morpho = to_morphology_set[partner]
+                    # Get the map from voxel id to list of compartments in that voxel.
+                    to_map = to_morpho.cloud.map
+                    # Find which voxels inside the bounding box of the fiber and the cell box
+                    # actually intersect with eachother.
+                    voxel_intersections = self.intersect_voxel_tree(
+                        from_voxel_tree, to_morpho.cloud, to_cell.position
                     )
-                    connections_out.append([from_cell.id, to_cell.id])
+                    # Returns a list of lists: the elements in the inner lists are the indices
+                    # of the voxels in the from point cloud, the indices of the lists inside
+                    # of the outer list are the to voxel indices.
+                    #
+                    # Find non-empty lists: these voxels actually have intersections
+                    intersecting_to_voxels = np.nonzero(voxel_intersections)[0]
+                    if not len(intersecting_to_voxels):
+                        # No intersections found? Do nothing, continue to next partner.
+                        continue
+                    # Dictionary that stores the target compartments for each to_voxel.
+                    target_comps_per_to_voxel = {}
+
+                    # Iterate over each to_voxel index.
+                    for to_voxel_id in intersecting_to_voxels:
+                        # Get the list of voxels that the to_voxel intersects with.
+                        intersecting_voxels = voxel_intersections[to_voxel_id]
+                        target_compartments = []
+
+                        for from_voxel_id in intersecting_voxels:
+                            # Store all of the compartments in the from_voxel as
+                            # possible candidates for these cells' connections
+                            target_compartments.extend([from_map[from_voxel_id]])
+                        target_comps_per_to_voxel[to_voxel_id] = target_compartments
+                    # Weigh the random sampling by the amount of compartments so
+                    # that voxels with more compartments have a higher chance of
+                    # having one of their many compartments randomly picked.
+                    voxel_weights = [
+                        len(to_map[to_voxel_id]) * len(from_targets)
+                        for to_voxel_id, from_targets in target_comps_per_to_voxel.items()
+                    ]
+                    weight_sum = sum(voxel_weights)
+                    voxel_weights = [w / weight_sum for w in voxel_weights]
+                    contacts = round(self.contacts.sample())
+                    # Pick a random voxel and its targets
+                    candidates = list(target_comps_per_to_voxel.items())
+                    while contacts > 0:
+                        contacts -= 1
+                        # Pick a random voxel and its targets
+                        random_candidate_id = np.random.choice(
+                            range(len(candidates)), 1, p=voxel_weights
+                        )[0]
+                        # Pick a to_voxel_id and its target compartments from the list of candidates
+                        random_to_voxel_id, random_compartments = candidates[
+                            random_candidate_id
+                        ]
+                        # Pick a random from and to compartment of the chosen voxel pair
+                        from_compartment = np.random.choice(random_compartments, 1)[0]
+                        to_compartment = np.random.choice(to_map[random_to_voxel_id], 1)[
+                            0
+                        ]
+                        compartments_out.append([from_compartment, to_compartment])
+                        morphologies_out.append(
+                            [
+                                from_morpho._set_index,
+                                joined_map_offset + to_morpho._set_index,
+                            ]
+                        )
+                        connections_out.append([from_cell.id, to_cell.id])
+            return (
+                np.array(connections_out, dtype=int).reshape(-1, 2),
+                np.array(morphologies_out, dtype=int).reshape(-1, 2),
+                np.array(compartments_out, dtype=int).reshape(-1, 2),
+                fiber_cut_num,
+            )
 
+        # Intersect the presynaptic fibers in chunks and gather them in order.
+        chunks = self.map_presynaptic(intersect, len(from_morphology_set))
+        fiber_cut_num = sum(c[3] for c in chunks)
         # Throw warning on cut fibers:
         if fiber_cut_num > 0:
             warn(
                 "{} fibers out of {} were cut due to outside of quiver volume or external region voxels.".format(
-                    fiber_cut_num, c + 1
+                    fiber_cut_num, len(from_morphology_set)
                 ),
                 QuiverFieldWarning,
             )
         self.scaffold.connect_cells(
             self,
-            np.array(connections_out or np.empty((0, 2))),
-            morphologies=np.array(morphologies_out or np.empty((0, 2), dtype=str)),
-            compartments=np.array(compartments_out or np.empty((0, 2))),
+            np.concatenate([c[0] for c in chunks] + [np.empty((0, 2), dtype=int)]),
+            morphologies=np.concatenate(
+                [c[1] for c in chunks] + [np.empty((0, 2), dtype=int)]
+            ),
+            compartments=np.concatenate(
+                [c[2] for c in chunks] + [np.empty((0, 2), dtype=int)]
+            ),
             morpho_map=joined_map,
         )
 
     def intersect_voxel_tree(self, from_voxel_tree, to_cloud, to_pos):
         """
-        Similarly to `intersect_clouds` from `VoxelIntersection`, it finds intersecting voxels between a from_voxel_tree
-        and a to_cloud set of voxels
+        Find the intersecting voxels between a from_voxel_tree and a to_cloud set of
+        voxels
 
         :param from_voxel_tree: tree built from the voxelization of all branches in the fiber (in absolute coordinates)
         :type from_point_cloud: Rtree index
@@ -294,25 +306,29 @@ class FiberIntersection(ConnectionStrategy, MorphologyStrategy):
             branch.interpolate(self.resolution)
             self.interpolate_branches(branch.child_branches)
 
-    def voxelize_branches(
-        self,
-        branches,
-        position,
-        bounding_box=None,
-        voxel_tree=None,
-        map=None,
-        voxel_list=None,
-    ):
-        voxel_list = []
-        for branch in branches:
-            bounding_box, voxel_tree, map, voxel_list = branch.voxelize(
-                position, bounding_box, voxel_tree, map, voxel_list
-            )
-            self.voxelize_branches(
-                branch.child_branches, position, bounding_box, voxel_tree, map, voxel_list
-            )
+    def voxelize_fiber(self, fiber, position):
+        """
+        Voxelize all branches of a fiber, with a box around each of its segments.
 
-        return bounding_box, voxel_tree, map, voxel_list
+        :returns: The bounding box of the fiber, an Rtree of the voxels and the
+          compartment id of each voxel.
+        """
+        branches = fiber.get_branches()
+        voxels = np.concatenate([b.voxelize(position) for b in branches])
+        voxel_map = np.concatenate([b.ids for b in branches])
+        ends = np.concatenate([b.ends for b in branches]) + position
+        # The bounding box contains the start of the first root branch and all ends.
+        origin = fiber.root_branches[0].origin + position
+        bounding_box = [
+            np.minimum(origin, ends.min(axis=0)),
+            np.maximum(origin, ends.max(axis=0)),
+        ]
+        p = index.Property(dimension=3)
+        # Bulk load the voxels into the tree.
+        voxel_tree = index.Index(
+            ((i, tuple(voxel), None) for i, voxel in enumerate(voxels)), properties=p
+        )
+        return bounding_box, voxel_tree, voxel_map
 
 
 class FiberTransform(ConfigurableClass):
@@ -328,6 +344,23 @@ class FiberTransform(ConfigurableClass):
             self.transform_branch(branch, offset)
             self.transform_branches(branch.child_branches, offset)
 
+    def transform_fibers(self, fibers, offsets):
+        """
+        Transform a population of fibers.
+
+        :param fibers: Fibers to transform.
+        :type fibers: list of :class:`.networks.FiberMorphology`
+        :param offsets: Position of the cell of each fiber.
+        :returns: Number of cut branches of each fiber.
+        :rtype: numpy.ndarray
+        """
+        cut_branches = np.zeros(len(fibers), dtype=int)
+        for i, (fiber, offset) in enumerate(zip(fibers, offsets)):
+            cut_num = self._branch_cut_num
+            self.transform_branches(fiber.root_branches, offset)
+            cut_branches[i] = self._branch_cut_num - cut_num
+        return cut_branches
+
     @abc.abstractmethod
     def transform_branch(self):
         pass
@@ -372,7 +405,6 @@ class QuiverTransform(FiberTransform):
             )
 
     def transform_branch(self, branch, offset):
-
         """
         Compute bending transformation of a fiber branch (discretized according to original compartments and configured resolution value).
         The transformation is a rotation of each segment/compartment of each fiber branch to align to the cross product between
@@ -387,79 +419,107 @@ class QuiverTransform(FiberTransform):
         :returns: a transformed branch
 
         """
-        orientation_data = self.quivers
-        volume_res = self.vol_res
-        volume_start = self.vol_start
-
-        if not self.shared:
-            # Compute branch direction - to check that PFs have 2 branches, left and right
-            branch_dir = self.get_branch_direction(branch)
-            # If the entire branch consists of compartments without direction, do nothing.
-            if branch_dir is False:
-                return
-
-            num_comp = len(branch._compartments)
-
-            # Compute length of the first compartment in the current branch
-            length_comp = np.linalg.norm(
-                branch._compartments[0].end - branch._compartments[0].start
+        self._transform([branch], np.reshape(offset, (1, 3)))
+
+    def transform_branches(self, branches, offset=None):
+        if offset is None:
+            offset = np.zeros(3)
+        branches = flatten_branches(branches)
+        self._transform(branches, np.tile(offset, (len(branches), 1)))
+
+    def transform_fibers(self, fibers, offsets):
+        branches, owners = [], []
+        for i, fiber in enumerate(fibers):
+            fiber_branches = fiber.get_branches()
+            branches.extend(fiber_branches)
+            owners.extend([i] * len(fiber_branches))
+        owners = np.array(owners, dtype=int)
+        offsets = np.array(offsets, dtype=float).reshape(-1, 3)[owners]
+        cut = self._transform(branches, offsets)
+        return np.bincount(owners[cut], minlength=len(fibers))
+
+    def _transform(self, branches, offsets):
+        """
+        Transform the branches all at once, walking along their segments in lockstep.
+
+        :returns: Indices of the branches that were cut.
+        """
+        if self.shared:
+            return np.empty(0, dtype=int)
+        # Compute branch direction - to check that PFs have 2 branches, left and right
+        # If the entire branch consists of compartments without direction, do nothing.
+        directions = [self.get_branch_direction(branch) for branch in branches]
+        todo = [i for i, d in enumerate(directions) if d is not False]
+        if not todo:
+            return np.empty(0, dtype=int)
+        # Find direction transversal to branch: cross product between
+        # the branch direction and the original morphology/parent branch
+        transversal = []
+        for i in todo:
+            orientation = branches[i].orientation
+            if orientation is None:
+                orientation = [0, 1, 0]
+            transversal.append(np.cross(directions[i], orientation))
+        transversal = np.array(transversal)
+        offsets = offsets[todo]
+        # Pad the segments of all branches into (branches, segments, 3) arrays.
+        counts = np.array([len(branches[i]) for i in todo])
+        starts = np.zeros((len(todo), counts.max(), 3))
+        ends = np.zeros((len(todo), counts.max(), 3))
+        for row, i in enumerate(todo):
+            starts[row, : counts[row]] = branches[i].starts
+            ends[row, : counts[row]] = branches[i].ends
+        # Each segment keeps its original length.
+        lengths = np.linalg.norm(ends - starts, axis=2)
+        volume_start = np.array(self.vol_start, dtype=float)
+        shape = np.array(self.quivers.shape[1:])
+        active = np.ones(len(todo), dtype=bool)
+        cut_at = np.full(len(todo), -1)
+        for comp in range(counts.max()):
+            rows = np.nonzero(active & (comp < counts))[0]
+            if not len(rows):
+                break
+            # Extracting index of voxel where the current compartments are located
+            voxel_ind = (starts[rows, comp] + offsets[rows] - volume_start) / self.vol_res
+            voxel_ind = voxel_ind.astype(int) - 1
+            # Catch values falling outside of quiver field volume
+            outside = np.all(voxel_ind < 0, axis=1) | np.all(voxel_ind > shape, axis=1)
+            inside = rows[~outside]
+            voxel_ind = voxel_ind[~outside]
+            orientation_vector = self.quivers[
+                :, voxel_ind[:, 0], voxel_ind[:, 1], voxel_ind[:, 2]
+            ].T
+            # Catch values belonging to a different area than the reconstructed one
+            # (marked by NaN)
+            nan = np.isnan(orientation_vector).any(axis=1)
+            cut = np.concatenate((rows[outside], inside[nan]))
+            active[cut] = False
+            cut_at[cut] = comp
+            inside = inside[~nan]
+            cross_prod = np.cross(orientation_vector[~nan], transversal[inside])
+            cross_prod = cross_prod / np.linalg.norm(cross_prod, axis=1, keepdims=True)
+            # Transform compartments
+            ends[inside, comp] = (
+                starts[inside, comp] + cross_prod * lengths[inside, comp, None]
             )
-            # Looping over branch compartments to transform them
-            for comp in range(len(branch._compartments)):
-                # Find direction transversal to branch: cross product between
-                # the branch direction and the original morphology/parent branch
-                if branch.orientation is None:
-                    transversal_vector = np.cross(branch_dir, [0, 1, 0])
-                else:
-                    transversal_vector = np.cross(branch_dir, branch.orientation)
-
-                # Extracting index of voxel where the current compartment is located
-                voxel_ind = (
-                    branch._compartments[comp].start + offset - volume_start
-                ) / volume_res
-
-                voxel_ind = voxel_ind.astype(int) - [1, 1, 1]
-                # Catch values falling outside of quiver field volume
-                if (np.array(voxel_ind) < np.array([0, 0, 0])).all() or (
-                    np.array(voxel_ind) > np.array(orientation_data.shape[1:])
-                ).all():
-                    # Update number of cut branches
-                    self._branch_cut_num += 1
-                    # Detach subsequent compartments from branch
-                    leftover_branch = branch.detach(branch._compartments[comp])
-                    break
-
-                orientation_vector = orientation_data[
-                    :, voxel_ind[0], voxel_ind[1], voxel_ind[2]
-                ]
-
-                # Catch values belonging to a different area than the reconstructed one (marked by NaN)
-                if np.isnan(orientation_vector).any():
-                    self._branch_cut_num += 1
-                    # Detach subsequent compartments from branch
-                    leftover_branch = branch.detach(branch._compartments[comp])
-                    break
-
-                cross_prod = np.cross(orientation_vector, transversal_vector)
-                cross_prod = cross_prod / np.linalg.norm(cross_prod)
-
-                # Transform compartment
-                branch._compartments[comp].end = (
-                    branch._compartments[comp].start + cross_prod * length_comp
-                )
-                if comp < (num_comp - 1):
-                    length_comp = np.linalg.norm(
-                        branch._compartments[comp + 1].end
-                        - branch._compartments[comp + 1].start
-                    )
-                    # The new end is the start of the adjacent compartment
-                    branch._compartments[comp + 1].start = branch._compartments[comp].end
+            if comp < counts.max() - 1:
+                # The new end is the start of the adjacent compartment
+                starts[inside, comp + 1] = ends[inside, comp]
+        for row, i in enumerate(todo):
+            branches[i].starts = starts[row, : counts[row]]
+            branches[i].ends = ends[row, : counts[row]]
+            if cut_at[row] >= 0:
+                # Detach subsequent compartments from branch
+                branches[i].detach(cut_at[row])
+        # Update number of cut branches
+        self._branch_cut_num += np.count_nonzero(cut_at >= 0)
+        return np.array(todo, dtype=int)[cut_at >= 0]
 
     def get_branch_direction(self, branch):
-        for comp in branch._compartments:
-            branch_dir = comp.end - comp.start
-            if not np.sum(branch_dir):
-                continue
-            # Normalize branch_dir vector
-            branch_dir = branch_dir / np.linalg.norm(branch_dir)
-            return branch_dir
+        directions = branch.ends - branch.starts
+        directed = np.nonzero(np.sum(directions, axis=1))[0]
+        if not len(directed):
+            return False
+        # Normalize branch_dir vector
+        branch_dir = directions[directed[0]]
+        return branch_dir / np.linalg.norm(branch_dir)
@@ -1,12 +1,12 @@
 import numpy as np
-from ..strategy import ConnectionStrategy
+from ..strategy import ConnectionStrategy, ParallelStrategy
 from .shared import MorphologyStrategy
 from ...helpers import (
     DistributionConfiguration,
     assert_attr_in,
 )
 from ...reporting import report, warn
-from random import sample as sample_elements
+from scipy.spatial import cKDTree
 
 
 class TouchInformation:
@@ -19,12 +19,13 @@ class TouchInformation:
         self.to_cell_compartments = to_cell_compartments
 
 
-class TouchDetector(ConnectionStrategy, MorphologyStrategy):
+class TouchDetector(ConnectionStrategy, MorphologyStrategy, ParallelStrategy):
     """
     Connectivity based on intersection of detailed morphologies
     """
 
     casts = {
+        **ParallelStrategy.casts,
         "compartment_intersection_radius": float,
         "cell_intersection_radius": float,
         "synapses": DistributionConfiguration.cast,
@@ -32,6 +33,7 @@ class TouchDetector(ConnectionStrategy, MorphologyStrategy):
     }
 
     defaults = {
+        **ParallelStrategy.defaults,
         "cell_intersection_plane": "xyz",
         "compartment_intersection_plane": "xyz",
         "compartment_intersection_radius": 5.0,
@@ -64,6 +66,7 @@ class TouchDetector(ConnectionStrategy, MorphologyStrategy):
         labels_pre = None if self.label_pre is None else [self.label_pre]
         labels_post = None if self.label_post is None else [self.label_post]
         self.morphology_cache = {}
+        self._touch_points = {}
         for from_cell_type_index in range(len(self.from_cell_types)):
             from_cell_type = self.from_cell_types[from_cell_type_index]
             from_cell_compartments = self.from_cell_compartments[from_cell_type_index]
@@ -79,28 +82,40 @@ class TouchDetector(ConnectionStrategy, MorphologyStrategy):
                 touch_info.from_placement = self.scaffold.get_placement_set(
                     from_cell_type, labels=labels_pre
                 )
-                touch_info.from_positions = list(touch_info.from_placement.positions)
-                touch_info.from_identifiers = list(touch_info.from_placement.identifiers)
+                touch_info.from_positions = touch_info.from_placement.positions
+                touch_info.from_identifiers = touch_info.from_placement.identifiers
                 touch_info.to_placement = self.scaffold.get_placement_set(
                     to_cell_type, labels=labels_post
                 )
-                touch_info.to_identifiers = list(touch_info.to_placement.identifiers)
-                touch_info.to_positions = list(touch_info.to_placement.positions)
+                touch_info.to_identifiers = touch_info.to_placement.identifiers
+                touch_info.to_positions = touch_info.to_placement.positions
                 # Intersect cells on the widest possible search radius.
                 candidates = self.intersect_cells(touch_info)
-                # Intersect cell compartments between matched cells.
-                connections, morphology_names, compartments = self.intersect_compartments(
-                    touch_info, candidates
+                # Intersect cell compartments between matched cells, in chunks of
+                # presynaptic cells.
+                chunks = self.map_presynaptic(
+                    lambda cells: self.intersect_compartments(
+                        touch_info, candidates, cells
+                    ),
+                    len(candidates),
                 )
+                (
+                    connections,
+                    morphologies,
+                    compartments,
+                    morpho_map,
+                ) = self._join_chunks(chunks)
                 # Connect the cells and store the morphologies and selected compartments that connect them.
                 self.scaffold.connect_cells(
                     self,
                     connections,
-                    morphologies=morphology_names,
+                    morphologies=morphologies,
                     compartments=compartments,
+                    morpho_map=morpho_map,
                 )
-        # Remove the morphology cache
+        # Remove the morphology caches
         self.morphology_cache = None
+        self._touch_points = None
 
     def intersect_cells(self, touch_info):
         from_cell_type = touch_info.from_cell_type
@@ -130,102 +145,181 @@ class TouchDetector(ConnectionStrategy, MorphologyStrategy):
             reversed_matches = from_cell_tree.query_radius(
                 to_cell_tree.get_arrays()[0], radius
             )
-            matches = [[] for _ in range(len(from_cell_tree.get_arrays()[0]))]
-            for i in range(len(reversed_matches)):
-                for match in reversed_matches[i]:
-                    matches[match].append(i)
-            return matches
-
-    def intersect_compartments(self, touch_info, candidate_map):
-        connected_cells = []
-        morphology_names = []
-        connected_compartments = []
+            # Invert the matches: sort the (to, from) pairs on the from cell and split
+            # them per from cell.
+            lengths = np.fromiter(map(len, reversed_matches), dtype=int)
+            to_cells = np.repeat(np.arange(len(reversed_matches)), lengths)
+            from_cells = np.concatenate(list(reversed_matches) + [np.empty(0, dtype=int)])
+            order = np.argsort(from_cells, kind="stable")
+            counts = np.bincount(
+                from_cells, minlength=len(from_cell_tree.get_arrays()[0])
+            )
+            return np.split(to_cells[order], np.cumsum(counts)[:-1])
+
+    def intersect_compartments(self, touch_info, candidate_map, presynaptic=None):
+        """
+        Find the touching compartments between each presynaptic cell and all of its
+        candidate partners with a single KD-tree query per presynaptic cell.
+
+        :param presynaptic: Indices of the presynaptic cells to intersect, all of them
+          by default.
+        :returns: The connections, the morphologies as indices into the returned
+          morphology map and the compartments of each synapse.
+        """
+        radius = self.compartment_intersection_radius
+        if presynaptic is None:
+            presynaptic = range(len(candidate_map))
+        morpho_map = []
+        blocks = []
         c_check = 0
         touching_cells = 0
-        for i in range(len(candidate_map)):
-            if i % 100 == 0:
-                percentage = 100 * float(i) / float(len(candidate_map))
+        for n, i in enumerate(presynaptic):
+            if n % 100 == 0:
+                percentage = 100 * float(n) / float(len(presynaptic))
                 report(
                     f"Connection progress: {percentage:.2f}%...",
                     level=2,
                     ongoing=True,
                 )
-            from_id = touch_info.from_identifiers[i]
-            touch_info.from_morphology = self.get_random_morphology(
-                touch_info.from_cell_type
+            from_morpho = self.get_random_morphology(touch_info.from_cell_type)
+            candidates = np.asarray(candidate_map[i], dtype=int)
+            to_morphos = [
+                self.get_random_morphology(touch_info.to_cell_type) for _ in candidates
+            ]
+            c_check += len(candidates)
+            from_points, from_comps, from_tree = self._get_touch_points(
+                from_morpho, touch_info.from_cell_compartments
             )
-            for j in candidate_map[i]:
-                c_check += 1
-                to_id = touch_info.to_identifiers[j]
-                touch_info.to_morphology = self.get_random_morphology(
-                    touch_info.to_cell_type
-                )
-                intersections = self.get_compartment_intersections(
-                    touch_info, touch_info.from_positions[i], touch_info.to_positions[j]
-                )
-                if len(intersections) > 0:
-                    touching_cells += 1
-                    number_of_synapses = max(
-                        min(int(self.synapses.sample()), len(intersections)),
-                        int(not self.allow_zero_synapses),
-                    )
-                    cell_connections = [
-                        [from_id, to_id] for _ in range(number_of_synapses)
-                    ]
-                    compartment_connections = sample_elements(
-                        intersections, k=number_of_synapses
-                    )
-                    connected_cells.extend(cell_connections)
-                    connected_compartments.extend(compartment_connections)
-                    # Pad the morphology names with the right names for the amount of compartment connections made
-                    morphology_names.extend(
-                        [
-                            [
-                                touch_info.from_morphology.morphology_name,
-                                touch_info.to_morphology.morphology_name,
-                            ]
-                            for _ in range(len(compartment_connections))
-                        ]
-                    )
+            if from_tree is None or not len(candidates):
+                continue
+            to_points = [
+                self._get_touch_points(m, touch_info.to_cell_compartments)
+                for m in to_morphos
+            ]
+            lengths = np.array([len(p[0]) for p in to_points], dtype=int)
+            if not np.sum(lengths):
+                continue
+            # Move all the candidate compartments into the frame of the presynaptic
+            # morphology and intersect them with it in one query.
+            offsets = touch_info.to_positions[candidates] - touch_info.from_positions[i]
+            query_points = np.concatenate([p[0] for p in to_points])
+            query_points += np.repeat(offsets, lengths, axis=0)
+            query_comps = np.concatenate([p[1] for p in to_points])
+            owners = np.repeat(np.arange(len(candidates)), lengths)
+            # Only query the points inside of the bounding box of the presynaptic
+            # compartments, grown by the intersection radius.
+            lower = np.min(from_points, axis=0) - radius
+            upper = np.max(from_points, axis=0) + radius
+            inside = np.all((query_points >= lower) & (query_points <= upper), axis=1)
+            query_points = query_points[inside]
+            query_comps = query_comps[inside]
+            owners = owners[inside]
+            if not len(query_points):
+                continue
+            hits = from_tree.sparse_distance_matrix(
+                cKDTree(query_points), radius, output_type="ndarray"
+            )
+            if not len(hits):
+                continue
+            hit_pairs = owners[hits["j"]]
+            # Sample the synapses of each touching pair without replacement: shuffle
+            # the hits of each pair and keep the first `n` of them.
+            order = np.lexsort((np.random.random(len(hits)), hit_pairs))
+            hit_pairs = hit_pairs[order]
+            pairs, starts, hit_counts = np.unique(
+                hit_pairs, return_index=True, return_counts=True
+            )
+            touching_cells += len(pairs)
+            synapses = np.minimum(
+                np.array(self.synapses.draw(len(pairs)), dtype=int), hit_counts
+            )
+            synapses = np.maximum(synapses, int(not self.allow_zero_synapses))
+            rank = np.arange(len(hit_pairs)) - np.repeat(starts, hit_counts)
+            selected = order[rank < np.repeat(synapses, hit_counts)]
+            synapse_pairs = owners[hits["j"][selected]]
+            block = np.empty((len(selected), 6), dtype=int)
+            block[:, 0] = touch_info.from_identifiers[i]
+            block[:, 1] = touch_info.to_identifiers[candidates[synapse_pairs]]
+            block[:, 2] = self._map_morphology(morpho_map, from_morpho.morphology_name)
+            block[:, 3] = [
+                self._map_morphology(morpho_map, to_morphos[p].morphology_name)
+                for p in synapse_pairs
+            ]
+            block[:, 4] = from_comps[hits["i"][selected]]
+            block[:, 5] = query_comps[hits["j"][selected]]
+            blocks.append(block)
         report(
             "Checked {} candidate cell pairs from {} to {}".format(
                 c_check, touch_info.from_cell_type.name, touch_info.to_cell_type.name
             ),
             level=2,
         )
+        data = np.concatenate(blocks) if blocks else np.empty((0, 6), dtype=int)
         report(
             "Touch connection results: \n* Touching pairs: {} \n* Synapses: {}".format(
-                touching_cells, len(connected_compartments)
+                touching_cells, len(data)
             ),
             level=2,
         )
+        return data[:, 0:2], data[:, 2:4], data[:, 4:6], morpho_map
 
+    def _join_chunks(self, chunks):
+        # Concatenate the results of the chunks and merge their morphology maps.
+        morpho_map = []
+        morphologies = []
+        for _, chunk_morphologies, _, chunk_map in chunks:
+            remap = np.array(
+                [self._map_morphology(morpho_map, name) for name in chunk_map], dtype=int
+            )
+            morphologies.append(remap[chunk_morphologies])
+        if not chunks:
+            return (*(np.empty((0, 2), dtype=int) for _ in range(3)), morpho_map)
         return (
-            np.array(connected_cells, dtype=int),
-            np.array(morphology_names, dtype=np.string_),
-            np.array(connected_compartments, dtype=int),
+            np.concatenate([c[0] for c in chunks]),
+            np.concatenate(morphologies),
+            np.concatenate([c[2] for c in chunks]),
+            morpho_map,
         )
 
+    def _map_morphology(self, morpho_map, name):
+        try:
+            return morpho_map.index(name)
+        except ValueError:
+            morpho_map.append(name)
+            return len(morpho_map) - 1
+
+    def _get_touch_points(self, morphology, labels):
+        """
+        Return the positions, compartment ids and KD-tree of the compartments of a
+        morphology with the given labels. Computed once per morphology and labels.
+        """
+        key = (id(morphology), None if labels is None else tuple(labels))
+        if key not in self._touch_points:
+            comps = morphology.get_compartments(labels)
+            points = np.array([c.end for c in comps], dtype=float).reshape(-1, 3)
+            ids = np.array([c.id for c in comps], dtype=int)
+            tree = cKDTree(points) if len(points) else None
+            self._touch_points[key] = (points, ids, tree, morphology)
+        return self._touch_points[key][:3]
+
     def get_compartment_intersections(self, touch_info, from_pos, to_pos):
-        from_morpho = touch_info.from_morphology
-        to_morpho = touch_info.to_morphology
-        to_comps = to_morpho.get_compartment_positions(touch_info.to_cell_compartments)
-        from_tree = from_morpho.get_compartment_tree(touch_info.from_cell_compartments)
-        if from_tree is None or not len(to_comps):
+        if getattr(self, "_touch_points", None) is None:
+            self._touch_points = {}
+        _, from_comps, from_tree = self._get_touch_points(
+            touch_info.from_morphology, touch_info.from_cell_compartments
+        )
+        to_points, to_comps, _ = self._get_touch_points(
+            touch_info.to_morphology, touch_info.to_cell_compartments
+        )
+        if from_tree is None or not len(to_points):
             return []
-        query_points = to_comps + to_pos - from_pos
-        compartment_hits = from_tree.query_radius(
-            query_points, self.compartment_intersection_radius
+        query_points = to_points + to_pos - from_pos
+        hits = from_tree.sparse_distance_matrix(
+            cKDTree(query_points),
+            self.compartment_intersection_radius,
+            output_type="ndarray",
         )
-        from_map = from_morpho.get_compartment_submask(touch_info.from_cell_compartments)
-        to_map = to_morpho.get_compartment_submask(touch_info.to_cell_compartments)
-        intersections = []
-        for i in range(len(compartment_hits)):
-            hits = compartment_hits[i]
-            if len(hits) > 0:
-                for j in range(len(hits)):
-                    intersections.append([from_map[hits[j]], to_map[i]])
-        return intersections
+        return np.column_stack((from_comps[hits["i"]], to_comps[hits["j"]])).tolist()
 
     def get_search_radius(self, cell_type):
         morphologies = self.get_all_morphologies(cell_type)
@@ -1,7 +1,9 @@
 from ..helpers import ConfigurableClass, SortableByAfter
 from ..functions import compute_intersection_slice
 from ..models import ConnectivitySet
-import abc
+from ..reporting import warn
+import abc, random, multiprocessing, numpy as np
+from sklearn.neighbors import KDTree
 
 
 class _SimulationPlaceholder:
@@ -34,6 +36,7 @@ class ConnectionStrategy(ConfigurableClass, SortableByAfter):
 
         # Store a local reference to the original connect function
         connect = this.connect
+
         # Wrapper closure that calls the local `connect`, referencing the original connect
         def wrapped_connect(self):
             # Handle with_label specifications.
@@ -140,6 +143,18 @@ class ConnectionStrategy(ConfigurableClass, SortableByAfter):
                     # Don't filter by label and store the cells under from_cells/to_cells
                     self.__dict__[t + "s"][cell_type.name] = cells
 
+    def get_cell_tree(self, cell_type):
+        """
+        Return the KDTree of the cell positions of a cell type. The tree of the
+        scaffold's cell tree collection is used, unless it does not match the placed
+        cells, then a new tree is made.
+        """
+        positions = self.scaffold.cells_by_type[cell_type.name][:, 2:5]
+        tree = self.scaffold.trees.cells.get_tree(cell_type.name)
+        if tree is None or not np.array_equal(tree.get_arrays()[0], positions):
+            tree = KDTree(positions)
+        return tree
+
     @classmethod
     def get_ordered(cls, objects):
         return objects.values()  # No sorting of connection types required.
@@ -160,6 +175,114 @@ class ConnectionStrategy(ConfigurableClass, SortableByAfter):
         return [ConnectivitySet(self.scaffold.output_formatter, tag) for tag in self.tags]
 
 
+# The chunked work of the `ParallelStrategy` that is being mapped. Forked worker
+# processes inherit it, so that the strategy and its data don't have to be pickled.
+_chunk_job = None
+
+
+def _run_chunk(chunk):
+    func, seed = _chunk_job
+    index, start, stop = chunk
+    # Seed every chunk separately so that the results don't depend on which process
+    # connects the chunk.
+    np.random.seed((seed + index) % 2 ** 32)
+    random.seed(seed + index)
+    return func(np.arange(start, stop))
+
+
+class ParallelStrategy:
+    """
+    Mixin for connection strategies that can connect their presynaptic cells in
+    independent chunks. The chunks are connected in a pool of ``workers`` processes,
+    or spread over the MPI ranks, and gathered in the order of the chunks, so that
+    the connections only depend on the ``seed`` and the ``chunk_size``. Seeded
+    strategies are always connected in chunks, of ``default_chunk_size`` cells if no
+    ``chunk_size`` is given.
+    """
+
+    casts = {"workers": int, "chunk_size": int, "seed": int}
+
+    defaults = {"workers": 1, "chunk_size": None, "seed": None}
+
+    default_chunk_size = 1000
+
+    def is_parallel(self):
+        """
+        Return whether the presynaptic cells should be connected in chunks.
+        """
+        return (
+            self.workers > 1
+            or self.chunk_size is not None
+            or self.seed is not None
+            or self._get_mpi_size() > 1
+        )
+
+    def map_presynaptic(self, func, count):
+        """
+        Call ``func`` with chunks of the indices of ``count`` presynaptic cells.
+
+        :param func: Connects the presynaptic cells with the given indices.
+        :type func: callable
+        :param count: Number of presynaptic cells.
+        :type count: int
+        :returns: The results of each chunk, in the order of the chunks.
+        :rtype: list
+        """
+        global _chunk_job
+        if not self.is_parallel():
+            return [func(np.arange(count))]
+        chunk_size = self.chunk_size or self.default_chunk_size
+        chunks = [
+            (i, start, min(start + chunk_size, count))
+            for i, start in enumerate(range(0, count, chunk_size))
+        ]
+        # Connecting the chunks reseeds the random generators, restore them after.
+        state, py_state = np.random.get_state(), random.getstate()
+        _chunk_job = (func, self._get_seed())
+        try:
+            size = self._get_mpi_size()
+            if size > 1:
+                # Each rank connects a strided subset of the chunks and all ranks gather
+                # the results back into chunk order.
+                comm = self.scaffold.MPI.COMM_WORLD
+                rank_results = comm.allgather(self._map_chunks(chunks[comm.rank :: size]))
+                results = [None] * len(chunks)
+                for rank, rank_result in enumerate(rank_results):
+                    results[rank::size] = rank_result
+                return results
+            return self._map_chunks(chunks)
+        finally:
+            _chunk_job = None
+            np.random.set_state(state)
+            random.setstate(py_state)
+
+    def _map_chunks(self, chunks):
+        if self.workers > 1 and len(chunks) > 1:
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+                with context.Pool(min(self.workers, len(chunks))) as pool:
+                    return pool.map(_run_chunk, chunks)
+            warn(
+                "Connecting {} in a single process: worker pools require the 'fork'"
+                " start method.".format(self.name)
+            )
+        return [_run_chunk(chunk) for chunk in chunks]
+
+    def _get_mpi_size(self):
+        if not self.scaffold.has_mpi_installed:
+            return 1
+        return self.scaffold.MPI.COMM_WORLD.size
+
+    def _get_seed(self):
+        seed = self.seed
+        if seed is None:
+            seed = np.random.randint(np.iinfo(np.int32).max)
+        if self.scaffold.has_mpi_installed:
+            # Make sure that all ranks connect the same chunks.
+            seed = self.scaffold.MPI.COMM_WORLD.bcast(seed, root=0)
+        return seed
+
+
 class TouchingConvergenceDivergence(ConnectionStrategy):
     casts = {"divergence": int, "convergence": int}
 
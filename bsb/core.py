@@ -13,6 +13,7 @@ from .reporting import report, warn, has_mpi_installed, get_report_file
 from .config import JSONConfig
 import json
 import contextlib
+from collections.abc import MutableMapping
 
 ###############################
 ## Scaffold class
@@ -23,8 +24,90 @@ import contextlib
 
 
 class TreeCollectionGroup:
-    def add_collection(self, name, handler):
-        self.__dict__[name] = TreeCollection(name, handler)
+    def add_collection(self, name, handler, read_only=False):
+        self.__dict__[name] = TreeCollection(name, handler, read_only=read_only)
+
+
+class _StoredCache(MutableMapping):
+    """
+    Network cache that keeps its data in the output file instead of in memory.
+
+    Entries are loaded from the output on access and kept until :meth:`release` is
+    called. Entries that are assigned to are kept in memory until the output formatter
+    collects them with :meth:`pop_changes`.
+    """
+
+    def __init__(self, loader, keys=()):
+        self._loader = loader
+        self._keys = dict.fromkeys(keys)
+        self._loaded = {}
+        self._changed = {}
+
+    def __getitem__(self, key):
+        if key in self._changed:
+            return self._changed[key]
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._loaded:
+            self._loaded[key] = self._loader(key)
+        return self._loaded[key]
+
+    def __setitem__(self, key, value):
+        self._keys[key] = None
+        self._loaded.pop(key, None)
+        self._changed[key] = value
+
+    def __delitem__(self, key):
+        del self._keys[key]
+        self._loaded.pop(key, None)
+        self._changed.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def stored(self, key):
+        """
+        Mark an entry as appended to in the output, invalidating its loaded data.
+        """
+        self._keys[key] = None
+        self._loaded.pop(key, None)
+
+    def pop_changes(self):
+        """
+        Return and forget all the entries that were assigned to since the last call.
+        """
+        changes, self._changed = self._changed, {}
+        for key, value in changes.items():
+            self._loaded[key] = value
+        return changes
+
+    def release(self):
+        """
+        Forget all the data loaded from the output.
+        """
+        self._loaded = {}
+
+
+def _map_block(data_map, data, use_map=None):
+    # Map the data onto indices of `data_map`, which is extended with new values.
+    if use_map:
+        if len(data):
+            # Using `+` on empty dataset errors
+            data += len(data_map)
+        data_map.extend(use_map)
+        return np.array(data, dtype=int)
+    if data.dtype.type is np.string_:
+        # Explicitly cast numpy strings to str so they don't yield
+        # `b'morphology_name'` when stored as attribute by hdf5.
+        data = data.astype(str)
+    mapped_data, _ = map_ndarray(data, _map=data_map)
+    return np.array(mapped_data, dtype=int)
 
 
 def from_hdf5(file):
@@ -63,6 +146,16 @@ class Scaffold:
     simulators such as NEST or NEURON.
     """
 
+    # Network caches that are stored in the output during incremental compilation.
+    _stored_caches = (
+        "cells_by_type",
+        "entities_by_type",
+        "rotations",
+        "cell_connections_by_tag",
+        "connection_compartments",
+        "connection_morphologies",
+    )
+
     def __init__(self, config, from_file=None):
         self._initialise_MPI()
         self.configuration = config
@@ -71,8 +164,13 @@ class Scaffold:
         self.statistics = Statistics(self)
         self._initialise_output_formatter()
         self.trees = TreeCollectionGroup()
-        self.trees.add_collection("cells", self.output_formatter)
-        self.trees.add_collection("morphologies", self.output_formatter)
+        # Only the master node writes the trees to the output.
+        self.trees.add_collection(
+            "cells", self.output_formatter, read_only=self.is_mpi_slave
+        )
+        self.trees.add_collection(
+            "morphologies", self.output_formatter, read_only=self.is_mpi_slave
+        )
         self._nextId = 0
         # Use the configuration to initialise all components such as cells and layers
         # to prepare for the network architecture compilation.
@@ -227,12 +325,36 @@ class Scaffold:
         """
         Run the connection strategies of all cell types.
         """
+        self._share_placement()
         sorted_connection_types = ConnectionStrategy.resolve_order(
             self.configuration.connection_types
         )
         for connection_type in sorted_connection_types:
             self.connect_type(connection_type)
 
+    def _share_placement(self):
+        """
+        Broadcast the placement of the master node to the other MPI ranks, so that
+        the connection strategies that connect in parallel divide the same cells.
+        """
+        if not self.has_mpi_installed or self.MPI.COMM_WORLD.size == 1:
+            return
+        caches = ("cells_by_type", "entities_by_type", "rotations", "labels")
+        placement = None
+        if self.is_mpi_master:
+            placement = {c: dict(getattr(self, c).items()) for c in caches}
+            placement["_nextId"] = self._nextId
+        placement = self.MPI.COMM_WORLD.bcast(placement, root=0)
+        if self.is_mpi_master:
+            return
+        for cache in caches:
+            setattr(self, cache, placement[cache])
+        self._nextId = placement["_nextId"]
+        self.trees.cells.trees = {}
+        for cell_type in self.get_cell_types(entities=False):
+            cells = self.cells_by_type[cell_type.name][:, 2:5]
+            self.trees.cells.create_tree(cell_type.name, cells)
+
     def connect_type(self, connection_type):
         """
         Run a connection type
@@ -281,6 +403,8 @@ class Scaffold:
             if i > 0:
                 self.reset_network_cache()
             t = time.time()
+            if output and self._can_stream():
+                self._start_streaming()
             for step in (
                 self.place_cell_types,
                 self.run_after_placement_hooks,
@@ -297,9 +421,10 @@ class Scaffold:
                             self.MPI.COMM_WORLD.bcast(self.output_formatter.file, root=0)
                         else:
                             warn(
-                                "Distributed compiling under MPI is not possible."
-                                + "All nodes except the master node are waiting, "
-                                + "doing nothing. Please compile on a single node.",
+                                "Distributed compiling under MPI is limited to "
+                                + "connection strategies that connect in parallel. "
+                                + "All other steps run on every node and only the "
+                                + "master node writes the output.",
                                 ResourceWarning,
                             )
                             self.output_formatter.file = self.MPI.COMM_WORLD.bcast(
@@ -388,13 +513,64 @@ class Scaffold:
         self._connectivity_set_meta = {}
         self.labels = {}
         self.rotations = {}
+        if getattr(self, "_streaming", False):
+            self.output_formatter.stop_streaming()
+        self._streaming = False
+
+    def _can_stream(self):
+        # Only the master node writes the output, the others keep it in memory.
+        incremental = getattr(self.output_formatter, "incremental", False)
+        return incremental and self.is_mpi_master
+
+    def _start_streaming(self):
+        """
+        Create the output file and from now on append the placement and connectivity
+        data to it as it is produced, instead of keeping it in memory.
+        """
+        formatter = self.output_formatter
+        formatter.init_output()
+        for cell_type in self.get_cell_types():
+            name = cell_type.name
+            if cell_type.entity:
+                ids = self.entities_by_type.get(name, ())
+                positions = None
+            else:
+                data = self.cells_by_type[name]
+                ids, positions = data[:, 0], data[:, 2:5]
+            formatter.append_placement(
+                cell_type, ids, positions, rotations=self.rotations.get(name)
+            )
+        for tag, data in self.cell_connections_by_tag.items():
+            compartments = self.connection_compartments.get(tag)
+            morphologies = self.connection_morphologies.get(tag)
+            morpho_map = self.connection_morphologies.get(f"__map_{tag}")
+            formatter.append_connections(
+                tag, data, compartments, morphologies, morpho_map
+            )
 
-    def run_simulation(self, simulation_name, quit=False):
+        def loader(cache):
+            return lambda key: formatter.load_cache(cache, key)
+
+        for cache in self._stored_caches:
+            keys = getattr(self, cache).keys()
+            setattr(self, cache, _StoredCache(loader(cache), keys))
+        self._streaming = True
+
+    def _stop_streaming(self):
+        # Load the stored caches back into memory.
+        for cache in self._stored_caches:
+            setattr(self, cache, dict(getattr(self, cache)))
+        self.output_formatter.stop_streaming()
+        self._streaming = False
+
+    def run_simulation(self, simulation_name, quit=False, resume=False):
         """
         Run a simulation starting from the default single-instance adapter.
 
         :param simulation_name: Name of the simulation in the configuration.
         :type simulation_name: string
+        :param resume: Continue the simulation from its last checkpoint.
+        :type resume: bool
         """
         t = time.time()
         simulation, simulator = self.prepare_simulation(simulation_name)
@@ -403,7 +579,10 @@ class Scaffold:
         if report_file:
             listener = ReportListener(self, report_file)
             simulation.add_progress_listener(listener)
-        simulation.simulate(simulator)
+        if resume:
+            simulation.resume(simulator)
+        else:
+            simulation.simulate(simulator)
         result_path = simulation.collect_output(simulator)
         time_sim = time.time() - t
         report("Simulation runtime: {}".format(time_sim), level=2)
@@ -454,12 +633,22 @@ class Scaffold:
             return
         # Create an ID for each cell.
         cell_ids = self._allocate_ids(positions.shape[0])
-        # Spoof old cache
-        cell_data = np.column_stack((cell_ids, np.zeros(positions.shape[0]), positions))
-        # Cache them per type
-        self.cells_by_type[cell_type.name] = np.concatenate(
-            (self.cells_by_type[cell_type.name], cell_data)
-        )
+        if self._streaming:
+            self.output_formatter.append_placement(
+                cell_type, cell_ids, positions, rotations=rotations
+            )
+            self.cells_by_type.stored(cell_type.name)
+            if rotations is not None:
+                self.rotations.stored(cell_type.name)
+        else:
+            # Spoof old cache
+            cell_data = np.column_stack(
+                (cell_ids, np.zeros(positions.shape[0]), positions)
+            )
+            # Cache them per type
+            self.cells_by_type[cell_type.name] = np.concatenate(
+                (self.cells_by_type[cell_type.name], cell_data)
+            )
 
         placement_dict = self.statistics.cells_placed
         if cell_type.name not in placement_dict:
@@ -469,7 +658,7 @@ class Scaffold:
             setattr(cell_type.placement, "cells_placed", 0)
         cell_type.placement.cells_placed += cell_count
 
-        if rotations is not None:
+        if rotations is not None and not self._streaming:
             if cell_type.name not in self.rotations:
                 self.rotations[cell_type.name] = np.empty((0, 2))
             self.rotations[cell_type.name] = np.concatenate(
@@ -525,21 +714,45 @@ class Scaffold:
         # Keep track of relevant tags in the connection_type object
         if tag not in connection_type.tags:
             connection_type.tags.append(tag)
-        self._append_tagged("cell_connections_by_tag", tag, connectome_data)
-        if compartments is not None or morphologies is not None:
+        has_morphologies = compartments is not None or morphologies is not None
+        if has_morphologies:
             if len(morphologies) != len(connectome_data) or len(compartments) != len(
                 connectome_data
             ):
                 raise MorphologyDataError(
                     "The morphological data did not match the connectome data."
                 )
+        # Store the metadata internally until the output is compiled.
+        if meta is not None:
+            self._connectivity_set_meta[tag] = meta
+        if self._streaming:
+            self._stream_connections(
+                tag, connectome_data, compartments, morphologies, morpho_map
+            )
+            return
+        self._append_tagged("cell_connections_by_tag", tag, connectome_data)
+        if has_morphologies:
             self._append_mapped(
                 "connection_morphologies", tag, morphologies, use_map=morpho_map
             )
             self._append_tagged("connection_compartments", tag, compartments)
-        # Store the metadata internally until the output is compiled.
-        if meta is not None:
-            self._connectivity_set_meta[tag] = meta
+
+    def _stream_connections(self, tag, data, compartments, morphologies, morpho_map):
+        # Append a block of connections to the output instead of the network cache.
+        map_name = f"__map_{tag}"
+        if compartments is not None or morphologies is not None:
+            data_map = list(self.connection_morphologies.get(map_name, []))
+            morphologies = _map_block(data_map, morphologies, use_map=morpho_map)
+        else:
+            data_map = None
+        self.output_formatter.append_connections(
+            tag, data, compartments, morphologies, data_map
+        )
+        self.cell_connections_by_tag.stored(tag)
+        if data_map is not None:
+            self.connection_compartments.stored(tag)
+            self.connection_morphologies.stored(tag)
+            self.connection_morphologies.stored(map_name)
 
     def create_entities(self, cell_type, count):
         """
@@ -559,8 +772,11 @@ class Scaffold:
         # Create an ID for each entity.
         entities_ids = self._allocate_ids(count)
 
+        if self._streaming:
+            self.output_formatter.append_placement(cell_type, entities_ids)
+            self.entities_by_type.stored(cell_type.name)
         # Cache them per type
-        if not cell_type.name in self.entities_by_type:
+        elif not cell_type.name in self.entities_by_type:
             self.entities_by_type[cell_type.name] = entities_ids
         else:
             self.entities_by_type[cell_type.name] = np.concatenate(
@@ -597,22 +813,7 @@ class Scaffold:
         map_name = f"__map_{tag}"
         if map_name not in attr_data:
             attr_data[map_name] = []
-        # Map data
-        if use_map:
-            data_map = use_map
-            if len(data):
-                # Using `+` on empty dataset errors
-                data += len(attr_data[map_name])
-            mapped_data = np.array(data, dtype=int)
-        else:
-            if data.dtype.type is np.string_:
-                # Explicitly cast numpy strings to str so they don't yield
-                # `b'morphology_name'` when stored as attribute by hdf5.
-                data = data.astype(str)
-            mapped_data, data_map = map_ndarray(data, _map=attr_data[map_name])
-            mapped_data = np.array(mapped_data, dtype=int)
-        attr_data[map_name].extend(data_map)
-
+        mapped_data = _map_block(attr_data[map_name], data, use_map=use_map)
         # Append data
         if tag in attr_data:
             cache = attr_data[tag]
@@ -655,7 +856,7 @@ class Scaffold:
             raise TypeNotFoundError(
                 "Attempting to load unknown cell type '{}'".format(name)
             )
-        if self.cells_by_type[name].shape[0] == 0:
+        if self.cells_by_type[name].shape[0] == 0 and not self._streaming:
             if not self.output_formatter.exists():
                 return self.cells_by_type[name]
             if self.output_formatter.has_cells_of_type(name):
@@ -677,7 +878,7 @@ class Scaffold:
             raise TypeNotFoundError(
                 "Attempting to load unknown entity type '{}'".format(name)
             )
-        if self.entities_by_type[name].shape[0] == 0:
+        if self.entities_by_type[name].shape[0] == 0 and not self._streaming:
             if not self.output_formatter.exists():
                 return self.entities_by_type[name]
             if self.output_formatter.has_cells_of_type(name, entity=True):
@@ -699,6 +900,9 @@ class Scaffold:
         this object.
         """
         self.output_formatter.create_output()
+        if self._streaming:
+            for cache in self._stored_caches:
+                getattr(self, cache).release()
 
     def partial_placement(self, place_types, append=False):
         if append:
@@ -733,6 +937,8 @@ class Scaffold:
                 "Coming in v4. Open an issue on GitHub if you require partial"
                 + "(re)connects with append before v4."
             )
+        if self._streaming:
+            self._stop_streaming()
         oc = self.cell_connections_by_tag
         self.cell_connections_by_tag = {
             cnt: np.zeros((0, 2), dtype=float)
@@ -187,3 +187,62 @@ def get_distances(candidates, point):
     Return the distances of a list of points to a common point
     """
     return [np.sqrt(np.sum((np.array(c) - point) ** 2)) for c in candidates]
+
+
+def query_radius_pairs(tree, points, radius):
+    """
+    Find all pairs of query points and tree points within a radius of each other.
+
+    :param tree: Tree of the points to find.
+    :type tree: :class:`sklearn.neighbors.KDTree`
+    :returns: The indices of the query points and of the tree points of each pair.
+    :rtype: tuple of numpy.ndarray
+    """
+    if not len(points):
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    hits = tree.query_radius(points, radius)
+    counts = np.fromiter(map(len, hits), dtype=int, count=len(hits))
+    return (
+        np.repeat(np.arange(len(points)), counts),
+        np.concatenate(hits).astype(int),
+    )
+
+
+def group_ranks(groups):
+    """
+    Return the position of each element of a sorted array within its run of equal
+    values, e.g. ``[3, 3, 5, 5, 5]`` gives ``[0, 1, 0, 1, 2]``.
+    """
+    groups = np.asarray(groups)
+    if not len(groups):
+        return np.empty(0, dtype=int)
+    starts = np.concatenate(([True], groups[1:] != groups[:-1]))
+    first = np.nonzero(starts)[0]
+    return np.arange(len(groups)) - np.repeat(
+        first, np.diff(np.append(first, len(groups)))
+    )
+
+
+def window_join(coordinates, lower, upper, closed=True):
+    """
+    Find all pairs of points and windows where the coordinate of the point lies in the
+    window, by searching the window bounds in the sorted coordinates.
+
+    :param coordinates: Coordinate of each point.
+    :param lower: Lower bound of each window.
+    :param upper: Upper bound of each window.
+    :param closed: Whether points on the bounds lie in the windows.
+    :type closed: bool
+    :returns: The point index and window index of each pair, grouped by window.
+    :rtype: numpy.ndarray of shape (N, 2)
+    """
+    coordinates = np.asarray(coordinates)
+    order = np.argsort(coordinates, kind="stable")
+    ordered = coordinates[order]
+    starts = np.searchsorted(ordered, lower, side="left" if closed else "right")
+    ends = np.searchsorted(ordered, upper, side="right" if closed else "left")
+    counts = np.maximum(ends - starts, 0)
+    pairs = np.empty((np.sum(counts), 2), dtype=int)
+    pairs[:, 1] = np.repeat(np.arange(len(counts)), counts)
+    pairs[:, 0] = order[np.repeat(starts, counts) + group_ranks(pairs[:, 1])]
+    return pairs
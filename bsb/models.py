@@ -10,6 +10,7 @@ from .helpers import (
     count_continuity_list,
     iterate_continuity_list,
 )
+from .functions import group_ranks
 from .exceptions import *
 
 
@@ -204,6 +205,64 @@ class Resource:
                 d = d.astype(dtype)
             return d
 
+    def get_view(self, transform=None):
+        """
+        Return a cached, read-only array of the full dataset. Repeated calls return the
+        same array until the resource is written to.
+
+        :param transform: Function applied to the data before it is cached.
+        :type transform: callable
+        """
+        try:
+            return self._handler.get_view(self._path, transform)
+        except KeyError:
+            raise DatasetNotFoundError(
+                "Dataset '{}' not found in '{}'.".format(self._path, self._handler.file)
+            ) from None
+
+    def get_rows(self, rows):
+        """
+        Read only the given rows of the dataset. Runs of nearby rows are read with a
+        hyperslab selection each, so that at most ``_ROW_GAP`` times as many rows as
+        requested are read.
+
+        :param rows: Indices of the rows, in any order.
+        :returns: The rows, in the given order.
+        :rtype: numpy.ndarray
+        """
+        rows = np.asarray(rows, dtype=int).reshape(-1)
+        order = np.argsort(rows, kind="stable")
+        with self._handler.load("r") as f:
+            if not self._path in f():
+                raise DatasetNotFoundError(
+                    "Dataset '{}' not found in '{}'.".format(
+                        self._path, self._handler.file
+                    )
+                )
+            data = _read_sorted_rows(f()[self._path], rows[order])
+        result = np.empty_like(data)
+        result[order] = data
+        return result
+
+    def get_slices(self, starts, stops):
+        """
+        Read only the ``[start, stop)`` slices of the dataset, with a hyperslab
+        selection per run of adjacent slices.
+
+        :returns: The concatenated slices, in the given order.
+        :rtype: numpy.ndarray
+        """
+        starts = np.asarray(starts, dtype=int).reshape(-1)
+        stops = np.asarray(stops, dtype=int).reshape(-1)
+        with self._handler.load("r") as f:
+            if not self._path in f():
+                raise DatasetNotFoundError(
+                    "Dataset '{}' not found in '{}'.".format(
+                        self._path, self._handler.file
+                    )
+                )
+            return _read_slices(f()[self._path], starts, stops)
+
     @property
     def attributes(self):
         with self._handler.load("r") as f:
@@ -278,6 +337,158 @@ class Connection:
                 self.to_compartment = to_morphology.compartments[to_compartment]
 
 
+class ConnectionColumns:
+    """
+    Parallel arrays that describe the connections of a
+    :class:`~.models.ConnectivitySet`: the pre- & postsynaptic ``*_ids``, the
+    ``*_compartments`` ids, the ``*_sections`` ids and the ``*_morphologies`` indices
+    into ``morphologies``. Missing compartment data is represented by ``-1``.
+    """
+
+    def __init__(
+        self,
+        from_ids,
+        to_ids,
+        from_compartments=None,
+        to_compartments=None,
+        from_morphologies=None,
+        to_morphologies=None,
+        morphologies=None,
+    ):
+        self.from_ids = np.asarray(from_ids, dtype=int)
+        self.to_ids = np.asarray(to_ids, dtype=int)
+        self.from_compartments = self._column(from_compartments)
+        self.to_compartments = self._column(to_compartments)
+        self.from_morphologies = self._column(from_morphologies)
+        self.to_morphologies = self._column(to_morphologies)
+        if np.any(self.from_compartments < -1) or np.any(self.to_compartments < -1):
+            raise RuntimeError("Invalid compartment data")
+        self.morphologies = morphologies if morphologies is not None else {}
+        self._section_tables = {}
+        self.from_sections = self._lookup_sections(
+            self.from_morphologies, self.from_compartments
+        )
+        self.to_sections = self._lookup_sections(
+            self.to_morphologies, self.to_compartments
+        )
+
+    def __len__(self):
+        return len(self.from_ids)
+
+    def _column(self, data):
+        if data is None:
+            return np.full(len(self.from_ids), -1, dtype=int)
+        return np.asarray(data, dtype=int)
+
+    def _get_section_table(self, morphology):
+        if morphology not in self._section_tables:
+            self._section_tables[morphology] = np.array(
+                [
+                    -1 if c.section_id is None else c.section_id
+                    for c in self.morphologies[morphology].compartments
+                ],
+                dtype=int,
+            )
+        return self._section_tables[morphology]
+
+    def _lookup_sections(self, morphologies, compartments):
+        # Resolve the section ids with a lookup table per morphology.
+        sections = np.full(len(compartments), -1, dtype=int)
+        for morphology in np.unique(morphologies):
+            if morphology == -1:
+                continue
+            rows = np.nonzero(morphologies == morphology)[0]
+            rows = rows[compartments[rows] != -1]
+            table = self._get_section_table(morphology)
+            sections[rows] = table[compartments[rows]]
+        return sections
+
+    def get_compartment(self, morphology, compartment):
+        """
+        Return the compartment object for a morphology index and compartment id.
+        """
+        if morphology == -1 or compartment == -1:
+            return NilCompartment()
+        return self.morphologies[morphology].compartments[compartment]
+
+    def get_from_compartment(self, i):
+        """
+        Return the presynaptic compartment object of the i-th connection.
+        """
+        return self.get_compartment(self.from_morphologies[i], self.from_compartments[i])
+
+    def get_to_compartment(self, i):
+        """
+        Return the postsynaptic compartment object of the i-th connection.
+        """
+        return self.get_compartment(self.to_morphologies[i], self.to_compartments[i])
+
+
+class ConnectionIndex:
+    """
+    Sorted index of the connections of a :class:`~.models.ConnectivitySet` by the
+    cell ids of one of its columns, in CSR layout: the connections of ``ids[i]`` are
+    the ``order[offsets[i]:offsets[i + 1]]`` rows of the connectivity set, sorted by
+    partner cell. ``partners`` holds the number of distinct partners of each cell.
+    """
+
+    datasets = ("ids", "offsets", "order", "partners")
+
+    def __init__(self, ids, offsets, order, partners):
+        self.ids = np.asarray(ids, dtype=int)
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.order = np.asarray(order, dtype=int)
+        self.partners = np.asarray(partners, dtype=int)
+
+    @classmethod
+    def build(cls, cells, partners):
+        """
+        Index connections by ``cells``, the cell id column, sorting the connections
+        of each cell by ``partners``, the other cell id column.
+        """
+        cells = np.asarray(cells, dtype=int)
+        partners = np.asarray(partners, dtype=int)
+        order = np.lexsort((partners, cells))
+        cells, partners = cells[order], partners[order]
+        ids, starts = np.unique(cells, return_index=True)
+        # Count each change of partner within the run of connections of a cell.
+        new = np.ones(len(order), dtype=int)
+        new[1:] = (cells[1:] != cells[:-1]) | (partners[1:] != partners[:-1])
+        counts = np.add.reduceat(new, starts) if len(starts) else np.empty(0, int)
+        return cls(ids, np.append(starts, len(order)), order, counts)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _rows(self, ids):
+        # The row of each cell id, and whether the cell has any connections at all.
+        ids = np.asarray(ids, dtype=int).reshape(-1)
+        if not len(self.ids):
+            return np.zeros(len(ids), dtype=int), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return rows, self.ids[rows] == ids
+
+    def degrees(self, ids):
+        """
+        Return the number of connections of each cell id, 0 for unconnected cells.
+        """
+        rows, known = self._rows(ids)
+        if not len(self.ids):
+            return rows
+        return np.where(known, self.offsets[rows + 1] - self.offsets[rows], 0)
+
+    def select(self, ids):
+        """
+        Return the rows of the connections of the given cell ids, in the order of the
+        cell ids and then of the partner cells.
+        """
+        rows, _ = self._rows(ids)
+        slices = np.repeat(np.arange(len(rows)), self.degrees(ids))
+        if not len(slices):
+            return np.empty(0, dtype=int)
+        return self.order[self.offsets[rows][slices] + group_ranks(slices)]
+
+
 class ConnectivitySet(Resource):
     """
     Connectivity sets store connections.
@@ -291,6 +502,8 @@ class ConnectivitySet(Resource):
         self.tag = tag
         self.compartment_set = Resource(handler, "/cells/connection_compartments/" + tag)
         self.morphology_set = Resource(handler, "/cells/connection_morphologies/" + tag)
+        self.index_path = "/cells/connection_index/" + tag
+        self._indices = {}
 
     def has_compartment_data(self):
         """
@@ -314,14 +527,14 @@ class ConnectivitySet(Resource):
         """
         Return a list with the presynaptic identifier of each connection.
         """
-        return self.get_dataset(dtype=int)[:, 0]
+        return self.get_view(_int_array)[:, 0]
 
     @property
     def to_identifiers(self):
         """
         Return a list with the postsynaptic identifier of each connection.
         """
-        return self.get_dataset(dtype=int)[:, 1]
+        return self.get_view(_int_array)[:, 1]
 
     @property
     def intersections(self):
@@ -331,6 +544,52 @@ class ConnectivitySet(Resource):
         """
         return self.get_intersections()
 
+    def get_columns(self, rows=None):
+        """
+        Return the connections as :class:`~.models.ConnectionColumns`, parallel arrays
+        of identifiers, compartments, sections and morphologies.
+
+        :param rows: Read only these rows of the connectivity set.
+        """
+        if rows is None:
+            read = Resource.get_view
+        else:
+            read = lambda resource: resource.get_rows(rows)
+        return self._read_columns(read, self, self.compartment_set, self.morphology_set)
+
+    def _read_columns(self, read, cell_set, compartment_set, morphology_set):
+        cells = read(cell_set)
+        if not compartment_set.exists():
+            return ConnectionColumns(cells[:, 0], cells[:, 1])
+        comp_data = read(compartment_set)
+        morpho_data = read(morphology_set)
+        names = self.morphology_set.get_attribute("map")
+        repo = self.scaffold.morphology_repository
+        morphologies = {}
+        for id in np.unique(morpho_data):
+            if id == -1:
+                continue
+            name = names[id]
+            if isinstance(name, bytes):
+                name = name.decode("UTF-8")
+            morphologies[id] = repo.get_morphology(name)
+        return ConnectionColumns(
+            cells[:, 0],
+            cells[:, 1],
+            comp_data[:, 0],
+            comp_data[:, 1],
+            morpho_data[:, 0],
+            morpho_data[:, 1],
+            morphologies,
+        )
+
+    @property
+    def columns(self):
+        """
+        Return the connections as :class:`~.models.ConnectionColumns`.
+        """
+        return self.get_columns()
+
     def get_intersections(self):
         intersections = []
         morphos = {-1: None}
@@ -345,10 +604,10 @@ class ConnectivitySet(Resource):
                     name = name.decode("UTF-8")
                 morphos[id] = self.scaffold.morphology_repository.get_morphology(name)
 
-        cells = self.get_dataset()
+        cells = self.get_view()
         if self.has_compartment_data():
-            comp_data = self.compartment_set.get_dataset()
-            morpho_data = self.morphology_set.get_dataset()
+            comp_data = self.compartment_set.get_view()
+            morpho_data = self.morphology_set.get_view()
         else:
             comp_data = np.ones(cells.shape) * -1
             morpho_data = np.ones(cells.shape) * -1
@@ -370,11 +629,115 @@ class ConnectivitySet(Resource):
             )
         return intersections
 
+    def _has_stored_index(self, path):
+        # The stored index is only valid if it was built from the current connections:
+        # with the same amount of connections and the same write count.
+        with self._handler.load("r") as f:
+            if path not in f():
+                return False
+            index_attrs, attrs = f()[path].attrs, f()[self._path].attrs
+            return (
+                index_attrs.get("connections") == len(self)
+                and "version" in index_attrs
+                and index_attrs["version"] == attrs.get("version")
+            )
+
+    def _get_index(self, direction, column):
+        # Use the index stored at compile time if it indexes the current connections,
+        # otherwise build it in memory. Either is cached until the next write.
+        version = self._handler.get_version()
+        cached = self._indices.get(direction)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        path = self.index_path + "/" + direction
+        if self._has_stored_index(path):
+            index = ConnectionIndex(
+                *(
+                    self._handler.get_view(path + "/" + name)
+                    for name in ConnectionIndex.datasets
+                )
+            )
+        else:
+            cells = self.get_view(_int_array)
+            index = ConnectionIndex.build(cells[:, column], cells[:, 1 - column])
+        self._indices[direction] = (version, index)
+        return index
+
+    @property
+    def outgoing_index(self):
+        """
+        The :class:`~.models.ConnectionIndex` of the connections by presynaptic id.
+        """
+        return self._get_index("outgoing", 0)
+
+    @property
+    def incoming_index(self):
+        """
+        The :class:`~.models.ConnectionIndex` of the connections by postsynaptic id.
+        """
+        return self._get_index("incoming", 1)
+
+    def outgoing(self, ids):
+        """
+        Return the rows of the connections that start from the given presynaptic ids.
+        """
+        return self.outgoing_index.select(ids)
+
+    def incoming(self, ids):
+        """
+        Return the rows of the connections that end on the given postsynaptic ids.
+        """
+        return self.incoming_index.select(ids)
+
+    def get_outgoing_columns(self, ids):
+        """
+        Return the :class:`~.models.ConnectionColumns` of the connections that start
+        from the given presynaptic ids, in the order of the outgoing index.
+        """
+        return self._get_index_columns("outgoing", 0, ids)
+
+    def get_incoming_columns(self, ids):
+        """
+        Return the :class:`~.models.ConnectionColumns` of the connections that end on
+        the given postsynaptic ids, in the order of the incoming index.
+        """
+        return self._get_index_columns("incoming", 1, ids)
+
+    def _get_index_columns(self, direction, column, ids):
+        # The rows of the connections of each cell are a contiguous slice of the order
+        # of the stored index: read only those slices, and then only those rows.
+        ids = np.unique(np.asarray(ids, dtype=int))
+        path = self.index_path + "/" + direction
+        if not self._has_stored_index(path):
+            return self.get_columns(self._get_index(direction, column).select(ids))
+        index = ConnectionIndex(
+            self._handler.get_view(path + "/ids"),
+            self._handler.get_view(path + "/offsets"),
+            [],
+            [],
+        )
+        cells, known = index._rows(ids)
+        cells = cells[known]
+        order = Resource(self._handler, path + "/order")
+        rows = order.get_slices(index.offsets[cells], index.offsets[cells + 1])
+        return self.get_columns(rows)
+
+    def get_out_degrees(self, ids):
+        """
+        Return the number of connections that start from each of the given ids.
+        """
+        return self.outgoing_index.degrees(ids)
+
+    def get_in_degrees(self, ids):
+        """
+        Return the number of connections that end on each of the given ids.
+        """
+        return self.incoming_index.degrees(ids)
+
     def get_divergence_list(self):
         presynaptic_type = self.get_presynaptic_types()[0]
         placement_set = self.scaffold.get_placement_set(presynaptic_type)
-        unique_connections = np.unique(self.get_dataset(), axis=0)
-        _, divergence_list = np.unique(unique_connections[:, 0], return_counts=True)
+        divergence_list = self.outgoing_index.partners
         return np.concatenate(
             (divergence_list, np.zeros(len(placement_set) - len(divergence_list)))
         )
@@ -389,8 +752,7 @@ class ConnectivitySet(Resource):
     def get_convergence_list(self):
         postsynaptic_type = self.get_postsynaptic_types()[0]
         placement_set = self.scaffold.get_placement_set(postsynaptic_type)
-        unique_connections = np.unique(self.get_dataset(), axis=0)
-        _, convergence_list = np.unique(unique_connections[:, 1], return_counts=True)
+        convergence_list = self.incoming_index.partners
         return np.concatenate(
             (convergence_list, np.zeros(len(placement_set) - len(convergence_list)))
         )
@@ -482,11 +844,10 @@ class PlacementSet(Resource):
         self._filter = f = _Filter()
 
         def id_source():
-            return np.array(
-                expand_continuity_list(self._identifiers.get_dataset()), dtype=int
-            )
+            return self._identifiers.get_view(_expand_identifiers)
 
         self._filter.filter_source = id_source
+        self._filter.get_version = handler.get_version
         self.identifier_set = _FilteredIds(handler, root + tag + "/identifiers", f)
         self.positions_set = _FilteredResource(handler, root + tag + "/positions", f)
         self.rotation_set = _FilteredResource(handler, root + tag + "/rotations", f)
@@ -496,7 +857,7 @@ class PlacementSet(Resource):
         """
         Return a list of cell identifiers.
         """
-        return self.identifier_set.get_dataset()
+        return self.identifier_set.get_view()
 
     @property
     def positions(self):
@@ -504,7 +865,7 @@ class PlacementSet(Resource):
         Return a dataset of cell positions.
         """
         try:
-            return self.positions_set.get_dataset()
+            return self.positions_set.get_view()
         except DatasetNotFoundError:
             raise DatasetNotFoundError(
                 "No position information for the '{}' placement set.".format(self.tag)
@@ -519,7 +880,7 @@ class PlacementSet(Resource):
            cell type.
         """
         try:
-            return self.rotation_set.get_dataset()
+            return self.rotation_set.get_view()
         except DatasetNotFoundError:
             raise DatasetNotFoundError(
                 "No rotation information for the '{}' placement set.".format(self.tag)
@@ -536,7 +897,7 @@ class PlacementSet(Resource):
         ]
 
     def __iter__(self):
-        id_iter = iterate_continuity_list(self._identifiers.get_dataset())
+        id_iter = iterate_continuity_list(self._identifiers.get_view())
         iterators = [iter(id_iter), self._none(), self._none()]
         if self.positions_set.exists():
             iterators[1] = iter(self.positions)
@@ -545,7 +906,7 @@ class PlacementSet(Resource):
         return zip(*iterators)
 
     def __len__(self):
-        return count_continuity_list(self._identifiers)
+        return int(np.sum(self._identifiers.get_view()[1::2]))
 
     def _none(self):
         """
@@ -557,6 +918,30 @@ class PlacementSet(Resource):
     def set_filter(self, filter):
         self._filter.active_filter = filter
 
+    def get_cell_rows(self, ids):
+        """
+        Return the row of each of the given cell ids in the datasets of this set, or -1
+        for the ids that are not in this set. Ignores the filter.
+        """
+        return _identifier_rows(self._identifiers.get_view(), ids)
+
+    def select_cells(self, ids):
+        """
+        Read only the cells of this set that are among the given ids, without loading
+        the positions of the other cells. Ignores the filter.
+
+        :returns: The sorted ids of the selected cells and their positions, or ``None``
+          if this set has no positions.
+        :rtype: tuple
+        """
+        ids = np.unique(np.asarray(ids, dtype=int))
+        rows = self.get_cell_rows(ids)
+        ids, rows = ids[rows != -1], rows[rows != -1]
+        positions_set = Resource(self._handler, self._path + "/positions")
+        if not positions_set.exists():
+            return ids, None
+        return ids, positions_set.get_rows(rows)
+
 
 class _Filter:
     """
@@ -568,23 +953,63 @@ class _Filter:
     `data` should be parallel arrays)
     """
 
-    active_filter = None
     filter_source = None
+    get_version = None
+
+    def __init__(self):
+        self._active_filter = None
+        self._mask = None
+        # Incremented each time the filter changes, to invalidate filtered views.
+        self.generation = 0
+
+    @property
+    def active_filter(self):
+        return self._active_filter
+
+    @active_filter.setter
+    def active_filter(self, value):
+        self._active_filter = value
+        self._mask = None
+        self.generation += 1
+
+    def get_mask(self):
+        """
+        Return the boolean mask of the active filter. The mask is computed once and
+        reused until the filter changes or the data is written to.
+        """
+        version = self.get_version() if self.get_version is not None else None
+        if self._mask is None or self._mask[0] != version:
+            mask = np.isin(self.filter_source(), self.active_filter())
+            self._mask = (version, mask)
+        return self._mask[1]
 
     def filter(self, data):
         if self.active_filter is None:
             return data
-        return data[np.isin(self.filter_source(), self.active_filter())]
+        return data[self.get_mask()]
 
 
 class _FilteredResource(Resource):
     def __init__(self, handler, path, filter):
         super().__init__(handler, path)
         self._filter = filter
+        self._filtered_view = None
 
     def get_dataset(self, *args, **kwargs):
         return self._filter.filter(super().get_dataset(*args, **kwargs))
 
+    def get_view(self, transform=None):
+        view = super().get_view(transform)
+        if self._filter.active_filter is None:
+            return view
+        key = (id(view), self._filter.generation)
+        if self._filtered_view is None or self._filtered_view[0] != key:
+            filtered = self._filter.filter(view)
+            filtered.flags.writeable = False
+            # Keep a reference to `view` so that its id stays unique.
+            self._filtered_view = (key, filtered, view)
+        return self._filtered_view[1]
+
 
 class _FilteredIds(_FilteredResource):
     def get_dataset(self, *args, **kwargs):
@@ -593,6 +1018,58 @@ class _FilteredIds(_FilteredResource):
         )
         return self._filter.filter(data)
 
+    def get_view(self):
+        return super().get_view(_expand_identifiers)
+
+
+def _expand_identifiers(data):
+    # Vectorized version of `expand_continuity_list` for the (start, count) pairs.
+    starts, counts = np.asarray(data, dtype=int).reshape(-1, 2).T
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(np.sum(counts), dtype=int)
+
+
+def _int_array(data):
+    return np.asarray(data, dtype=int)
+
+
+# Rows that are at most this many rows apart are read in the same hyperslab.
+_ROW_GAP = 16
+
+
+def _read_sorted_rows(dataset, rows):
+    if not len(rows):
+        return np.empty((0, *dataset.shape[1:]), dtype=dataset.dtype)
+    runs = np.split(rows, np.nonzero(np.diff(rows) > _ROW_GAP)[0] + 1)
+    return np.concatenate([dataset[run[0] : run[-1] + 1][run - run[0]] for run in runs])
+
+
+def _read_slices(dataset, starts, stops):
+    if not len(starts):
+        return np.empty((0, *dataset.shape[1:]), dtype=dataset.dtype)
+    # Join each slice that continues the previous slice onto it.
+    breaks = np.nonzero(starts[1:] != stops[:-1])[0]
+    starts = np.append(starts[0], starts[breaks + 1])
+    stops = np.append(stops[breaks], stops[-1])
+    return np.concatenate([dataset[start:stop] for start, stop in zip(starts, stops)])
+
+
+def _identifier_rows(pairs, ids):
+    # The row of each id in the (start, count) pairs of a placement set, or -1.
+    starts, counts = np.asarray(pairs, dtype=int).reshape(-1, 2).T
+    ids = np.asarray(ids, dtype=int).reshape(-1)
+    rows = np.full(len(ids), -1, dtype=int)
+    if not len(starts):
+        return rows
+    offsets = np.cumsum(counts) - counts
+    order = np.argsort(starts)
+    stretch = np.searchsorted(starts[order], ids, side="right") - 1
+    found = stretch >= 0
+    stretch = order[np.maximum(stretch, 0)]
+    found &= ids - starts[stretch] < counts[stretch]
+    rows[found] = offsets[stretch[found]] + ids[found] - starts[stretch[found]]
+    return rows
+
 
 class Cell:
     def __init__(self, id, cell_type, position, rotation=None):
@@ -683,15 +1160,34 @@ class MorphologySet:
 
         # Function to load and voxelize a morphology
         def load_morpho(scaffold, morpho_ind, compartment_types=None):
-            m = scaffold.morphology_repository.get_morphology(
-                self._morphology_map[morpho_ind]
-            )
+            repo = scaffold.morphology_repository
+            m = repo.get_morphology(self._morphology_map[morpho_ind])
             m._set_index = morpho_ind
-            m.voxelize(N, compartments=m.get_compartments(compartment_types))
+            # Reuse the voxel clouds stored in the repository, only the master node
+            # stores new ones.
+            m.cloud = repo.get_voxel_cloud(
+                m, N, compartment_types, store=scaffold.is_mpi_master
+            )
             return m
 
         # Load and voxelize only the unique morphologies present in the morphology map.
-        self._morphologies = [
-            load_morpho(self.scaffold, i, compartment_types)
-            for i in range(len(self._morphology_map))
-        ]
+        def load_morphos():
+            return [
+                load_morpho(self.scaffold, i, compartment_types)
+                for i in range(len(self._morphology_map))
+            ]
+
+        # The master node stores the missing voxel clouds in the repository before the
+        # other nodes load them, and only continues once they are done reading.
+        comm = None
+        if getattr(self.scaffold, "has_mpi_installed", False):
+            comm = self.scaffold.MPI.COMM_WORLD
+        master = comm is None or self.scaffold.is_mpi_master
+        if master:
+            self._morphologies = load_morphos()
+        if comm is not None:
+            comm.Barrier()
+        if not master:
+            self._morphologies = load_morphos()
+        if comm is not None:
+            comm.Barrier()
@@ -1,5 +1,4 @@
-import math, numpy as np, random
-from .morphologies import Compartment
+import numpy as np
 
 
 def depth_first_branches(adjacency_list, node=0, return_visited=False):
@@ -67,9 +66,15 @@ def reduce_branch(branch, branch_points):
 
 
 class Branch:
-    def __init__(self, compartments, orientation, parent=None, ordered=True):
-        self.origin = compartments[0].start
-        self._compartments = compartments
+    """
+    An unbranched piece of fiber, stored as arrays of the start and end points of its
+    segments and the ids of the compartments that the segments are part of.
+    """
+
+    def __init__(self, starts, ends, ids, orientation=None, parent=None):
+        self.starts = np.array(starts, dtype=float).reshape(-1, 3)
+        self.ends = np.array(ends, dtype=float).reshape(-1, 3)
+        self.ids = np.array(ids, dtype=int)
         self.is_root = parent is None
         self._parent_branch = parent
         self.child_branches = []
@@ -77,259 +82,186 @@ class Branch:
             self.orientation = orientation
         else:
             self.orientation = parent.orientation
-        # Are the compartments provided in the order they are connected in?
-        if ordered:
-            # Iterate over the compartments to set the previous/next as parent/child.
-            for c in range(len(compartments) - 1):
-                compartments[c]._child = compartments[c + 1]
-            for c in range(1, len(compartments)):
-                compartments[c]._parent = compartments[c - 1]
-        # Polish the start and end of the branch
-        self._root = _get_root_compartment(compartments[0], compartments)
-        self._terminus = _get_terminal_compartment(compartments[-1], compartments)
-        self._root._parent = None
-        self._terminus._child = None
 
-    def add_branch(self, branch):
-        branch._parent_branch = self
-        self.child_branches.append(branch)
+    @property
+    def origin(self):
+        return self.starts[0]
 
-    def __iter__(self):
-        return iter(self.walk())
+    @property
+    def points(self):
+        """
+        The start points of the segments, followed by the end of the last segment.
+        """
+        return np.concatenate((self.starts, self.ends[-1:]))
 
-    def walk(self, start=None):
-        if start is None:
-            start = self._root
-        while start._child is not None:
-            yield start
-            start = start._child
-        yield start
+    def __len__(self):
+        return len(self.starts)
 
-    def append(self, compartment):
-        self._compartments.append(compartment)
-        self._terminus._child = compartment
-        compartment._parent = self._terminus
-        self._terminus = compartment
+    def add_branch(self, branch):
+        branch._parent_branch = self
+        self.child_branches.append(branch)
 
     def interpolate(self, resolution):
-        for comp in self._compartments:
-            length_comp = np.linalg.norm(comp.end - comp.start)
-            if length_comp > resolution + 1e-3:
-                num_to_add = math.ceil(length_comp / resolution)
-                added_points = self.split(comp, num_to_add)
-
-    def split(self, compartment, n):
         """
-        Split the compartment in n pieces and make those a part of the branch.
-
-        This function stores a link to the original compartment in the partial
-        compartments in the attribute `_original`.
+        Split the segments that are longer than the resolution into equal pieces.
+        """
+        lengths = np.linalg.norm(self.ends - self.starts, axis=1)
+        pieces = np.where(
+            lengths > resolution + 1e-3, np.ceil(lengths / resolution), 1
+        ).astype(int)
+        if np.all(pieces == 1):
+            return
+        segment = np.repeat(np.arange(len(pieces)), pieces)
+        # Index of each piece in its segment
+        piece = np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        steps = (self.ends - self.starts)[segment] / pieces[segment, None]
+        starts = self.starts[segment]
+        self.starts = starts + steps * piece[:, None]
+        ends = starts + steps * (piece[:, None] + 1)
+        # The last piece ends exactly on the end of the segment.
+        last = piece == pieces[segment] - 1
+        ends[last] = self.ends
+        self.ends = ends
+        self.ids = self.ids[segment]
+
+    def detach(self, segment):
+        """
+        Cut off the segments of this branch from the given segment onwards.
 
-        :param compartment: The compartment to split.
-        :type compartment: :class:`.morphologies.Compartment`
-        :param n: The amount of pieces to split the compartment into.
-        :type n: int
+        :param segment: Index of the first segment to cut off.
+        :type segment: int
+        :returns: A branch of the cut off segments.
         """
-        if n < 2:
-            raise ValueError("Compartments must be split in at least 2 parts.")
-        new_compartments = []
-        # For each dimension calculate n breakpoints between the start and end of the
-        # compartment. The arrays for each dimensions are then stacked as columns of a
-        # matrix with all the breakpoints. This matrix includes the start and end points
-        # themselves.
-        points = np.column_stack(
-            [
-                np.linspace(start, end, n + 1)
-                for start, end in zip(compartment.start, compartment.end)
-            ]
-        )
-        # Inside of the loop `last_compartment` is used as a parent for the new
-        # compartments. By providing the original compartment's parent as an initial
-        # condition, we will connect the first new compartment to the original parent,
-        # thus continuing the branch from the first new compartment.
-        last_compartment = compartment._parent
-        # Loop over the points and use every point except the last as the starting point
-        # for a new compartment. Then connect each new compartment to the previous
-        # compartment.
-        for i in range(len(points) - 1):
-            # Copy the compartment information but change start and end.
-            c = Compartment.from_template(compartment, start=points[i], end=points[i + 1])
-            new_compartments.append(c)
-            # Store a reference to the original compartment for back referencing.
-            c._original = compartment
-            # Connect the new child to its parent
-            c._parent = last_compartment
-            if last_compartment:
-                # Connect to the parent to its child
-                last_compartment._child = c
-            # Move up the pointer of the loop so that the next compartment is connected to
-            # the current one.
-            last_compartment = c
-        # Finally we should connect the last compartment to the child of the original
-        # compartment to continue the branch
-        last_compartment._child = compartment._child
-        # Remove the original compartment as a part of the branch
-        self._compartments.remove(compartment)
-        # Add the new compartments into the internal array of compartments
-        self._compartments.extend(new_compartments)
-        # Is the original compartment was the root of the branch?
-        if compartment is self._root:
-            # Then we need to replace the root with the first new compartment so that
-            # branch iteration starts from the new compartment.
-            self._root = new_compartments[0]
-
-    def detach(self, compartment):
-        if compartment is self._root or compartment._parent is None:
-            # We have been asked to detach ourselves from ourselves: that just yields our whole branch again
+        if segment == 0:
+            # We have been asked to detach ourselves from ourselves: that just yields our
+            # whole branch again
             return self
-        # Detach our parent from the cutoff point.
-        compartment._parent._child = None
-        self._terminus = compartment._parent
-        # Detach ourself from our parent.
-        compartment._parent = None
         detached_branch = Branch(
-            list(self.walk(start=compartment)), self.orientation, ordered=False
+            self.starts[segment:],
+            self.ends[segment:],
+            self.ids[segment:],
+            self.orientation,
         )
-        # Clean up all detached compartments that now belong to the detached branch
-        for detached_comp in detached_branch.walk():
-            self._compartments.remove(detached_comp)
+        self.starts = self.starts[:segment]
+        self.ends = self.ends[:segment]
+        self.ids = self.ids[:segment]
         return detached_branch
 
-    def voxelize(self, position, bounding_box, voxel_tree, map, voxel_list):
-        v_id = len(voxel_list)
-        for v, comp in enumerate(self._compartments):
-            # Check if the current bounding_box needs to be extended
-            bounding_box[0] = np.minimum(bounding_box[0], comp.end + position)
-            bounding_box[1] = np.maximum(bounding_box[1], comp.end + position)
-
-            # Find the external points of the voxel surrounding the compartment in absolute coordinates
-            voxel_bottom_left = np.minimum(comp.start, comp.end)
-            voxel_top_right = np.maximum(comp.start, comp.end)
+    def voxelize(self, position):
+        """
+        Return the boxes around each segment, translated to the given position.
 
-            voxel = tuple(
-                np.concatenate((voxel_bottom_left + position, voxel_top_right + position))
+        :returns: Lower and upper corners of each box.
+        :rtype: Array of shape (N, 6)
+        """
+        return np.column_stack(
+            (
+                np.minimum(self.starts, self.ends) + position,
+                np.maximum(self.starts, self.ends) + position,
             )
+        )
 
-            # Add the voxel to the tree
-            voxel_tree.insert(
-                v_id,
-                voxel,
-            )
-            map.append(comp)
-            voxel_list.append(voxel)
-            v_id += 1
-
-        return bounding_box, voxel_tree, map, voxel_list
-
-
-def _init_child_compartments(compartments):
-    # Reset/init child compartments
-    for c in compartments:
-        c._children = []
-    # Add child nodes to their parent's children
-    for node in compartments:
-        if node.parent not in compartments:
-            node.parent = None
-        if node.parent is not None:
-            node.parent._children.append(node)
-
-
-def _get_root_compartment(compartment, compartments):
-    while compartment.parent is not None and compartment.parent in compartments:
-        compartment = compartment.parent
-    return compartment
-
-
-def _get_single_child(compartment, compartments):
-    # Get the child either by the _child attribute, or the only element of _children
-    child = (
-        hasattr(compartment, "_child")
-        and compartment._child
-        or hasattr(compartment, "_children")
-        and len(compartment._children) == 1
-        and compartment._children[0]
-    )
-    # If a child was found this way, check if it is in the compartments array and return
-    # it, otherwise this function returns False
-    return child and child in compartments and child
-
-
-def _get_terminal_compartment(compartment, compartments):
-    result = compartment
-    child = _get_single_child(compartment, compartments)
-    while child:
-        result = child
-        child = _get_single_child(compartment, compartments)
-    return result
-
-
-def _consume_branch(unvisited, root_compartment, orientation, parent=None):
-    branch = Branch([root_compartment], orientation, parent=parent, ordered=False)
-    unvisited.remove(root_compartment)
-    root_compartment._parent = None
-    if len(root_compartment._children) > 0:
-        root_compartment._child = root_compartment._children[0]
-    compartment = root_compartment
-    while len(compartment._children) == 1:
-        next_compartment = compartment._children[0]
-        branch.append(next_compartment)
-        unvisited.remove(next_compartment)
-        compartment = next_compartment
-    if len(compartment._children) > 0:
-        for child in compartment._children:
-            child_branch = _consume_branch(unvisited, child, parent=branch)
-            branch.add_branch(child_branch)
-    branch._terminus._child = None
-    return branch
-
-
-def _copy_linked_compartments(compartments):
-    copy_map = {}
-    new_compartments = []
-    # Create a copy of each compartment
-    for c in compartments:
-        new_c = Compartment.from_template(c)
-        copy_map[new_c.id] = new_c
-        new_compartments.append(new_c)
-    # Overwrite each parent with a reference to the copied parent, or strip it
-    for c in new_compartments:
-        if c.parent is not None:
-            parent_id = c.parent.id
-            if parent_id in copy_map:
-                c.parent = copy_map[parent_id]
-            else:
-                c.parent = None
-    return new_compartments
+    def copy(self, parent=None):
+        """
+        Copy the branch and its child branches.
+        """
+        branch = Branch(
+            self.starts.copy(),
+            self.ends.copy(),
+            self.ids.copy(),
+            self.orientation,
+            parent=parent,
+        )
+        for child in self.child_branches:
+            branch.add_branch(child.copy(parent=branch))
+        return branch
 
 
 def create_root_branched_network(compartments, orientation):
-    root_branches = []
-    _init_child_compartments(compartments)
-    unvisited = set(compartments)
-    while len(unvisited) > 0:
-        starting_compartment = next(iter(unvisited))
-        root_compartment = _get_root_compartment(starting_compartment, compartments)
-        root_branch = _consume_branch(unvisited, root_compartment, orientation)
-        root_branches.append(root_branch)
-    return root_branches
+    """
+    Divide linked compartments into trees of unbranched :class:`Branches <.Branch>`.
+
+    :returns: The root branches.
+    :rtype: list
+    """
+    index = {c.id: i for i, c in enumerate(compartments)}
+    # Compartments whose parent isn't one of the compartments start a root branch.
+    parents = [
+        -1 if c.parent is None else index.get(c.parent.id, -1) for c in compartments
+    ]
+    children = [[] for _ in compartments]
+    for node, parent in enumerate(parents):
+        if parent >= 0:
+            children[parent].append(node)
+    starts = np.array([c.start for c in compartments], dtype=float).reshape(-1, 3)
+    ends = np.array([c.end for c in compartments], dtype=float).reshape(-1, 3)
+    ids = np.array([c.id for c in compartments], dtype=int)
+
+    def consume_branch(root, parent=None):
+        chain = [root]
+        while len(children[chain[-1]]) == 1:
+            chain.append(children[chain[-1]][0])
+        branch = Branch(
+            starts[chain], ends[chain], ids[chain], orientation, parent=parent
+        )
+        for child in children[chain[-1]]:
+            branch.add_branch(consume_branch(child, parent=branch))
+        return branch
+
+    return [consume_branch(node) for node, parent in enumerate(parents) if parent < 0]
+
+
+def flatten_branches(branches):
+    """
+    Return a depth-first flattened list of the branches and all their child branches.
+    """
+    all_branches = []
+    for branch in branches:
+        all_branches.append(branch)
+        all_branches.extend(flatten_branches(branch.child_branches))
+    return all_branches
 
 
 class FiberMorphology:
     def __init__(self, compartments, rotation):
-        compartments = _copy_linked_compartments(compartments)
+        self.root_branches = create_root_branched_network(compartments, None)
+        self.orient(rotation)
+
+    def orient(self, rotation):
+        """
+        Set the orientation of the fiber from the rotation angles of its cell.
+        """
         if rotation is None:
             orientation = None
         else:
             orientation = np.array(
                 [np.cos(rotation[0]), np.sin(rotation[0]), np.sin(rotation[1])]
             )
-        self.root_branches = create_root_branched_network(compartments, orientation)
-
-    def flatten(self, branches=None):
-        if branches is None:
-            branches = self.root_branches
-        compartments = []
-        for branch in branches:
-            compartments.extend(list(branch._compartments))
-            compartments.extend(self.flatten(branch.child_branches))
-        return compartments
+        for branch in self.get_branches():
+            branch.orientation = orientation
+
+    def copy(self):
+        """
+        Copy the fiber, so that it can be transformed without changing this fiber.
+        """
+        fiber = FiberMorphology.__new__(FiberMorphology)
+        fiber.root_branches = [branch.copy() for branch in self.root_branches]
+        return fiber
+
+    def get_branches(self):
+        """
+        Return a depth-first flattened list of all branches.
+        """
+        return flatten_branches(self.root_branches)
+
+    def flatten(self):
+        """
+        Return the start points, end points and compartment ids of all the segments
+        of the fiber, depth-first.
+        """
+        branches = self.get_branches()
+        return (
+            np.concatenate([b.starts for b in branches] + [np.empty((0, 3))]),
+            np.concatenate([b.ends for b in branches] + [np.empty((0, 3))]),
+            np.concatenate([b.ids for b in branches] + [np.empty(0, dtype=int)]),
+        )
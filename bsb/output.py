@@ -1,14 +1,15 @@
 from . import __version__
 from .reporting import warn
-from .helpers import ConfigurableClass, get_qualified_class_name
+from .helpers import ConfigurableClass, get_qualified_class_name, continuity_list
 from .morphologies import Morphology, Compartment, Branch
+from .voxels import VoxelCloud
 from .helpers import suppress_stdout
 from contextlib import contextmanager
 from abc import abstractmethod, ABC
-import h5py, os, time, pickle, random, numpy as np
+import h5py, os, time, pickle, random, hashlib, numpy as np
 from numpy import string_
 from .exceptions import *
-from .models import ConnectivitySet, PlacementSet
+from .models import ConnectivitySet, PlacementSet, ConnectionIndex
 from sklearn.neighbors import KDTree
 import os, sys, functools
 import itertools as it
@@ -20,6 +21,9 @@ class ResourceHandler(ABC):
     def __init__(self):
         self.handle_mode = None
         self._handle = None
+        # Number of times a writable handle was released, and the cached views.
+        self._writes = 0
+        self._views = {}
 
     @contextmanager
     def load(self, mode="r"):
@@ -41,6 +45,9 @@ class ResourceHandler(ABC):
             if restore_previous:
                 self.release_handle(self._handle)
                 self._handle = None
+                if mode != "r":
+                    self._writes += 1
+                    self._views = {}
                 if previous_mode is not None:
                     if previous_mode == "w":
                         # Continue appending instead of re-overwriting previous write.
@@ -55,6 +62,39 @@ class ResourceHandler(ABC):
         """
         pass
 
+    def get_version(self):
+        """
+        Return a token that changes whenever the resource is written to.
+        """
+        return self._writes
+
+    def get_view(self, path, transform=None):
+        """
+        Return a cached, read-only array of the data at ``path`` in the resource. The
+        cached array is reused until the resource is written to.
+
+        :param transform: Function applied to the data before it is cached.
+        :type transform: callable
+        """
+        version = self.get_version()
+        key = (path, transform)
+        cached = self._views.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        data = self.read_view(path)
+        if transform is not None:
+            data = np.asarray(transform(data))
+        data.flags.writeable = False
+        self._views[key] = (version, data)
+        return data
+
+    def read_view(self, path):
+        """
+        Read the data at ``path`` in the resource for :meth:`get_view`.
+        """
+        with self.load("r") as f:
+            return np.asarray(f()[path][()])
+
     @abstractmethod
     def release_handle(self, handle):
         """
@@ -77,6 +117,14 @@ class HDF5ResourceHandler(ResourceHandler):
         """
         return handle.close()
 
+    def get_version(self):
+        """
+        Return a token that changes whenever the file is written to, also by other
+        handlers or processes.
+        """
+        stat = os.stat(self.file)
+        return (self.file, self._writes, stat.st_mtime_ns, stat.st_size)
+
 
 class TreeHandler(ResourceHandler):
     """
@@ -449,30 +497,79 @@ class MorphologyRepository(HDF5TreeHandler):
             group = self._raw_morphology(name, handler)
             return _morphology(group)
 
-    def store_voxel_cloud(self, morphology, overwrite=False):
-        raise NotImplementedError("Voxel cloud storage is not yet reimplemented")
+    def get_voxel_cloud(self, morphology, N, labels=None, store=True):
+        """
+        Return the voxel cloud of the compartments with the given labels of a
+        morphology. The cloud is loaded from the repository if it was stored before
+        for the current version of the morphology, otherwise it is voxelized and, if
+        ``store`` is set, stored for the next time.
+
+        :param morphology: Morphology of this repository.
+        :type morphology: :class:`.morphologies.Morphology`
+        :param N: Number of voxels.
+        :type N: int
+        :param labels: Labels of the compartments to voxelize, all if omitted.
+        :type labels: list
+        :rtype: :class:`.voxels.VoxelCloud`
+        """
+        name = morphology.morphology_name
+        cloud_name = voxel_cloud_key(N, labels)
+        cloud = self.load_voxel_cloud(name, cloud_name)
+        if cloud is None:
+            cloud = VoxelCloud.create(
+                morphology, N, compartments=morphology.get_compartments(labels)
+            )
+            if store:
+                self.store_voxel_cloud(name, cloud_name, cloud, overwrite=True)
+        return cloud
+
+    def load_voxel_cloud(self, morphology_name, cloud_name):
+        """
+        Load a stored voxel cloud. Returns ``None`` if the cloud wasn't stored or if
+        the morphology changed since it was stored.
+        """
+        with self.load() as repo:
+            if not self.voxel_cloud_exists(morphology_name, cloud_name):
+                return None
+            group = self._raw_voxel_cloud(morphology_name, cloud_name, repo)
+            digest = _morphology_digest(self._raw_morphology(morphology_name, repo))
+            if group.attrs.get("morphology_digest") != digest:
+                return None
+            pointers = group["map_pointers"][()]
+            flat_map = group["map"][()].tolist()
+            voxel_map = [flat_map[a:b] for a, b in zip(pointers[:-1], pointers[1:])]
+            return VoxelCloud(
+                group.attrs["bounds"],
+                group["voxels"][()],
+                group.attrs["grid_size"],
+                voxel_map,
+            )
+
+    def store_voxel_cloud(self, morphology_name, cloud_name, cloud, overwrite=False):
+        """
+        Store a voxel cloud of a morphology under
+        ``morphologies/<morphology_name>/clouds/<cloud_name>``.
+        """
         with self.load("a") as repo:
-            if self.voxel_cloud_exists(morphology.morphology_name):
+            if self.voxel_cloud_exists(morphology_name, cloud_name):
                 if not overwrite:
-                    self.scaffold.warn(
-                        "Did not overwrite existing voxel cloud for '{}'".format(
-                            morphology.morphology_name
+                    warn(
+                        "Did not overwrite existing voxel cloud '{}' of '{}'".format(
+                            cloud_name, morphology_name
                         ),
                         RepositoryWarning,
                     )
                     return
-                else:
-                    del repo()["/morphologies/voxel_clouds/" + morphology.morphology_name]
-            voxel_cloud_group = repo()["/morphologies/voxel_clouds/"].create_group(
-                morphology.morphology_name
-            )
-            voxel_cloud_group.attrs["name"] = morphology.morphology_name
-            voxel_cloud_group.attrs["bounds"] = morphology.cloud.bounds
-            voxel_cloud_group.attrs["grid_size"] = morphology.cloud.grid_size
-            voxel_cloud_group.create_dataset("positions", data=morphology.cloud.voxels)
-            voxel_cloud_group.create_dataset(
-                "map", data=string_(pickle.dumps(morphology.cloud.map))
-            )
+                self.remove_voxel_cloud(morphology_name, cloud_name)
+            morphology_group = self._raw_morphology(morphology_name, repo)
+            group = morphology_group.require_group("clouds").create_group(cloud_name)
+            group.attrs["morphology_digest"] = _morphology_digest(morphology_group)
+            group.attrs["bounds"] = cloud.bounds
+            group.attrs["grid_size"] = cloud.grid_size
+            group.create_dataset("voxels", data=cloud.voxels)
+            lengths = [len(compartments) for compartments in cloud.map]
+            group.create_dataset("map_pointers", data=np.cumsum([0] + lengths))
+            group.create_dataset("map", data=np.fromiter(it.chain(*cloud.map), dtype=int))
 
     def morphology_exists(self, name):
         with self.load() as repo:
@@ -489,7 +586,7 @@ class MorphologyRepository(HDF5TreeHandler):
 
     def remove_voxel_cloud(self, morphology_name, cloud_name):
         with self.load("a") as repo:
-            if self.voxel_cloud_exists(name):
+            if self.voxel_cloud_exists(morphology_name, cloud_name):
                 del repo()[f"morphologies/{morphology_name}/clouds/{cloud_name}"]
 
     def list_morphologies(
@@ -537,7 +634,7 @@ class MorphologyRepository(HDF5TreeHandler):
                 yield from handle["/morphologies"].keys()
 
             def clouds(m):
-                return handle[f"/morphologies/{m}/clouds"].keys()
+                return handle[f"/morphologies/{m}"].get("clouds", {}).keys()
 
             return [m for m in morphos() if len(clouds(m)) > 0]
 
@@ -554,6 +651,40 @@ class MorphologyRepository(HDF5TreeHandler):
         return handler()[f"/morphologies/{morphology_name}/clouds/{cloud_name}"]
 
 
+def voxel_cloud_key(N, labels=None):
+    """
+    Return the name under which the voxel cloud of ``N`` voxels of the compartments
+    with the given labels is stored.
+    """
+    if labels is None:
+        return f"N{N}"
+    return f"N{N}:" + "+".join(sorted(labels))
+
+
+def _morphology_digest(m_root_group):
+    # Fingerprint the branch data of a stored morphology, so that its stored voxel
+    # clouds can be discarded when the morphology changes.
+    digest = hashlib.sha1()
+
+    def update(value):
+        value = np.asarray(value)
+        if value.dtype.kind == "O":
+            # Variable length strings.
+            value = np.array([str(v) for v in value.flat])
+        digest.update(np.ascontiguousarray(value).tobytes())
+
+    def visit(name, obj):
+        digest.update(name.encode())
+        for key in sorted(obj.attrs.keys()):
+            digest.update(key.encode())
+            update(obj.attrs[key])
+        if isinstance(obj, h5py.Dataset):
+            update(obj[()])
+
+    m_root_group["branches"].visititems(visit)
+    return digest.hexdigest()
+
+
 def _is_invalid_order(order):
     # Checks sequential order starting from zero. [] is also valid.
     #
@@ -720,15 +851,24 @@ class HDF5Formatter(OutputFormatter, MorphologyRepository):
     and an HDF5TreeHandler.
     """
 
+    casts = {"incremental": bool, "chunk_size": int}
+
     defaults = {
         "file": "scaffold_network_{}.hdf5".format(
             time.strftime("%Y_%m_%d-%H%M%S") + str(random.random()).split(".")[1]
         ),
         "simulator_output_path": False,
         "morphology_repository": None,
+        "incremental": False,
+        "chunk_size": 4096,
     }
 
+    _streaming = False
+    _changed_tags = frozenset()
+
     def create_output(self):
+        if self.is_streaming():
+            return self.update_output()
         was_compiled = self.exists()
         if was_compiled:
             with h5py.File("__backup__.hdf5", "w") as backup:
@@ -753,6 +893,276 @@ class HDF5Formatter(OutputFormatter, MorphologyRepository):
         if was_compiled:
             os.remove("__backup__.hdf5")
 
+    def is_streaming(self):
+        """
+        Check whether the output file is being written incrementally.
+        """
+        return self._streaming
+
+    def init_output(self):
+        """
+        Create an output file without any network data, to which the placement and
+        connectivity blocks can be appended as they are produced.
+        """
+        was_compiled = self.exists()
+        if was_compiled:
+            with h5py.File("__backup__.hdf5", "w") as backup:
+                with self.load() as repo:
+                    repo().copy("/morphologies", backup)
+
+        if self.save_file_as:
+            self.file = self.save_file_as
+
+        try:
+            with self.load("w") as output:
+                self.store_configuration()
+                cells_group = output().create_group("cells")
+                placement_group = cells_group.create_group("placement")
+                for cell_type in self.scaffold.get_cell_types():
+                    self._require_placement_group(placement_group, cell_type)
+                cells_group.create_group("connections")
+                cells_group.create_group("connection_compartments")
+                cells_group.create_group("connection_morphologies")
+                cells_group.create_group("connection_index")
+                cells_group.create_group("labels")
+                self.store_morphology_repository(was_compiled)
+        except:
+            os.remove(self.file)
+            raise
+
+        if was_compiled:
+            os.remove("__backup__.hdf5")
+        self._streaming = True
+        self._changed_tags = set()
+
+    def stop_streaming(self):
+        self._streaming = False
+
+    def update_output(self):
+        """
+        Store the parts of the network that are not appended as they are produced:
+        the labels, trees, statistics, appendices and any cached data that was
+        replaced in memory.
+        """
+        scf = self.scaffold
+        with self.load("a") as f:
+            cells_group = f()["cells"]
+            if "labels" in cells_group:
+                del cells_group["labels"]
+            self.store_labels(cells_group)
+            for name, data in scf.cells_by_type.pop_changes().items():
+                self._store_placement_data(cells_group, name, data[:, 0], data[:, 2:5])
+            for name, data in scf.entities_by_type.pop_changes().items():
+                self._store_placement_data(cells_group, name, data)
+            for name, data in scf.rotations.pop_changes().items():
+                group = cells_group["placement"][name]
+                if "rotations" in group:
+                    del group["rotations"]
+                self._create_chunked(group, "rotations", data, float)
+            self._store_changed_connections(cells_group)
+            if "statistics" in f():
+                del f()["statistics"]
+            for key in scf.appends.keys():
+                if key in f():
+                    del f()[key]
+        self.store_tree_collections(scf.trees.__dict__.values())
+        self.store_statistics()
+        self.store_appendices()
+
+    def _store_placement_data(self, cells_group, name, ids, positions=None):
+        cell_type = self.scaffold.get_cell_type(name)
+        group = cells_group["placement"][name]
+        for dataset in ("identifiers", "positions"):
+            if dataset in group:
+                del group[dataset]
+        self._require_placement_group(cells_group["placement"], cell_type)
+        self.append_placement(cell_type, ids, positions)
+
+    def _store_changed_connections(self, cells_group):
+        scf = self.scaffold
+        datasets = {
+            "connections": scf.cell_connections_by_tag.pop_changes(),
+            "connection_compartments": scf.connection_compartments.pop_changes(),
+            "connection_morphologies": scf.connection_morphologies.pop_changes(),
+        }
+        for group_name, changes in datasets.items():
+            group = cells_group[group_name]
+            # Store the maps after the data they belong to.
+            changes = sorted(changes.items(), key=lambda c: c[0].startswith("__map_"))
+            for tag, data in changes:
+                if tag.startswith("__map_"):
+                    tag = tag[len("__map_") :]
+                    self._changed_tags.add(tag)
+                    if tag not in group:
+                        self._create_chunked(group, tag, np.empty((0, 2)), int)
+                    group[tag].attrs["map"] = [str(x) for x in data]
+                    continue
+                self._changed_tags.add(tag)
+                attrs = dict(group[tag].attrs) if tag in group else {}
+                if tag in group:
+                    del group[tag]
+                dtype = float if group_name == "connections" else int
+                dataset = self._create_chunked(group, tag, data, dtype)
+                dataset.attrs.update(attrs)
+                if group_name == "connections":
+                    self._count_connection_write(dataset)
+        # Metadata can be added after the connections were appended. Only the tags
+        # that were appended to or replaced since the last update are indexed again.
+        for tag in sorted(self._changed_tags):
+            if tag in cells_group["connections"]:
+                self._store_connection_attributes(cells_group["connections"][tag])
+                self._store_connection_index(cells_group, tag)
+        self._changed_tags = set()
+
+    def _create_chunked(self, group, name, data, dtype):
+        # Create a dataset that can be resized along its first axis to append data to.
+        data = np.array(data, dtype=dtype)
+        shape = data.shape if data.ndim > 1 or len(data) else (0,)
+        return group.create_dataset(
+            name,
+            data=data.reshape(shape),
+            maxshape=(None, *shape[1:]),
+            chunks=(self.chunk_size, *shape[1:]),
+        )
+
+    def _append_chunked(self, group, name, data, dtype, width=None):
+        data = np.array(data, dtype=dtype)
+        if width is not None:
+            data = data.reshape(-1, width)
+        if name not in group:
+            return self._create_chunked(group, name, data, dtype)
+        dataset = group[name]
+        start = dataset.shape[0]
+        dataset.resize(start + len(data), axis=0)
+        dataset[start:] = data
+        return dataset
+
+    def _require_placement_group(self, placement_group, cell_type):
+        group = placement_group.require_group(cell_type.name)
+        if "identifiers" not in group:
+            self._create_chunked(group, "identifiers", [], np.int32)
+        if not cell_type.entity and "positions" not in group:
+            self._create_chunked(group, "positions", np.empty((0, 3)), float)
+        return group
+
+    def append_placement(self, cell_type, ids, positions=None, rotations=None):
+        """
+        Append a block of placed cells or entities to the output file.
+        """
+        with self.load("a") as f:
+            placement_group = f()["cells/placement"]
+            group = self._require_placement_group(placement_group, cell_type)
+            identifiers = group["identifiers"]
+            block = np.array(continuity_list(np.array(ids, dtype=int)), dtype=np.int32)
+            if len(identifiers) and len(block) and sum(identifiers[-2:]) == block[0]:
+                # The block continues the last stretch of ids: extend its count.
+                identifiers[-1] += block[1]
+                block = block[2:]
+            self._append_chunked(group, "identifiers", block, np.int32)
+            if positions is not None:
+                self._append_chunked(group, "positions", positions, float, width=3)
+            if rotations is not None:
+                self._append_chunked(group, "rotations", rotations, float, width=2)
+
+    def append_connections(
+        self, tag, connections, compartments=None, morphologies=None, morphology_map=None
+    ):
+        """
+        Append a block of connections, and optionally their compartments and mapped
+        morphologies, to the connectivity set ``tag`` in the output file.
+
+        :param morphology_map: The morphology names that the ``morphologies`` refer
+          to. Replaces the current map of the connectivity set.
+        :type morphology_map: list
+        """
+        if self.is_streaming():
+            self._changed_tags.add(tag)
+        with self.load("a") as f:
+            cells_group = f()["cells"]
+            dataset = self._append_chunked(
+                cells_group["connections"], tag, connections, float, width=2
+            )
+            self._store_connection_attributes(dataset)
+            self._count_connection_write(dataset)
+            if compartments is not None:
+                self._append_chunked(
+                    cells_group["connection_compartments"], tag, compartments, int, 2
+                )
+                morphology_dataset = self._append_chunked(
+                    cells_group["connection_morphologies"], tag, morphologies, int, 2
+                )
+                morphology_dataset.attrs["map"] = [str(x) for x in morphology_map]
+
+    def _store_connection_attributes(self, dataset):
+        scf = self.scaffold
+        tag = dataset.name.split("/")[-1]
+        related_types = [
+            conn_t
+            for conn_t in scf.configuration.connection_types.values()
+            if tag in conn_t.tags
+        ]
+        dataset.attrs["tag"] = tag
+        dataset.attrs["connection_types"] = [t.name for t in related_types]
+        dataset.attrs["connection_type_classes"] = list(
+            map(get_qualified_class_name, related_types)
+        )
+        if tag in scf._connectivity_set_meta:
+            meta_dict = scf._connectivity_set_meta[tag]
+            for key in meta_dict:
+                dataset.attrs[key] = meta_dict[key]
+
+    def _count_connection_write(self, dataset):
+        # Count the writes to a connectivity set, so that readers can tell whether its
+        # stored index was built from the current connections.
+        dataset.attrs["version"] = dataset.attrs.get("version", 0) + 1
+
+    def _store_connection_index(self, cells_group, tag):
+        # Store the order of the connections sorted by presynaptic id (CSR) and by
+        # postsynaptic id (CSC) so that connectivity sets can look up the connections
+        # of a cell. The index is tagged with the write count of the connections it
+        # was built from.
+        dataset = cells_group["connections"][tag]
+        connections = np.array(dataset[()], dtype=int).reshape(-1, 2)
+        index_group = cells_group.require_group("connection_index")
+        if tag in index_group:
+            del index_group[tag]
+        tag_group = index_group.create_group(tag)
+        for direction, column in (("outgoing", 0), ("incoming", 1)):
+            index = ConnectionIndex.build(
+                connections[:, column], connections[:, 1 - column]
+            )
+            group = tag_group.create_group(direction)
+            for name in ConnectionIndex.datasets:
+                group.create_dataset(name, data=getattr(index, name))
+            group.attrs["connections"] = len(connections)
+            group.attrs["version"] = dataset.attrs.get("version", 0)
+
+    def load_cache(self, cache, key):
+        """
+        Load the data of a network cache entry back from the output file.
+
+        :param cache: Name of the network cache, such as ``cells_by_type``.
+        :type cache: str
+        :param key: Cell type name or connection tag.
+        :type key: str
+        """
+        with self.load() as f:
+            cells_group = f()["cells"]
+            if cache in ("cells_by_type", "entities_by_type"):
+                entity = cache == "entities_by_type"
+                return self.get_cells_of_type(key, entity=entity)
+            if cache == "rotations":
+                return cells_group[f"placement/{key}/rotations"][()]
+            if cache == "cell_connections_by_tag":
+                if key not in cells_group["connections"]:
+                    return np.empty((0, 2))
+                return cells_group["connections"][key][()]
+            group = cells_group[cache]
+            if key.startswith("__map_"):
+                tag = key[len("__map_") :]
+                return list(group[tag].attrs["map"]) if tag in group else []
+            return group[key][()]
+
     def exists(self):
         return os.path.exists(self.file)
 
@@ -818,23 +1228,11 @@ class HDF5Formatter(OutputFormatter, MorphologyRepository):
         morphologies_group = cells_group.require_group("connection_morphologies")
         for tag, connectome_data in scf.cell_connections_by_tag.items():
             _map = f"__map_{tag}"
-            related_types = [
-                conn_t
-                for conn_t in scf.configuration.connection_types.values()
-                if tag in conn_t.tags
-            ]
             connection_dataset = connections_group.create_dataset(
                 tag, data=connectome_data
             )
-            connection_dataset.attrs["tag"] = tag
-            connection_dataset.attrs["connection_types"] = [t.name for t in related_types]
-            connection_dataset.attrs["connection_type_classes"] = list(
-                map(get_qualified_class_name, related_types)
-            )
-            if tag in scf._connectivity_set_meta:
-                meta_dict = scf._connectivity_set_meta[tag]
-                for key in meta_dict:
-                    connection_dataset.attrs[key] = meta_dict[key]
+            self._store_connection_attributes(connection_dataset)
+            self._count_connection_write(connection_dataset)
             if tag in scf.connection_compartments:
                 compartments_group.create_dataset(
                     tag, data=scf.connection_compartments[tag], dtype=int
@@ -845,6 +1243,7 @@ class HDF5Formatter(OutputFormatter, MorphologyRepository):
                 # Sanitize values to pure Python strings. H5py errors on numpy str
                 safe_map = [str(x) for x in scf.connection_morphologies[_map]]
                 morphology_dataset.attrs["map"] = safe_map
+            self._store_connection_index(cells_group, tag)
 
     def store_labels(self, cells_group):
         labels_group = cells_group.create_group("labels")
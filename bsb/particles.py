@@ -1,8 +1,10 @@
 import numpy as np
 from sklearn.neighbors import KDTree
+from scipy.spatial import cKDTree
 from rtree import index
 from random import choice
-from .reporting import report
+from .reporting import report, warn
+from .exceptions import *
 
 try:
     import plotly.graph_objects as go
@@ -369,6 +371,290 @@ class LargeParticleSystem(ParticleSystem):
         super().solve_collisions()
 
 
+class ArrayParticleSystem:
+    """
+    Particle system that stores its particles as parallel arrays of positions, radii
+    and types instead of :class:`.Particle` objects. Collisions are detected for all
+    particle pairs at once and resolved by displacing every colliding particle in
+    the same step, using the repulsion and inertia rules of :class:`.ParticleSystem`.
+
+    Has the same interface as :class:`.ParticleSystem`, but particles are referred to
+    by their index in the arrays. Random numbers are drawn from ``random_state``, a
+    :class:`numpy.random.RandomState`, or from the global NumPy generator if omitted.
+    """
+
+    def __init__(
+        self, track_displaced=False, scaffold=None, max_iterations=200, random_state=None
+    ):
+        self.particle_types = []
+        self.voxels = []
+        self.track_displaced = track_displaced
+        self.scaffold = scaffold
+        self.max_iterations = max_iterations
+        self._random = np.random if random_state is None else random_state
+        self.displaced_particles = np.empty(0, dtype=int)
+        self._reset_arrays(0)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def fill(self, voxels, particles):
+        # Amount of spatial dimensions, extracted from the dimensions of the first voxel
+        self.dimensions = len(voxels[0][0])
+        self.particle_types.extend(particles)
+        self.max_radius = max([pt["radius"] for pt in self.particle_types])
+        self.min_radius = min([pt["radius"] for pt in self.particle_types])
+        self.search_radius = self.max_radius * 2
+        self.voxels.extend([ParticleVoxel(v[0], v[1]) for v in voxels])
+        voxel_origins = np.array([v.origin for v in self.voxels], dtype=float)
+        voxel_sizes = np.array([v.size for v in self.voxels], dtype=float)
+        self._reset_arrays(self.dimensions)
+        for type_id, particle_type in enumerate(self.particle_types):
+            placement_voxels = np.array(particle_type["voxels"], dtype=int)
+            # Draw the same placement matrix as `ParticleSystem.fill`: the first column
+            # selects the voxel, the remaining columns position the particle in it.
+            placement_matrix = self._random.rand(
+                particle_type["count"], self.dimensions + 1
+            )
+            voxel_ids = placement_voxels[
+                (placement_matrix[:, 0] * len(placement_voxels)).astype(int)
+            ]
+            positions = (
+                voxel_origins[voxel_ids]
+                + placement_matrix[:, 1:] * voxel_sizes[voxel_ids]
+            )
+            self.add_particles(particle_type["radius"], positions, type=type_id)
+
+    def _reset_arrays(self, dimensions):
+        self._positions = np.empty((0, dimensions))
+        self._radii = np.empty(0)
+        self._types = np.empty(0, dtype=int)
+        self.colliding = np.zeros(0, dtype=bool)
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def radii(self):
+        return self._radii
+
+    @property
+    def volumes(self):
+        return sphere_volume(self._radii)
+
+    def add_particles(self, radius, positions, type=None):
+        positions = np.array(positions, dtype=float).reshape(-1, self.dimensions)
+        if type is None:
+            type = -1
+        elif not isinstance(type, (int, np.integer)):
+            type = self.particle_types.index(type)
+        self._positions = np.concatenate((self._positions, positions))
+        self._radii = np.concatenate((self._radii, np.full(len(positions), radius)))
+        self._types = np.concatenate((self._types, np.full(len(positions), type)))
+        self.colliding = np.zeros(len(self), dtype=bool)
+
+    def add_particle(self, radius, position, type=None):
+        self.add_particles(radius, [position], type=type)
+
+    def remove_particles(self, particles_id):
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(particles_id, dtype=int)] = False
+        self._positions = self._positions[keep]
+        self._radii = self._radii[keep]
+        self._types = self._types[keep]
+        self.colliding = self.colliding[keep]
+
+    def find_colliding_particles(self, freeze=False):
+        """
+        Find all particles that overlap with at least one other particle.
+
+        :returns: Indices of the colliding particles.
+        :rtype: :class:`numpy.ndarray`
+        """
+        tree = cKDTree(self._positions)
+        # Do an O(n * log(n)) search for all pairs within the maximum collision radius
+        self._pairs = pairs = tree.query_pairs(
+            r=self.search_radius, output_type="ndarray"
+        )
+        self._pair_vectors = vectors = (
+            self._positions[pairs[:, 0]] - self._positions[pairs[:, 1]]
+        )
+        self._pair_distances = distances = np.sqrt(np.sum(vectors ** 2, axis=1))
+        self._pair_radii = self._radii[pairs[:, 0]] + self._radii[pairs[:, 1]]
+        self._overlap = overlap = distances <= self._pair_radii
+        self.colliding = np.zeros(len(self), dtype=bool)
+        self.colliding[pairs[overlap].reshape(-1)] = True
+        self.colliding_particles = np.nonzero(self.colliding)[0]
+        self.colliding_count = len(self.colliding_particles)
+        return self.colliding_particles
+
+    def solve_collisions(self):
+        self.find_colliding_particles()
+        displaced = np.zeros(len(self), dtype=bool)
+        iterations = 0
+        while self.colliding_count > 0:
+            if iterations == self.max_iterations:
+                warn(
+                    "Could not untangle {} collisions in {} iterations.".format(
+                        self.colliding_count, iterations
+                    ),
+                    PlacementWarning,
+                )
+                break
+            iterations += 1
+            report("Untangling {} collisions".format(self.colliding_count), level=2)
+            displaced |= self.colliding
+            self._displace_colliding()
+            self.find_colliding_particles()
+        if self.track_displaced:
+            self.displaced_particles = np.nonzero(displaced)[0]
+
+    def _displace_colliding(self):
+        pairs = self._pairs[self._overlap]
+        vectors = self._pair_vectors[self._overlap]
+        distances = self._pair_distances[self._overlap]
+        collision_radii = self._pair_radii[self._overlap]
+        # Particles on top of each other have no direction to repel each other in, so
+        # pick a random one.
+        stacked = distances == 0.0
+        if np.any(stacked):
+            vectors[stacked] = self._random.rand(
+                np.count_nonzero(stacked), self.dimensions
+            )
+            vectors[stacked] -= 0.5
+            distances[stacked] = np.sqrt(np.sum(vectors[stacked] ** 2, axis=1))
+        # Same repulsion force as `Particle.get_displacement_force`, vectorized.
+        force = np.full(len(pairs), 0.9)
+        force[~stacked] = np.minimum(
+            0.9, 0.3 / ((distances[~stacked] / collision_radii[~stacked]) ** 2)
+        )
+        # Distribute the displacement inversely to the volume of each partner.
+        volumes = self.volumes
+        pre_volumes, post_volumes = volumes[pairs[:, 0]], volumes[pairs[:, 1]]
+        total_volumes = pre_volumes + post_volumes
+        step = (vectors / distances[:, np.newaxis]) * (force * collision_radii)[
+            :, np.newaxis
+        ]
+        displacement = np.zeros(self._positions.shape)
+        for dim in range(self.dimensions):
+            displacement[:, dim] += np.bincount(
+                pairs[:, 0],
+                weights=step[:, dim] * post_volumes / total_volumes,
+                minlength=len(self),
+            )
+            displacement[:, dim] -= np.bincount(
+                pairs[:, 1],
+                weights=step[:, dim] * pre_volumes / total_volumes,
+                minlength=len(self),
+            )
+        self._positions = self._positions + displacement
+
+    def get_packing_factor(self, particles=None, volume=None):
+        if particles is None:
+            particles_volume = np.sum(
+                [p["count"] * sphere_volume(p["radius"]) for p in self.particle_types]
+            )
+        else:
+            particles_volume = np.sum(self.volumes[particles])
+        if volume is None:
+            volume = np.sum([np.prod(v.size) for v in self.voxels])
+        return particles_volume / volume
+
+    def prune(self, at_risk_particles=None, voxels=None):
+        """
+        Remove particles that have been moved outside of the bounds of the voxels.
+
+        :param at_risk_particles: Indices of the particles that might've been moved and might need to be moved, if omitted check all particles.
+        :type at_risk_particles: :class:`numpy.ndarray`
+        :param voxels: A subset of the voxels that the particles have to be in bounds of, if omitted all voxels are used.
+        """
+        if at_risk_particles is None:
+            at_risk_particles = np.arange(len(self))
+        at_risk_particles = np.asarray(at_risk_particles, dtype=int)
+        if voxels is None:
+            voxels = self.voxels
+        at_risk_positions = self._positions[at_risk_particles]
+        in_bounds = np.zeros(len(at_risk_particles), dtype=bool)
+        for voxel in voxels:
+            in_bounds |= np.all(
+                (at_risk_positions >= voxel.origin)
+                & (at_risk_positions <= voxel.origin + voxel.size),
+                axis=1,
+            )
+        out_of_bounds_ids = at_risk_particles[~in_bounds]
+        out_of_bounds_types = self._types[out_of_bounds_ids]
+        number_pruned_per_type = {}
+        for type_id, count in zip(*np.unique(out_of_bounds_types, return_counts=True)):
+            if type_id < 0:
+                continue
+            number_pruned_per_type[self.particle_types[type_id]["name"]] = count
+        self.remove_particles(out_of_bounds_ids)
+        return len(out_of_bounds_ids), number_pruned_per_type
+
+
+def partition_volume(origin, size, tile_size):
+    """
+    Partition a box into a grid of tiles of at most ``tile_size``.
+
+    :returns: Tile bounds as an array of shape (tiles, 2, 3) with the lower and upper
+      corner of each tile, and the shape of the tile grid.
+    """
+    origin = np.array(origin, dtype=float)
+    size = np.array(size, dtype=float)
+    grid = np.maximum(np.ceil(size / tile_size), 1).astype(int)
+    tile_ids = np.indices(grid).reshape(len(grid), -1).T
+    lower = origin + tile_ids * tile_size
+    upper = np.minimum(lower + tile_size, origin + size)
+    return np.stack((lower, upper), axis=1), tuple(grid)
+
+
+def tile_particle_positions(bounds, seed, count):
+    """
+    Draw the initial positions of the particles of a tile. The positions only depend
+    on the tile bounds and seed, so neighbouring tiles can regenerate them exactly.
+    """
+    random_state = np.random.RandomState(seed)
+    return bounds[0] + random_state.rand(count, len(bounds[0])) * (bounds[1] - bounds[0])
+
+
+def solve_tile(job):
+    """
+    Untangle the particles of a single tile. The particles of the neighbouring tiles
+    within the halo around the tile are added to the system so that collisions on the
+    tile borders are resolved, but only the particles that originate from the tile
+    itself are returned. Each particle is therefore owned by exactly one tile.
+
+    :param job: Dictionary with the ``bounds``, ``seed`` and ``count`` of the tile, the
+      ``neighbours`` as a list of ``(bounds, seed, count)`` tuples, the ``radius`` of
+      the particles and the ``halo`` width.
+    :returns: The final positions of the tile's particles and a mask of which of them
+      were displaced.
+    """
+    bounds, radius, halo = job["bounds"], job["radius"], job["halo"]
+    own = tile_particle_positions(bounds, job["seed"], job["count"])
+    if not len(own):
+        return own, np.zeros(0, dtype=bool)
+    context = [tile_particle_positions(*neighbour) for neighbour in job["neighbours"]]
+    context = np.concatenate([np.empty((0, len(bounds[0])))] + context)
+    in_halo = np.all(
+        (context >= bounds[0] - halo) & (context <= bounds[1] + halo), axis=1
+    )
+    system = ArrayParticleSystem(
+        track_displaced=True, random_state=np.random.RandomState(job["seed"])
+    )
+    system.fill(
+        [[bounds[0] - halo, bounds[1] - bounds[0] + 2 * halo]],
+        [{"name": "tile", "voxels": [0], "radius": radius, "count": 0}],
+    )
+    system.add_particles(radius, own, type=0)
+    system.add_particles(radius, context[in_halo], type=0)
+    system.solve_collisions()
+    displaced = np.zeros(len(own), dtype=bool)
+    displaced[system.displaced_particles[system.displaced_particles < len(own)]] = True
+    return system.positions[: len(own)], displaced
+
+
 def plot_particle_system(system):
     nc_particles = list(filter(lambda p: not p.colliding, system.particles))
     c_particles = list(filter(lambda p: p.colliding, system.particles))
@@ -1,7 +1,23 @@
 from .strategy import Layered, PlacementStrategy
-from ..particles import ParticleSystem
+from ..particles import (
+    ParticleSystem,
+    ArrayParticleSystem,
+    partition_volume,
+    solve_tile,
+)
 from ..exceptions import *
 from ..reporting import report, warn
+import numpy as np, concurrent.futures
+
+
+def _tile_size(value):
+    # Cast a single edge length or an edge length per dimension to a 3D tile size.
+    tile_size = np.array(value, dtype=float).reshape(-1)
+    if len(tile_size) == 1:
+        tile_size = np.repeat(tile_size, 3)
+    if len(tile_size) != 3 or np.any(tile_size <= 0):
+        raise ValueError("Tile size must be 1 or 3 positive numbers.")
+    return tile_size
 
 
 class ParticlePlacement(Layered, PlacementStrategy):
@@ -9,13 +25,42 @@ class ParticlePlacement(Layered, PlacementStrategy):
     casts = {
         "prune": bool,
         "bounded": bool,
+        "engine": str,
+        "tile_size": _tile_size,
+        "workers": int,
+        "seed": int,
     }
 
     defaults = {
         "prune": True,
         "bounded": False,
+        "engine": "array",
+        "tile_size": None,
+        "workers": 1,
+        "seed": None,
+    }
+
+    #: Particle system classes that can be selected with the ``engine`` attribute.
+    engines = {
+        "array": ArrayParticleSystem,
+        "object": ParticleSystem,
     }
 
+    def validate(self):
+        super().validate()
+        if self.engine not in self.engines:
+            raise ConfigurationError(
+                "Unknown particle engine '{}' in {}, choose from: {}".format(
+                    self.engine, self.name, ", ".join(self.engines.keys())
+                )
+            )
+        if self.tile_size is not None and self.engine != "array":
+            raise ConfigurationError(
+                "Tiled placement in {} requires the 'array' particle engine.".format(
+                    self.name
+                )
+            )
+
     def place(self):
         cell_type = self.cell_type
         layer = self.layer_instance
@@ -24,6 +69,8 @@ class ParticlePlacement(Layered, PlacementStrategy):
         origin[1] = layer.origin[1] + layer.thickness * self.restriction_minimum
         # Computing voxel thickness based on y_restriction
         volume = [layer.width, layer.thickness * self.restriction_factor, layer.depth]
+        if self.tile_size is not None:
+            return self.place_tiled(origin, volume)
         # Create a list of voxels with the current restricted layer as only voxel.
         voxels = [[origin, volume]]
         # Define the particles for the particle system.
@@ -36,10 +83,10 @@ class ParticlePlacement(Layered, PlacementStrategy):
             }
         ]
         # Create and fill the particle system.
-        system = ParticleSystem(track_displaced=True, scaffold=self.scaffold)
+        system = self.engines[self.engine](track_displaced=True, scaffold=self.scaffold)
         system.fill(voxels, particles)
         # Raise a warning if no cells could be placed in the volume
-        if len(system.particles) == 0:
+        if len(system.positions) == 0:
             warn(
                 "Did not place any {} cell in the {}!".format(cell_type.name, layer.name),
                 PlacementWarning,
@@ -51,15 +98,107 @@ class ParticlePlacement(Layered, PlacementStrategy):
         if len(colliding) > 0:
             system.solve_collisions()
             if self.prune:
-                number_pruned, pruned_per_type = system.prune(
-                    at_risk_particles=system.displaced_particles
-                )
-                report(
-                    "{} {} ({}%) cells pruned.".format(
-                        number_pruned,
-                        cell_type.name,
-                        int((number_pruned / self.get_placement_count()) * 100),
-                    )
-                )
+                self._prune(system, system.displaced_particles)
         particle_positions = system.positions
         self.scaffold.place_cells(cell_type, layer, particle_positions)
+
+    def place_tiled(self, origin, volume):
+        """
+        Tile the restricted layer into subvolumes of ``tile_size`` and untangle each tile
+        separately, in a pool of ``workers`` processes or spread over the MPI ranks.
+        Each tile also solves the particles of its neighbours that lie within a halo
+        around it, but keeps only its own particles. The tiles are then stitched
+        together by untangling the collisions that remain on the tile borders.
+        """
+        cell_type = self.cell_type
+        layer = self.layer_instance
+        radius = cell_type.placement.radius
+        count = self.get_placement_count()
+        if count == 0:
+            warn(
+                "Did not place any {} cell in the {}!".format(cell_type.name, layer.name),
+                PlacementWarning,
+            )
+            return
+        random_state = np.random.RandomState(self._get_seed())
+        tiles, grid = partition_volume(origin, volume, self.tile_size)
+        # Distribute the particles over the tiles proportional to their volume, and give
+        # each tile its own seed so that the result is independent of how the tiles are
+        # scheduled.
+        tile_volumes = np.prod(tiles[:, 1] - tiles[:, 0], axis=1)
+        counts = random_state.multinomial(count, tile_volumes / np.sum(tile_volumes))
+        seeds = random_state.randint(np.iinfo(np.int32).max, size=len(tiles))
+        tile_ids = np.arange(len(tiles)).reshape(grid)
+        jobs = []
+        for tile_id, index in enumerate(np.ndindex(grid)):
+            window = tuple(slice(max(i - 1, 0), i + 2) for i in index)
+            neighbours = [n for n in tile_ids[window].reshape(-1) if n != tile_id]
+            jobs.append(
+                {
+                    "bounds": tiles[tile_id],
+                    "seed": seeds[tile_id],
+                    "count": counts[tile_id],
+                    "neighbours": [(tiles[n], seeds[n], counts[n]) for n in neighbours],
+                    "radius": radius,
+                    "halo": 4 * radius,
+                }
+            )
+        report(
+            "Untangling {} {} cells in {} tiles.".format(
+                count, cell_type.name, len(jobs)
+            ),
+            level=3,
+        )
+        results = self._map_tiles(jobs)
+        positions = np.concatenate([r[0] for r in results])
+        displaced = np.concatenate([r[1] for r in results])
+        # Stitch the tiles together: untangle the collisions between particles of
+        # different tiles that remain along the tile borders.
+        system = ArrayParticleSystem(track_displaced=True, random_state=random_state)
+        system.fill(
+            [[origin, volume]],
+            [{"name": cell_type.name, "voxels": [0], "radius": radius, "count": 0}],
+        )
+        system.add_particles(radius, positions, type=0)
+        system.solve_collisions()
+        displaced[system.displaced_particles] = True
+        if self.prune:
+            self._prune(system, np.nonzero(displaced)[0])
+        self.scaffold.place_cells(cell_type, layer, system.positions)
+
+    def _get_seed(self):
+        seed = self.seed
+        if seed is None:
+            seed = np.random.randint(np.iinfo(np.int32).max)
+        if self.scaffold.has_mpi_installed:
+            # Make sure that all ranks place the same cells.
+            seed = self.scaffold.MPI.COMM_WORLD.bcast(seed, root=0)
+        return seed
+
+    def _map_tiles(self, jobs):
+        if self.scaffold.has_mpi_installed:
+            comm = self.scaffold.MPI.COMM_WORLD
+            if comm.size > 1:
+                # Each rank solves a strided subset of the tiles and all ranks gather
+                # the results back into tile order.
+                rank_results = comm.allgather(
+                    [solve_tile(job) for job in jobs[comm.rank :: comm.size]]
+                )
+                results = [None] * len(jobs)
+                for rank, rank_result in enumerate(rank_results):
+                    results[rank :: comm.size] = rank_result
+                return results
+        if self.workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+                return list(pool.map(solve_tile, jobs))
+        return [solve_tile(job) for job in jobs]
+
+    def _prune(self, system, at_risk_particles):
+        number_pruned, pruned_per_type = system.prune(at_risk_particles=at_risk_particles)
+        report(
+            "{} {} ({}%) cells pruned.".format(
+                number_pruned,
+                self.cell_type.name,
+                int((number_pruned / self.get_placement_count()) * 100),
+            )
+        )
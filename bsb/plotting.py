@@ -418,9 +418,15 @@ def plot_fiber_morphology(
 ):
     def get_branch_traces(branches, traces):
         for branch in branches:
+            points = branch.points + offset
             traces.append(
-                get_branch_trace(
-                    branch._compartments, offset, color=color, width=segment_radius
+                go.Scatter3d(
+                    x=points[:, 0],
+                    y=points[:, 2],
+                    z=points[:, 1],
+                    mode="lines",
+                    line=dict(width=segment_radius, color=color),
+                    showlegend=False,
                 )
             )
             get_branch_traces(branch.child_branches, traces)
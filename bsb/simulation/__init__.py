@@ -3,4 +3,5 @@ from .component import SimulationComponent
 from .targetting import TargetsNeurons, TargetsSections
 from .device import SimulationDevice
 from .adapter import SimulatorAdapter
-from .results import SimulationResult, SimulationRecorder
+from .results import SimulationResult, SimulationRecorder, ResultWriter
+from .relays import RelayIndex, RelayScheme
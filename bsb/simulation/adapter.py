@@ -66,6 +66,14 @@ class SimulatorAdapter(ConfigurableClass):
         """
         pass
 
+    def resume(self, simulator):
+        """
+        Continue a simulation from its last checkpoint, given a simulator object.
+        """
+        raise NotImplementedError(
+            "The {} adapter can't resume simulations.".format(self.simulator_name)
+        )
+
     @abc.abstractmethod
     def collect_output(self, simulator):
         """
@@ -126,8 +134,8 @@ class SimulatorAdapter(ConfigurableClass):
         self._last_progtic = now
         return progress
 
-    def step_progress(self, duration, step=1):
-        steps = itertools.chain(np.arange(0, duration), (duration,))
+    def step_progress(self, duration, step=1, start=0):
+        steps = itertools.chain(np.arange(start, duration, step), (duration,))
         a, b = itertools.tee(steps)
         next(b, None)
         yield from zip(a, b)
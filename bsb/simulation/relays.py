@@ -0,0 +1,163 @@
+"""
+Resolve the relays of a network, cells that pass their spikes on to their targets
+without being simulated, onto the terminal connections that they reach through
+chains of relays, as reachability over sparse adjacency matrices.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from ..models import ConnectionIndex
+from ..exceptions import RelayError
+
+
+class RelayIndex:
+    """
+    Collects the connections that start from relays and resolves them into a
+    :class:`.RelayScheme`. Intermediate connections lead from a relay to another
+    relay, terminal connections from a relay to a simulated cell. Each set of
+    terminal connections is numbered in the order it is added, so that the adapter
+    can look up the data of a terminal connection by its set and row.
+    """
+
+    def __init__(self):
+        self._relays = []
+        self._intermediate = []
+        self._terminal = []
+
+    def add_relays(self, ids):
+        """
+        Register relay cells, also those that have no connections.
+        """
+        self._relays.append(np.asarray(ids, dtype=int).reshape(-1))
+
+    def add_intermediate(self, from_ids, to_ids):
+        """
+        Add connections from relays to other relays.
+        """
+        self._intermediate.append(_edges(from_ids, to_ids))
+
+    def add_terminal(self, from_ids, to_ids):
+        """
+        Add a set of connections from relays to simulated cells.
+
+        :returns: The number of this set of terminal connections.
+        :rtype: int
+        """
+        self._terminal.append(_edges(from_ids, to_ids))
+        return len(self._terminal) - 1
+
+    def resolve(self, node_ids=None):
+        """
+        Resolve every relay onto the terminal connections that it reaches. A relay
+        that reaches a terminal connection over several paths relays to it once per
+        path.
+
+        :param node_ids: Keep only the terminal connections onto these cells.
+        :type node_ids: numpy.ndarray
+        :raises: :class:`~.exceptions.RelayError` if an intermediate connection
+          targets a cell that is not a relay, or if the relays form a cycle.
+        :rtype: :class:`.RelayScheme`
+        """
+        intermediate = _concat(self._intermediate)
+        terminal = _concat(self._terminal)
+        sets = np.repeat(np.arange(len(self._terminal)), [len(t) for t in self._terminal])
+        rows = np.concatenate(
+            [np.arange(len(t)) for t in self._terminal] + [np.empty(0, dtype=int)]
+        )
+        relays = np.unique(
+            np.concatenate(self._relays + [intermediate[:, 0], terminal[:, 0]])
+        ).astype(int)
+        loose = ~np.isin(intermediate[:, 1], relays)
+        if np.any(loose):
+            raise RelayError(
+                f"Non-relay {intermediate[loose, 1][0]} found in intermediate relay map."
+            )
+        if node_ids is not None:
+            keep = np.isin(terminal[:, 1], node_ids)
+            terminal, sets, rows = terminal[keep], sets[keep], rows[keep]
+        n = len(relays)
+        # Relay to relay adjacency, and relay to terminal connection adjacency.
+        adjacency = csr_matrix(
+            (
+                np.ones(len(intermediate), dtype=int),
+                (
+                    np.searchsorted(relays, intermediate[:, 0]),
+                    np.searchsorted(relays, intermediate[:, 1]),
+                ),
+            ),
+            shape=(n, n),
+        )
+        reach = csr_matrix(
+            (
+                np.ones(len(terminal), dtype=int),
+                (np.searchsorted(relays, terminal[:, 0]), np.arange(len(terminal))),
+            ),
+            shape=(n, len(terminal)),
+        )
+        # Add the terminal connections reached over 1, 2, ... intermediate hops. A
+        # chain without cycles has fewer hops than there are relays.
+        frontier = reach
+        for _ in range(n):
+            frontier = adjacency @ frontier
+            if not frontier.nnz:
+                break
+            reach = reach + frontier
+        else:
+            if n:
+                raise RelayError("Relays form a cycle.")
+        reach = reach.tocoo()
+        entries = np.repeat(np.arange(reach.nnz), reach.data)
+        connections = reach.col[entries]
+        return RelayScheme(
+            relays,
+            relays[reach.row[entries]],
+            terminal[connections, 1],
+            sets[connections],
+            rows[connections],
+        )
+
+
+class RelayScheme:
+    """
+    The terminal connections that each relay reaches, as parallel arrays of relay
+    id, target cell id, terminal connection set and row in that set.
+    """
+
+    def __init__(self, ids, relays, targets, sets, rows):
+        self.ids = ids
+        index = ConnectionIndex.build(relays, targets)
+        self.relays = relays[index.order]
+        self.targets = targets[index.order]
+        self.sets = sets[index.order]
+        self.rows = rows[index.order]
+        self._index = ConnectionIndex(index.ids, index.offsets, np.arange(len(index)), [])
+
+    def __contains__(self, id):
+        i = np.searchsorted(self.ids, id)
+        return i < len(self.ids) and self.ids[i] == id
+
+    def __len__(self):
+        return len(self.relays)
+
+    def select(self, ids):
+        """
+        Return the entries of the terminal connections of the given relays, sorted by
+        relay and then by target.
+        """
+        return self._index.select(ids)
+
+    def get_relays(self):
+        """
+        Return the ids of the relays that reach at least one terminal connection.
+        """
+        return self._index.ids
+
+
+def _edges(from_ids, to_ids):
+    return np.column_stack(
+        (np.asarray(from_ids, dtype=int), np.asarray(to_ids, dtype=int))
+    ).reshape(-1, 2)
+
+
+def _concat(edges):
+    return np.concatenate(edges + [np.empty((0, 2), dtype=int)])
@@ -1,5 +1,5 @@
 from ..reporting import warn
-import traceback
+import traceback, h5py, numpy as np
 
 
 class SimulationResult:
@@ -74,3 +74,159 @@ class PresetPathMixin:
 class PresetMetaMixin:
     def get_meta(self):
         return self.meta
+
+
+class ResultWriter:
+    """
+    Writes the results that all ranks recorded into a single HDF5 file. Data that is
+    collected under the same path on several ranks is concatenated in rank order: the
+    size of every dataset is shared with an allgather, so that each rank can write its
+    own slice at its global offset. With an MPI build of h5py and an ``mpi4py``
+    communicator all ranks write to the file at the same time through the MPI-IO
+    driver, otherwise they take turns.
+
+    :param path: Path of the HDF5 file.
+    :type path: str
+    :param comm: MPI communicator of the ranks, or any object with its
+      ``Get_rank``, ``Get_size``, ``Barrier`` and ``allgather`` methods. Defaults to
+      ``COMM_WORLD`` if ``mpi4py`` is installed.
+    :param chunk_size: Create chunked datasets that can be resized along their first
+      axis, with chunks of this many rows.
+    :type chunk_size: int
+    """
+
+    def __init__(self, path, comm=None, chunk_size=None):
+        self.path = path
+        self.comm = comm if comm is not None else _get_comm_world()
+        self.chunk_size = chunk_size
+        self.rank = self.comm.Get_rank() if self.comm is not None else 0
+        self.size = self.comm.Get_size() if self.comm is not None else 1
+
+    @property
+    def parallel(self):
+        """
+        Whether the ranks write to the file at the same time.
+        """
+        return self.size > 1 and h5py.get_config().mpi and _is_mpi_comm(self.comm)
+
+    def write(self, results, attrs=None):
+        """
+        Write the results of this rank. Must be called on all ranks.
+
+        :param results: The ``(path, data, meta)`` of the recorders of this rank, such
+          as :meth:`.SimulationResult.safe_collect` produces.
+        :param attrs: Attributes of the file.
+        :type attrs: dict
+        :returns: The path of the file.
+        """
+        local = self._merge(results)
+        layout = {
+            path: (data.shape, data.dtype, meta) for path, (data, meta) in local.items()
+        }
+        datasets = self._get_datasets(self._allgather(layout))
+        if self.parallel:
+            with h5py.File(self.path, "a", driver="mpio", comm=self.comm) as f:
+                self._create_datasets(f, datasets, attrs)
+                self._write_slices(f, local, datasets)
+            return self.path
+        if self.rank == 0:
+            with h5py.File(self.path, "a") as f:
+                self._create_datasets(f, datasets, attrs)
+        for rank in range(self.size):
+            self._barrier()
+            if rank == self.rank:
+                with h5py.File(self.path, "a") as f:
+                    self._write_slices(f, local, datasets)
+        self._barrier()
+        return self.path
+
+    def _merge(self, results):
+        # Concatenate the data that this rank collected under the same path.
+        merged = {}
+        for path, data, meta in results:
+            path = "/".join(f"{p}" for p in path)
+            if not isinstance(data, np.ndarray):
+                warn(f"Recorder {path} numpy.ndarray expected, got {type(data)}")
+                continue
+            data = np.atleast_1d(data)
+            if path in merged:
+                previous, previous_meta = merged[path]
+                try:
+                    data = np.concatenate((previous, data))
+                except ValueError:
+                    warn(
+                        f"Recorder {path} data {data.dtype} {data.shape} does not match"
+                        + f" {previous.dtype} {previous.shape}"
+                    )
+                    continue
+                meta = {**previous_meta, **meta}
+            merged[path] = (data, meta)
+        return merged
+
+    def _get_datasets(self, layouts):
+        # Determine the global shape, dtype, metadata and rank offsets of each dataset.
+        datasets = {}
+        for path in sorted(set().union(*layouts)):
+            shapes = [l[path][0] if path in l else None for l in layouts]
+            present = [l[path] for l in layouts if path in l]
+            shape, dtype, _ = present[0]
+            if any(p[0][1:] != shape[1:] for p in present):
+                warn(f"Recorder {path} data shapes differ between ranks: {shapes}")
+                continue
+            counts = [s[0] if s is not None else 0 for s in shapes]
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            meta = {}
+            for p in present:
+                meta.update(p[2])
+            datasets[path] = ((offsets[-1], *shape[1:]), dtype, meta, offsets)
+        return datasets
+
+    def _create_datasets(self, f, datasets, attrs):
+        for key, value in (attrs or {}).items():
+            f.attrs[key] = value
+        for path, (shape, dtype, meta, _) in datasets.items():
+            kwargs = {}
+            if self.chunk_size is not None:
+                kwargs["maxshape"] = (None, *shape[1:])
+                kwargs["chunks"] = (self.chunk_size, *shape[1:])
+            try:
+                d = f.create_dataset(path, shape=shape, dtype=dtype, **kwargs)
+                for k, v in meta.items():
+                    d.attrs[k] = v
+            except Exception:
+                warn(
+                    f"Recorder {path} processing errored out: {dtype} {shape}"
+                    + f"\n\n{traceback.format_exc()}"
+                )
+
+    def _write_slices(self, f, local, datasets):
+        for path, (data, _) in local.items():
+            if path not in f or not len(data):
+                continue
+            start = datasets[path][3][self.rank]
+            f[path][start : start + len(data)] = data
+
+    def _allgather(self, data):
+        if self.comm is None:
+            return [data]
+        return self.comm.allgather(data)
+
+    def _barrier(self):
+        if self.comm is not None:
+            self.comm.Barrier()
+
+
+def _get_comm_world():
+    try:
+        from mpi4py.MPI import COMM_WORLD
+    except ImportError:
+        return None
+    return COMM_WORLD
+
+
+def _is_mpi_comm(comm):
+    try:
+        from mpi4py.MPI import Comm
+    except ImportError:
+        return False
+    return isinstance(comm, Comm)
@@ -7,8 +7,10 @@ from ...simulation import (
     TargetsSections,
     SimulationResult,
     SimulationRecorder,
+    ResultWriter,
+    RelayIndex,
 )
-from ...models import ConnectivitySet
+from ...models import ConnectivitySet, ConnectionIndex
 from ...reporting import report, warn
 from ...exceptions import *
 from ...helpers import continuity_hop, get_configurable_class
@@ -103,9 +105,9 @@ class ArborCell(SimulationCell):
                 raise AdapterError(f"Couldn't find {comp.start}, on {self._str(gid)}")
             labels[f"comp_{comp.id}"] = str(loc)
 
-        comps_from = self.adapter._connections_from[gid]
-        comps_on = (rcv.comp_on for rcv in self.adapter._connections_on[gid])
-        gaps = (c.to_compartment for c in self.adapter._gap_junctions_on.get(gid, []))
+        comps_from = self.adapter._get_transmitters(gid)
+        comps_on = (rcv.comp_on for rcv in self.adapter._get_receivers(gid))
+        gaps = (c.to_compartment for c in self.adapter._get_gap_junctions(gid))
         it.consume(comp_label(i) for i in it.chain(comps_from, comps_on, gaps))
         labels[self.default_endpoint] = "(root)"
         return labels
@@ -118,7 +120,7 @@ class ArborCell(SimulationCell):
 
     def _create_transmitters(self, gid, decor):
         done = set()
-        for comp in self.adapter._connections_from[gid]:
+        for comp in self.adapter._get_transmitters(gid):
             if comp.id in done:
                 continue
             else:
@@ -127,7 +129,7 @@ class ArborCell(SimulationCell):
 
     def _create_gaps(self, gid, decor):
         done = set()
-        for conn in self.adapter._gap_junctions_on.get(gid, []):
+        for conn in self.adapter._get_gap_junctions(gid):
             comp = conn.to_compartment
             if comp.id in done:
                 continue
@@ -136,7 +138,7 @@ class ArborCell(SimulationCell):
             decor.place(f'"comp_{comp.id}"', arbor.junction("gj"), f"gap_{comp.id}")
 
     def _create_receivers(self, gid, decor):
-        for rcv in self.adapter._connections_on[gid]:
+        for rcv in self.adapter._get_receivers(gid):
             decor.place(
                 f'"comp_{rcv.comp_on.id}"',
                 rcv.synapse,
@@ -227,6 +229,87 @@ class Receiver:
         return arbor.cell_local_label(f"comp_{self.comp_on.id}_{self.index}")
 
 
+class GapJunction:
+    def __init__(self, model, from_id, from_compartment, to_compartment):
+        self.model = model
+        self.from_id = from_id
+        self.from_compartment = from_compartment
+        self.to_compartment = to_compartment
+
+
+class GidConnections:
+    """
+    Connections indexed per gid in CSR layout. The connections are stored as NumPy
+    arrays of the presynaptic gid, postsynaptic gid, connection set and row in the
+    columns of that set. The indices are built on first use, and only hold the
+    connections of the given gids.
+
+    :param gids: The gids to index, or ``None`` to index all gids.
+    """
+
+    def __init__(self, gids=None):
+        self._gids = None if gids is None else np.sort(np.fromiter(gids, dtype=int))
+        self._sets = []
+        self._edges = []
+        self._indices = {}
+
+    def add(self, columns, model, rows=None, from_ids=None):
+        """
+        Add connections of a connection model.
+
+        :param columns: Columns of the connections.
+        :type columns: :class:`~.models.ConnectionColumns`
+        :param rows: Add only these rows of the columns.
+        :param from_ids: Presynaptic gids that replace those of the columns.
+        """
+        if rows is None:
+            rows = np.arange(len(columns))
+        rows = np.asarray(rows, dtype=int)
+        if from_ids is None:
+            from_ids = columns.from_ids[rows]
+        self._edges.append(
+            np.column_stack(
+                (
+                    from_ids,
+                    columns.to_ids[rows],
+                    np.full(len(rows), len(self._sets)),
+                    rows,
+                )
+            ).astype(int)
+        )
+        self._sets.append((columns, model))
+        self._indices = {}
+
+    def incoming(self, gid):
+        """
+        Return the presynaptic gid, columns, row and connection model of each
+        connection onto the gid.
+        """
+        return self._select(1, gid)
+
+    def outgoing(self, gid):
+        """
+        Return the postsynaptic gid, columns, row and connection model of each
+        connection from the gid.
+        """
+        return self._select(0, gid)
+
+    def _select(self, column, gid):
+        edges, index = self._get_index(column)
+        for from_id, to_id, set_index, row in edges[index.select([gid])].tolist():
+            columns, model = self._sets[set_index]
+            yield (to_id if column == 0 else from_id), columns, row, model
+
+    def _get_index(self, column):
+        if column not in self._indices:
+            edges = np.concatenate(self._edges + [np.empty((0, 4), dtype=int)])
+            if self._gids is not None:
+                edges = edges[np.isin(edges[:, column], self._gids)]
+            index = ConnectionIndex.build(edges[:, column], edges[:, 1 - column])
+            self._indices[column] = (edges, index)
+        return self._indices[column]
+
+
 class QuickContains:
     def __init__(self, cell_model, ps):
         self._model = cell_model
@@ -308,7 +391,10 @@ class ArborRecipe(arbor.recipe):
         return s
 
     def num_sources(self, gid):
-        return 1 if self._is_relay(gid) else 0
+        if self._is_relay(gid):
+            return 1
+        # The soma detector and a detector per transmitting compartment.
+        return 1 + len(set(c.id for c in self._adapter._get_transmitters(gid)))
 
     def cell_kind(self, gid):
         return self._adapter._lookup.lookup_kind(gid)
@@ -322,11 +408,11 @@ class ArborRecipe(arbor.recipe):
             return []
         return [
             arbor.connection(rcv.from_(), rcv.on(), rcv.weight, rcv.delay)
-            for rcv in self._adapter._connections_on[gid]
+            for rcv in self._adapter._get_receivers(gid)
         ]
 
     def gap_junctions_on(self, gid):
-        return [c.model.gap_(c) for c in self._adapter._gap_junctions_on.get(gid, [])]
+        return [c.model.gap_(c) for c in self._adapter._get_gap_junctions(gid)]
 
     def _is_relay(self, gid):
         return self._adapter._lookup.lookup_kind(gid) == arbor.cell_kind.spike_source
@@ -445,60 +531,32 @@ class ArborAdapter(SimulatorAdapter):
             report(arbor.profiler_summary(), level=1)
 
     def collect_output(self, simulation):
-        import h5py, time, random, traceback
+        import time, random
 
         timestamp = str(time.time()).split(".")[0] + str(random.random()).split(".")[1]
         timestamp = self.broadcast(timestamp)
         result_path = "results_" + self.name + "_" + timestamp + ".hdf5"
-        rank = self.get_rank()
-        for node in range(self.get_size()):
-            self.barrier()
-            if node == rank:
-                report("Node", rank, "is writing", level=2, all_nodes=True)
-                with h5py.File(result_path, "a") as f:
-                    if rank == 0:
-                        spikes = simulation.spikes()
-                        spikes = np.column_stack(
-                            (
-                                np.fromiter((l[0][0] for l in spikes), dtype=int),
-                                np.fromiter((l[1] for l in spikes), dtype=int),
-                            )
-                        )
-                        f.create_dataset("all_spikes_dump", data=spikes)
-                    f.attrs["configuration_string"] = self.scaffold.configuration._raw
-                    for path, data, meta in self.result.safe_collect():
-                        try:
-                            path = "/".join(f"{p}" for p in path)
-                            if path in f:
-                                # Path exists, append by recreating concatenated data
-                                data = np.concatenate((f[path][()], data))
-                                _meta = d.attrs[k].copy()
-                                _meta.update(meta)
-                                meta = _meta
-                                del f[path]
-                            d = f.create_dataset(path, data=data)
-                            for k, v in meta.items():
-                                d.attrs[k] = v
-                        except Exception as e:
-                            if not isinstance(data, np.ndarray):
-                                warn(
-                                    f"Recorder `{path}` expected numpy.ndarray data,"
-                                    + f" got {type(data)}"
-                                )
-                            else:
-                                warn(
-                                    f"Recorder {path} processing errored out."
-                                    + f" - Data: {data.dtype} {data.shape}"
-                                    + f"\n\n{traceback.format_exc()}"
-                                )
-            self.barrier()
-        return result_path
+        results = self.result.safe_collect()
+        if self.get_rank() == 0:
+            spikes = simulation.spikes()
+            spikes = np.column_stack(
+                (
+                    np.fromiter((l[0][0] for l in spikes), dtype=int),
+                    np.fromiter((l[1] for l in spikes), dtype=int),
+                )
+            )
+            results = it.chain(((("all_spikes_dump",), spikes, {}),), results)
+        writer = ResultWriter(result_path, comm=mpi)
+        return writer.write(
+            results, attrs={"configuration_string": self.scaffold.configuration._raw}
+        )
 
     def get_recipe(self):
         return ArborRecipe(self)
 
     def _cache_gap_junctions(self):
-        self._gap_junctions_on = {}
+        # Gap junctions are indexed for all gids, the domain decomposition needs them.
+        self._gap_junctions = GidConnections()
         for conn_set in self.scaffold.get_connectivity_sets():
             if conn_set.is_orphan() or not len(conn_set):
                 continue
@@ -508,64 +566,82 @@ class ArborAdapter(SimulatorAdapter):
                 raise AdapterError(f"Missing connection model `{conn_set.tag}`")
             if not conn_model.gap:
                 continue
-            for conn in conn_set.intersections:
-                conn.model = conn_model
-                self._gap_junctions_on.setdefault(conn.from_id, []).append(conn)
+            self._gap_junctions.add(conn_set.get_columns(), conn_model)
 
     def _cache_connections(self):
-        self._connections_on = {gid: ReceiverCollection() for gid in self.gids}
-        self._connections_from = {gid: [] for gid in self.gids}
+        # Index only the connections from and onto the gids of this node, and read
+        # only their rows of the connectivity sets.
+        self._connections = GidConnections(self.gids)
+        self._receivers = {}
+        local = np.sort(np.fromiter(self.gids, dtype=int))
         for conn_set in self.scaffold.get_connectivity_sets():
             if conn_set.is_orphan() or not len(conn_set):
                 continue
-            ct = conn_set.connection_types[0]
             try:
                 conn_model = self.connection_models[conn_set.tag]
             except KeyError:
                 raise AdapterError(f"Missing connection model `{conn_set.tag}`")
-            if conn_model.gap:
+            from_type = conn_set.connection_types[0].from_cell_types[0]
+            if conn_model.gap or self.cell_models[from_type.name].relay:
+                # Connections from relays are added from the relay scheme.
                 continue
-            w = conn_model.weight
-            for conn in conn_set.intersections:
-                from_gid = int(conn.from_id)
-                to_gid = int(conn.to_id)
-                comp_from = conn.from_compartment
-                comp_on = conn.to_compartment
-                if from_gid in self._connections_from:
-                    self._connections_from[from_gid].append(comp_from)
-                if to_gid in self._connections_on:
-                    self._connections_on[to_gid].append(
-                        conn_model.make_receiver(from_gid, comp_from, comp_on)
-                    )
-            for gid, relays in self._relays_on.items():
-                for (from_gid, comp_from, comp_on, conn_model) in relays:
-                    self._connections_from[from_gid].append(comp_from)
-                    self._connections_on[gid].append(
-                        conn_model.make_receiver(from_gid, comp_from, comp_on)
-                    )
+            self._connections.add(conn_set.get_incoming_columns(local), conn_model)
+            # Connections between gids of this node came along with the incoming ones.
+            outgoing = conn_set.get_outgoing_columns(local)
+            remote = np.nonzero(~np.isin(outgoing.to_ids, local))[0]
+            self._connections.add(outgoing, conn_model, rows=remote)
+        scheme = self._relay_scheme
+        for set_index, (columns, conn_model) in enumerate(self._relay_sets):
+            relayed = scheme.sets == set_index
+            self._connections.add(
+                columns,
+                conn_model,
+                rows=scheme.rows[relayed],
+                from_ids=scheme.relays[relayed],
+            )
 
-    def _index_relays(self):
-        report("Indexing relays.")
-        terminal_relays = {}
-        intermediate_relays = {}
-        output_handler = self.scaffold.output_formatter
-        cell_types = self.scaffold.get_cell_types()
-        type_lookup = {
-            ct.name: range(min(ids), max(ids) + 1)
-            for ct, ids in zip(
-                cell_types, (ct.get_placement_set().identifiers for ct in cell_types)
+    def _get_receivers(self, gid):
+        # Receivers are only made for the gids of this node, when they are needed.
+        try:
+            return self._receivers[gid]
+        except KeyError:
+            pass
+        receivers = ReceiverCollection()
+        for from_gid, columns, row, conn_model in self._connections.incoming(gid):
+            receivers.append(
+                conn_model.make_receiver(
+                    from_gid,
+                    columns.get_from_compartment(row),
+                    columns.get_to_compartment(row),
+                )
             )
-        }
+        self._receivers[gid] = receivers
+        return receivers
 
-        def lookup(i):
-            for n, t in type_lookup.items():
-                if i in t:
-                    return n
-            else:
-                return None
+    def _get_transmitters(self, gid):
+        return [
+            columns.get_from_compartment(row)
+            for _, columns, row, _ in self._connections.outgoing(gid)
+        ]
 
+    def _get_gap_junctions(self, gid):
+        return [
+            GapJunction(
+                conn_model,
+                gid,
+                columns.get_from_compartment(row),
+                columns.get_to_compartment(row),
+            )
+            for _, columns, row, conn_model in self._gap_junctions.outgoing(gid)
+        ]
+
+    def _index_relays(self):
+        report("Indexing relays.")
+        relay_index = RelayIndex()
+        # The columns and connection model of each set of terminal connections.
+        self._relay_sets = []
+        output_handler = self.scaffold.output_formatter
         for connection_model in self.connection_models.values():
-            name = connection_model.name
             # Get the connectivity set associated with this connection model
             connectivity_set = ConnectivitySet(output_handler, connection_model.name)
             if connectivity_set.is_orphan():
@@ -576,99 +652,33 @@ class ArborAdapter(SimulatorAdapter):
             to_cell_model = self.cell_models[to_cell_type.name]
             if not from_cell_model.relay:
                 continue
+            relay_index.add_relays(
+                self.scaffold.get_placement_set(from_cell_type.name).identifiers
+            )
+            columns = connectivity_set.get_columns()
+            kind = "intermediate" if to_cell_model.relay else "terminal"
+            report(
+                "Adding",
+                len(connectivity_set),
+                connection_model.name,
+                "connections as " + kind + ".",
+                level=3,
+            )
             if to_cell_model.relay:
-                report(
-                    "Adding",
-                    len(connectivity_set),
-                    connection_model.name,
-                    "connections as intermediate.",
-                    level=3,
-                )
-                bin = intermediate_relays
-                connections = connectivity_set.connections
-                target = lambda c: c.to_id
+                relay_index.add_intermediate(columns.from_ids, columns.to_ids)
             else:
-                report(
-                    "Adding",
-                    len(connectivity_set),
-                    connection_model.name,
-                    "connections as terminal.",
-                    level=3,
-                )
-                bin = terminal_relays
-                connections = connectivity_set.intersections
-                target = lambda c: (
-                    c.to_id,
-                    c.from_compartment,
-                    c.to_compartment,
-                    connection_model,
-                )
-            for id in self.scaffold.get_placement_set(from_cell_type.name).identifiers:
-                if id not in bin:
-                    bin[id] = []
-            for connection in connections:
-                fid = connection.from_id
-                bin[fid].append(target(connection))
+                relay_index.add_terminal(columns.from_ids, columns.to_ids)
+                self._relay_sets.append((columns, connection_model))
 
         report("Relays indexed, resolving intermediates.")
-
-        interm_transfer = {k: [] for k in intermediate_relays.keys()}
-        while len(intermediate_relays) > 0:
-            intermediates_to_remove = []
-            for intermediate, targets in intermediate_relays.items():
-                for target in targets:
-                    if target in intermediate_relays:
-                        # This target of this intermediary is also an
-                        # intermediary and cannot be resolved to a terminal at
-                        # this point, so we wait until a next iteration where
-                        # the intermediary target might have been resolved.
-                        continue
-                    elif target in terminal_relays:
-                        # The target is a terminal relay and can be removed from
-                        # our intermediary target list and its terminal targets
-                        # added to our terminal target list.
-                        arr = interm_transfer[intermediate]
-                        assert all(
-                            isinstance(t, tuple) for t in terminal_relays[target]
-                        ), f"Terminal relay {lookup(target)} {target} contains non-terminal targets: {terminal_relays[target]}"
-                        arr.extend(terminal_relays[target])
-                        targets.remove(target)
-                    else:
-                        raise RelayError(
-                            f"Non-relay {lookup(target)} {target} found in intermediate relay map."
-                        )
-                # If we have no more intermediary targets, we can be removed from
-                # the intermediary relay list and be moved to the terminals.
-                if not targets:
-                    intermediates_to_remove.append(intermediate)
-                    terminal_relays[intermediate] = interm_transfer.pop(intermediate)
-            for intermediate in intermediates_to_remove:
-                report(
-                    "Intermediate resolved to",
-                    len(terminal_relays[intermediate]),
-                    "targets",
-                    level=4,
-                )
-                intermediate_relays.pop(intermediate, None)
-
+        # Keep only the relays to targets on this node.
+        self._relay_scheme = relay_index.resolve(np.fromiter(self.gids, dtype=int))
         report("Relays resolved.")
-
-        # Filter out all relays to targets not on this node.
-        self._relays_on = {gid: [] for gid in self.gids}
-        for relay, targets in terminal_relays.items():
-            assert all(
-                isinstance(t, tuple) for t in terminal_relays[target]
-            ), f"Terminal relay {lookup(target)} {target} contains non-terminal targets: {terminal_relays[target]}"
-
-            for conn in targets:
-                to_id = int(conn[0])
-                if to_id in self.gids:
-                    self._relays_on[to_id].append((relay, *conn[1:]))
         report(
             "Node",
             self.get_rank(),
             "needs to relay",
-            sum(bool(relays) for relays in self._relays_on.values()),
+            len(self._relay_scheme.get_relays()),
             "relays.",
             level=4,
         )
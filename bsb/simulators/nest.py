@@ -10,11 +10,9 @@ from ..reporting import report, warn
 from ..exceptions import *
 import time, os, json, weakref, numpy as np
 from itertools import chain
-from copy import deepcopy
 from sklearn.neighbors import KDTree
-from ..simulation import SimulationRecorder, SimulationResult
+from ..simulation import SimulationRecorder, SimulationResult, ResultWriter
 import warnings
-import h5py
 import time
 
 try:
@@ -43,19 +41,69 @@ _LOCK_ATTRIBUTE = "_dbbs_scaffold_lock"
 _HOT_MODULE_ATTRIBUTE = "_dbbs_scaffold_hot_modules"
 
 
+class IdentifierMap:
+    """
+    Dense lookup tables that translate scaffold identifiers into NEST identifiers and
+    back in a single indexing operation. Unknown identifiers raise a ``KeyError``.
+    """
+
+    def __init__(self, scaffold_ids=(), nest_ids=()):
+        self._to_nest = np.empty(0, dtype=int)
+        self._to_scaffold = np.empty(0, dtype=int)
+        self.update(scaffold_ids, nest_ids)
+
+    def update(self, scaffold_ids, nest_ids):
+        """
+        Add pairs of scaffold and NEST identifiers to the map.
+        """
+        scaffold_ids = np.asarray(scaffold_ids, dtype=int).reshape(-1)
+        nest_ids = np.asarray(nest_ids, dtype=int).reshape(-1)
+        self._to_nest = _assign_ids(self._to_nest, scaffold_ids, nest_ids)
+        self._to_scaffold = _assign_ids(self._to_scaffold, nest_ids, scaffold_ids)
+
+    def __len__(self):
+        return np.count_nonzero(self._to_nest != -1)
+
+    def get_nest_ids(self, ids):
+        return _lookup_ids(self._to_nest, ids)
+
+    def get_scaffold_ids(self, ids):
+        return _lookup_ids(self._to_scaffold, ids)
+
+
+def _assign_ids(table, keys, values):
+    # Grow the table to fit the largest key, with -1 for the keys that are not mapped.
+    if len(keys) and keys.max() >= len(table):
+        padding = np.full(keys.max() + 1 - len(table), -1, dtype=int)
+        table = np.concatenate((table, padding))
+    table[keys] = values
+    return table
+
+
+def _lookup_ids(table, ids):
+    keys = np.asarray(ids).astype(int)
+    values = np.full(keys.shape, -1, dtype=int)
+    known = (keys >= 0) & (keys < len(table))
+    values[known] = table[keys[known]]
+    unknown = values == -1
+    if np.any(unknown):
+        raise KeyError(int(keys[unknown][0]))
+    return values
+
+
 class MapsScaffoldIdentifiers:
     def reset_identifiers(self):
         self.nest_identifiers = []
         self.scaffold_identifiers = []
-        self.scaffold_to_nest_map = {}
+        self.identifier_map = IdentifierMap()
 
     def _build_identifier_map(self):
-        self.scaffold_to_nest_map = dict(
-            zip(self.scaffold_identifiers, self.nest_identifiers)
+        self.identifier_map = IdentifierMap(
+            self.scaffold_identifiers, self.nest_identifiers
         )
 
     def get_nest_ids(self, ids):
-        return [self.scaffold_to_nest_map[id] for id in ids]
+        return self.identifier_map.get_nest_ids(ids)
 
 
 class NestCell(SimulationCell, MapsScaffoldIdentifiers):
@@ -308,7 +356,7 @@ class NestAdapter(SimulatorAdapter):
         "entities": NestEntity,
     }
 
-    casts = {"threads": int, "modules": list}
+    casts = {"threads": int, "modules": list, "chunk_size": int}
 
     defaults = {
         "default_synapse_model": "static_synapse",
@@ -317,6 +365,7 @@ class NestAdapter(SimulatorAdapter):
         "threads": 1,
         "resolution": 1.0,
         "modules": [],
+        "chunk_size": 4096,
     }
 
     required = [
@@ -343,7 +392,7 @@ class NestAdapter(SimulatorAdapter):
         self.suffix = ""
         self.multi = False
         self.has_lock = False
-        self.global_identifier_map = {}
+        self.global_identifier_map = IdentifierMap()
         self.simulation_id = _randint()
 
     def prepare(self):
@@ -477,7 +526,7 @@ class NestAdapter(SimulatorAdapter):
         self.is_prepared = False
         if hasattr(self, "nest"):
             self.reset_kernel()
-        self.global_identifier_map = {}
+        self.global_identifier_map = IdentifierMap()
         for cell_model in self.cell_models.values():
             cell_model.reset()
         if self.has_lock:
@@ -563,45 +612,17 @@ class NestAdapter(SimulatorAdapter):
     def collect_output(self, simulator):
         report("Collecting output...", level=2)
         tick = time.time()
-        try:
-            import mpi4py
-
-            rank = mpi4py.MPI.COMM_WORLD.rank
-        except Exception as e:
-            print(str(e))
-            rank = 0
-
         timestamp = str(time.time()).split(".")[0] + str(_randint())
         result_path = "results_" + self.name + "_" + timestamp + ".hdf5"
-        if rank == 0:
-            with h5py.File(result_path, "a") as f:
-                f.attrs["configuration_string"] = self.scaffold.configuration._raw
-                for path, data, meta in self.result.safe_collect():
-                    try:
-                        path = "/".join(path)
-                        if path in f:
-                            data = np.vstack((f[path][()], data))
-                            del f[path]
-                        d = f.create_dataset(path, data=data)
-                        for k, v in meta.items():
-                            d.attrs[k] = v
-                    except Exception as e:
-                        import traceback
-
-                        traceback.print_exc()
-                        if not isinstance(data, np.ndarray):
-                            warn(
-                                "Recorder {} numpy.ndarray expected, got {}".format(
-                                    path, type(data)
-                                )
-                            )
-                        else:
-                            warn(
-                                "Recorder {} processing errored out: {}".format(
-                                    path, "{} {}".format(data.dtype, data.shape)
-                                )
-                            )
-        mpi4py.MPI.COMM_WORLD.bcast(result_path, root=0)
+        result_path = self.broadcast(result_path)
+        # Let the devices fetch the data that each rank recorded in memory.
+        for device_model in self.devices.values():
+            device_model.protocol.before_collect()
+        writer = ResultWriter(result_path, chunk_size=self.chunk_size)
+        writer.write(
+            self.result.safe_collect(),
+            attrs={"configuration_string": self.scaffold.configuration._raw},
+        )
         report(
             f"Output collected in '{result_path}'. "
             + f"{time.time() - tick:.2f}s elapsed.",
@@ -681,15 +702,16 @@ class NestAdapter(SimulatorAdapter):
         for mapping_type in chain(self.entities.values(), self.cell_models.values()):
             # "Freeze" the type's identifiers into a map
             mapping_type._build_identifier_map()
-            # Add the type's map to the global map
-            self.global_identifier_map.update(mapping_type.scaffold_to_nest_map)
+            # Add the type's identifiers to the global map
+            self.global_identifier_map.update(
+                mapping_type.scaffold_identifiers, mapping_type.nest_identifiers
+            )
 
     def get_nest_ids(self, ids):
-        return [self.global_identifier_map[id] for id in ids]
+        return self.global_identifier_map.get_nest_ids(ids)
 
     def get_scaffold_ids(self, ids):
-        scaffold_map = {v: k for k, v in self.global_identifier_map.items()}
-        return [scaffold_map[id] for id in ids]
+        return self.global_identifier_map.get_scaffold_ids(ids)
 
     def create_neurons(self):
         """
@@ -762,17 +784,13 @@ class NestAdapter(SimulatorAdapter):
                 continue
             # Get the NEST identifiers for the connections made in the connectivity matrix
             try:
-                presynaptic_sources = np.array(
-                    self.get_nest_ids(np.array(cs.from_identifiers, dtype=int))
-                )
+                presynaptic_sources = self.get_nest_ids(cs.from_identifiers)
             except KeyError as e:
                 raise UnknownGIDError(
                     f"Unknown GID {e.args[0]} in presynaptic `{name}` data."
                 ) from None
             try:
-                postsynaptic_targets = np.array(
-                    self.get_nest_ids(np.array(cs.to_identifiers, dtype=int))
-                )
+                postsynaptic_targets = self.get_nest_ids(cs.to_identifiers)
             except KeyError as e:
                 raise UnknownGIDError(
                     f"Unknown GID {e.args[0]} in postsynaptic `{name}` data."
@@ -806,7 +824,7 @@ class NestAdapter(SimulatorAdapter):
                     # once, without setting any receptor type in the conn params.
                     receptor_types.append(None)
                 for receptor_type in receptor_types:
-                    single_connection_parameters = deepcopy(connection_parameters)
+                    single_connection_parameters = connection_parameters.copy()
                     if receptor_type is not None:
                         single_connection_parameters["receptor_type"] = receptor_type
                     self.execute_command(
@@ -831,30 +849,13 @@ class NestAdapter(SimulatorAdapter):
                     connection_model, postsynaptic_cells
                 )
                 postsynaptic_type._vt_id = volume_transmitters
-
-                # Each post synaptic cell has to set its own vt_num for its synapses
-                for vt_num, post_cell in enumerate(postsynaptic_cells):
-                    connection_parameters = connection_model.get_connection_parameters()
-                    connection_parameters["vt_num"] = float(vt_num)
-                    indexes = np.where(postsynaptic_targets == post_cell)[0]
-                    pre_neurons = presynaptic_sources[indexes]
-                    post_neurons = postsynaptic_targets[indexes]
-
-                    self.execute_command(
-                        self.nest.Connect,
-                        pre_neurons,
-                        post_neurons,
-                        connection_specifications,
-                        connection_parameters,
-                        exceptions={
-                            "IncompatibleReceptorType": {
-                                "from": None,
-                                "exception": catch_receptor_error(
-                                    "Invalid receptor specifications in {}: ".format(name)
-                                ),
-                            }
-                        },
-                    )
+                self._connect_hetero(
+                    connection_model,
+                    presynaptic_sources,
+                    postsynaptic_targets,
+                    postsynaptic_cells,
+                    connection_specifications,
+                )
 
             if connection_model.is_teaching:
                 # We need to map the ID of the postsynaptic_target to its relative volume_transmitter
@@ -869,6 +870,35 @@ class NestAdapter(SimulatorAdapter):
                     {"model": "static_synapse", "weight": 1.0, "delay": 1.0},
                 )
 
+    def _connect_hetero(
+        self, connection_model, sources, targets, postsynaptic_cells, specifications
+    ):
+        # Each postsynaptic cell has its own volume transmitter, so the synapses set the
+        # `vt_num` of their target. Sort the connections by target, as the cells were
+        # connected one by one before, and pass `vt_num` as an array parameter to
+        # connect them all in a single call.
+        vt_nums = np.searchsorted(postsynaptic_cells, targets)
+        order = np.argsort(vt_nums, kind="stable")
+        connection_parameters = connection_model.get_connection_parameters()
+        connection_parameters["vt_num"] = vt_nums[order].astype(float)
+        self.execute_command(
+            self.nest.Connect,
+            sources[order],
+            targets[order],
+            specifications,
+            connection_parameters,
+            exceptions={
+                "IncompatibleReceptorType": {
+                    "from": None,
+                    "exception": catch_receptor_error(
+                        "Invalid receptor specifications in {}: ".format(
+                            connection_model.name
+                        )
+                    ),
+                }
+            },
+        )
+
     def create_devices(self):
         """
         Create the configured NEST devices in the simulator
@@ -1045,8 +1075,8 @@ class SpikeRecorder(SimulationRecorder):
                 file_spikes = np.loadtxt(file)
                 # if len(file_spikes):
                 if len(file_spikes.shape) > 1:
-                    scaffold_ids = np.array(
-                        self.device_model.adapter.get_scaffold_ids(file_spikes[:, 0])
+                    scaffold_ids = self.device_model.adapter.get_scaffold_ids(
+                        file_spikes[:, 0]
                     )
                     self.cell_types = list(
                         set(
@@ -1082,6 +1112,19 @@ class SpikeRecorder(SimulationRecorder):
         }
 
 
+class MemorySpikeRecorder(SpikeRecorder):
+    """
+    Recorder of a spike detector that records in memory. Each rank records the spikes
+    that the device protocol fetched on that rank, as records with typed ``id`` and
+    ``time`` columns.
+    """
+
+    dtype = np.dtype([("id", np.int64), ("time", np.float64)])
+
+    def get_data(self):
+        return self.device_model.protocol.spikes
+
+
 def _randint():
     return np.random.randint(np.iinfo(int).max)
 
@@ -1096,9 +1139,24 @@ class DeviceProtocol:
     def after_create(self, id):
         pass
 
+    def before_collect(self):
+        pass
+
 
 class SpikeDetectorProtocol(DeviceProtocol):
+    def records_to_file(self):
+        """
+        Check whether the spike detector writes its spikes to ``.gdf`` files, rather
+        than keeping them in memory.
+        """
+        return self.device.parameters.get("to_file", False)
+
     def before_create(self):
+        self.spikes = np.empty(0, dtype=MemorySpikeRecorder.dtype)
+        if not self.records_to_file():
+            # The spikes are recorded on every rank, and written in parallel.
+            self.device.adapter.result.add(MemorySpikeRecorder(self.device))
+            return
         if "label" not in self.device.parameters:
             raise ConfigurationError(
                 "Required `label` missing in spike detector '{}' parameters.".format(
@@ -1113,6 +1171,20 @@ class SpikeDetectorProtocol(DeviceProtocol):
         if mpi4py.MPI.COMM_WORLD.rank == 0:
             self.device.adapter.result.add(SpikeRecorder(self.device))
 
+    def after_create(self, id):
+        self.device_ids = id
+
+    def before_collect(self):
+        if self.records_to_file() or not hasattr(self, "device_ids"):
+            return
+        adapter = self.device.adapter
+        events = adapter.nest.GetStatus(self.device_ids, "events")[0]
+        self.spikes = np.empty(len(events["senders"]), dtype=MemorySpikeRecorder.dtype)
+        self.spikes["id"] = adapter.get_scaffold_ids(events["senders"])
+        self.spikes["time"] = events["times"]
+        # Clear the events so that they are not collected again.
+        adapter.nest.SetStatus(self.device_ids, {"n_events": 0})
+
 
 def get_device_protocol(device):
     if device.device in _device_protocols:
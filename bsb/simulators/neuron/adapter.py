@@ -7,18 +7,19 @@ from ...simulation import (
     SimulationResult,
     SimulationRecorder,
     SimulationDevice,
+    ResultWriter,
+    RelayIndex,
 )
 from ...helpers import get_configurable_class
 from ...reporting import report, warn
 from ...models import ConnectivitySet
 from ...exceptions import *
-import random, os, sys
+import random, os, sys, json, heapq, shutil
 import numpy as np
 import traceback
 import errr
 import time
 
-
 try:
     import neuron
 
@@ -27,6 +28,58 @@ except ImportError:
     _has_neuron = False
 
 
+def partition_costs(costs, size, adjacency=None, tolerance=0.05):
+    """
+    Partition weighted cells over ``size`` ranks with the greedy longest processing
+    time (LPT) rule: in order of decreasing cost, each cell is assigned to the least
+    loaded rank. If an ``adjacency`` matrix of the cells is given, a cell is assigned
+    to the rank of most of its already assigned neighbours instead, if that does not
+    load that rank more than ``tolerance`` above the average load.
+
+    :param costs: Cost of each cell.
+    :param adjacency: Sparse matrix of the connections between the cells.
+    :returns: The rank of each cell, and the load of each rank.
+    :rtype: tuple of numpy.ndarray
+    """
+    costs = np.asarray(costs, dtype=float)
+    ranks = np.full(len(costs), -1, dtype=int)
+    loads = np.zeros(size)
+    limit = np.sum(costs) / size * (1 + tolerance)
+    if adjacency is not None:
+        adjacency = (adjacency + adjacency.T).tocsr()
+    # Heap of the rank loads, with outdated entries skipped as they come up.
+    heap = [(0.0, rank) for rank in range(size)]
+    for cell in np.argsort(-costs, kind="stable"):
+        rank = -1
+        if adjacency is not None:
+            neighbours = adjacency.indices[
+                adjacency.indptr[cell] : adjacency.indptr[cell + 1]
+            ]
+            neighbour_ranks = ranks[neighbours]
+            neighbour_ranks = neighbour_ranks[neighbour_ranks != -1]
+            if len(neighbour_ranks):
+                preferred = np.argmax(np.bincount(neighbour_ranks, minlength=size))
+                if loads[preferred] + costs[cell] <= limit:
+                    rank = preferred
+        if rank == -1:
+            while heap[0][0] != loads[heap[0][1]]:
+                heapq.heappop(heap)
+            rank = heap[0][1]
+        ranks[cell] = rank
+        loads[rank] += costs[cell]
+        heapq.heappush(heap, (loads[rank], rank))
+    return ranks, loads
+
+
+def _positions(sorted_ids, ids):
+    # The position of each id in the sorted ids, and whether it was found.
+    ids = np.asarray(ids, dtype=int)
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=int), np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == ids
+
+
 class NeuronCell(SimulationCell):
     node_name = "simulations.?.cell_models"
 
@@ -120,11 +173,11 @@ class NeuronDevice(TargetsNeurons, TargetsSections, SimulationDevice):
     def get_locations(self, target):
         locations = []
         if target in self.adapter.relay_scheme:
-            for cell_id, section_id, connection in self.adapter.relay_scheme[target]:
-                if cell_id not in self.adapter.node_cells:
-                    continue
+            for cell_id, section_id, connection in self.adapter.get_relay_targets(target):
                 cell = self.adapter.cells[cell_id]
-                section = cell.sections[section_id]
+                section = self.adapter._get_section(
+                    cell, section_id, DeviceConnectionError
+                )
                 locations.append(TargetLocation(cell, section, connection))
         elif target in self.adapter.node_cells:
             try:
@@ -156,6 +209,28 @@ class NeuronEntity:
         raise NotImplementedError("Entities do not have a soma to record.")
 
 
+class ParallelContextComm:
+    """
+    Communicator over the ranks of a NEURON ``ParallelContext``, for when NEURON runs
+    without ``mpi4py``.
+    """
+
+    def __init__(self, pc):
+        self.pc = pc
+
+    def Get_rank(self):
+        return int(self.pc.id())
+
+    def Get_size(self):
+        return int(self.pc.nhost())
+
+    def Barrier(self):
+        self.pc.barrier()
+
+    def allgather(self, data):
+        return self.pc.py_allgather(data)
+
+
 class NeuronAdapter(SimulatorAdapter):
     """
     Interface between the scaffold model and the NEURON simulator.
@@ -174,9 +249,21 @@ class NeuronAdapter(SimulatorAdapter):
         "duration": float,
         "resolution": float,
         "initial": float,
+        "load_balancing": str,
+        "balance_tolerance": float,
+        "barrier_interval": float,
+        "checkpoint_interval": float,
+        "checkpoint_path": str,
     }
 
-    defaults = {"initial": -65.0}
+    defaults = {
+        "initial": -65.0,
+        "load_balancing": "round_robin",
+        "balance_tolerance": 0.05,
+        "barrier_interval": 1.0,
+        "checkpoint_interval": None,
+        "checkpoint_path": "checkpoints",
+    }
 
     required = ["temperature", "duration", "resolution"]
 
@@ -187,7 +274,24 @@ class NeuronAdapter(SimulatorAdapter):
         self.transmitter_map = {}
 
     def validate(self):
-        pass
+        if self.load_balancing not in ("round_robin", "cost"):
+            raise ConfigurationError(
+                "Unknown load balancing '{}' in {}, choose 'round_robin' or 'cost'.".format(
+                    self.load_balancing, self.get_config_node()
+                )
+            )
+        if self.barrier_interval <= 0:
+            raise ConfigurationError(
+                "The barrier interval of {} must be positive.".format(
+                    self.get_config_node()
+                )
+            )
+        if self.checkpoint_interval is not None and self.checkpoint_interval <= 0:
+            raise ConfigurationError(
+                "The checkpoint interval of {} must be positive.".format(
+                    self.get_config_node()
+                )
+            )
 
     def validate_prepare(self):
         output_handler = self.scaffold.output_formatter
@@ -328,8 +432,113 @@ class NeuronAdapter(SimulatorAdapter):
         rank = self.get_rank()
         size = self.get_size()
         self.cell_total = self.scaffold.get_cell_total()
-        # Do a lazy round robin for now.
-        self.node_cells = set(range(rank, self.cell_total, size))
+        if self.load_balancing == "round_robin":
+            self.node_cells = set(range(rank, self.cell_total, size))
+            self.predicted_load = None
+            return
+        ids, costs = self.estimate_cell_costs()
+        adjacency = self.get_cell_adjacency(ids)
+        ranks, loads = partition_costs(costs, size, adjacency, self.balance_tolerance)
+        self.node_cells = set(ids[ranks == rank].tolist())
+        self.predicted_load = loads[rank]
+
+    def estimate_cell_costs(self):
+        """
+        Estimate the integration cost of every cell of the cell models, as the cost of
+        their morphology plus the synapses that they receive. Relays and entities have
+        the cost of a single compartment.
+
+        :returns: The sorted cell ids and the cost of each cell.
+        :rtype: tuple of numpy.ndarray
+        """
+        ids, costs = [], []
+        for cell_model in self.cell_models.values():
+            type_ids = self.scaffold.get_placement_set(cell_model.name).identifiers
+            if cell_model.relay or cell_model.cell_type.entity:
+                cost = 1.0
+            else:
+                cost = self._get_morphology_cost(cell_model)
+            ids.append(type_ids)
+            costs.append(np.full(len(type_ids), cost))
+        ids = np.concatenate(ids).astype(int) if ids else np.empty(0, dtype=int)
+        costs = np.concatenate(costs) if costs else np.empty(0)
+        order = np.argsort(ids)
+        ids, costs = ids[order], costs[order]
+        output_handler = self.scaffold.output_formatter
+        for connection_model in self.connection_models.values():
+            connectivity_set = ConnectivitySet(output_handler, connection_model.name)
+            if connectivity_set.is_orphan():
+                continue
+            synapses = len(connection_model.synapses)
+            costs += synapses * connectivity_set.get_in_degrees(ids)
+        return ids, costs
+
+    def _get_morphology_cost(self, cell_model):
+        # Average over the morphologies of the cell type of the number of compartments,
+        # where each compartment also costs the mechanisms of its section type.
+        names = cell_model.cell_type.list_all_morphologies()
+        if not names:
+            return 1.0
+        section_types = getattr(
+            getattr(cell_model, "model_class", None), "section_types", {}
+        )
+        mechanisms = {
+            label: len(section.get("mechanisms", ()))
+            for label, section in section_types.items()
+            if isinstance(section, dict)
+        }
+        repository = self.scaffold.morphology_repository
+        costs = []
+        for name in names:
+            morphology = repository.get_morphology(name)
+            costs.append(
+                sum(
+                    1 + max((mechanisms.get(l, 0) for l in c.labels), default=0)
+                    for c in morphology.compartments
+                )
+            )
+        return float(np.mean(costs))
+
+    def get_cell_adjacency(self, ids):
+        """
+        Return the connections between the given sorted cell ids, as a sparse matrix
+        with a row and column per cell.
+        """
+        from scipy.sparse import coo_matrix
+
+        rows, cols = [], []
+        output_handler = self.scaffold.output_formatter
+        for connection_model in self.connection_models.values():
+            connectivity_set = ConnectivitySet(output_handler, connection_model.name)
+            if connectivity_set.is_orphan():
+                continue
+            pre, known_pre = _positions(ids, connectivity_set.from_identifiers)
+            post, known_post = _positions(ids, connectivity_set.to_identifiers)
+            known = known_pre & known_post
+            rows.append(pre[known])
+            cols.append(post[known])
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=int)
+        return coo_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(ids), len(ids))
+        ).tocsr()
+
+    def report_load_balance(self):
+        """
+        Report the predicted load of each rank against the time it spent integrating.
+        """
+        if self.predicted_load is None:
+            return
+        predicted = np.array(self.pc.py_allgather(self.predicted_load))
+        measured = np.array(self.pc.py_allgather(self.pc.step_time()))
+        if self.get_rank() == 0:
+            for rank, (p, m) in enumerate(zip(predicted, measured)):
+                report(
+                    "Rank {} load: predicted {:.2f}, measured {:.2f}".format(
+                        rank, p / np.mean(predicted), m / np.mean(measured)
+                    ),
+                    level=2,
+                )
 
     def simulate(self, simulator):
         from plotly import graph_objects as go
@@ -341,56 +550,171 @@ class NeuronAdapter(SimulatorAdapter):
         report("Simulating...", level=2)
         pc.set_maxstep(10)
         simulator.finitialize(self.initial)
-        progression = 0
+        self._run(0)
+
+    def resume(self, simulator):
+        """
+        Restore the state of the prepared network from the last checkpoint in the
+        ``checkpoint_path`` and simulate the rest of the duration.
+        """
+        pc = simulator.parallel
+        self.pc = pc
+        pc.barrier()
+        pc.set_maxstep(10)
+        simulator.finitialize(self.initial)
+        start = self.restore_checkpoint(simulator)
+        report("Resuming simulation at", start, "ms.", level=2)
+        self._run(start)
+
+    def _run(self, start):
+        pc = self.pc
+        interval = self.checkpoint_interval
+        next_checkpoint = start + interval if interval else float("inf")
         self.start_progress(self.duration)
-        for oi, i in self.step_progress(self.duration, 1):
-            t = time.time()
+        for oi, i in self.step_progress(self.duration, self.barrier_interval, start):
             pc.psolve(i)
             pc.barrier()
             self.progress(i)
+            if i >= next_checkpoint and i < self.duration:
+                self.write_checkpoint(self.h, i)
+                next_checkpoint = i + interval
             if os.path.exists("interrupt_neuron"):
                 report("Iterrupt requested. Stopping simulation.", level=1)
                 break
         report("Finished simulation.", level=2)
+        self.report_load_balance()
+
+    def write_checkpoint(self, simulator, t):
+        """
+        Write the NEURON state and the recorded data of this node to a new directory
+        in the ``checkpoint_path``. Once all nodes have written theirs, the
+        ``checkpoint.json`` pointer is atomically replaced to name the new directory,
+        and the previous checkpoint is removed.
+        """
+        rank = self.get_rank()
+        name = f"checkpoint_{float(t)}"
+        directory = os.path.join(self.checkpoint_path, name)
+        os.makedirs(directory, exist_ok=True)
+        state = simulator.SaveState()
+        state.save()
+        file = simulator.File()
+        file.wopen(os.path.join(directory, f"state_{rank}.dat"))
+        state.fwrite(file)
+        np.savez(
+            os.path.join(directory, f"recorders_{rank}.npz"),
+            *(np.array(vector) for vector in self._get_recorder_vectors()),
+        )
+        self.pc.barrier()
+        if rank == 0:
+            previous = self._read_checkpoint_pointer(missing_ok=True)
+            pointer = os.path.join(self.checkpoint_path, "checkpoint.json")
+            with open(pointer + ".tmp", "w") as f:
+                json.dump({"t": float(t), "nodes": self.get_size(), "path": name}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer + ".tmp", pointer)
+            if previous is not None and previous["path"] != name:
+                shutil.rmtree(
+                    os.path.join(self.checkpoint_path, previous["path"]),
+                    ignore_errors=True,
+                )
+        report("Checkpoint written at", t, "ms.", level=2)
+
+    def restore_checkpoint(self, simulator):
+        """
+        Restore the NEURON state and the recorded data of this node from the
+        checkpoint that ``checkpoint.json`` in the ``checkpoint_path`` points to.
+
+        :returns: The time of the checkpoint.
+        :rtype: float
+        """
+        rank = self.get_rank()
+        checkpoint = self._read_checkpoint_pointer()
+        if checkpoint["nodes"] != self.get_size():
+            raise NeuronError(
+                "Checkpoint written by {} nodes can't be restored on {} nodes.".format(
+                    checkpoint["nodes"], self.get_size()
+                )
+            )
+        directory = os.path.join(self.checkpoint_path, checkpoint["path"])
+        state_path = os.path.join(directory, f"state_{rank}.dat")
+        recorders_path = os.path.join(directory, f"recorders_{rank}.npz")
+        if not os.path.exists(state_path) or not os.path.exists(recorders_path):
+            raise NeuronError(
+                f"Checkpoint '{directory}' misses the files of node {rank}."
+            )
+        state = simulator.SaveState()
+        file = simulator.File()
+        file.ropen(state_path)
+        state.fread(file)
+        state.restore()
+        with np.load(recorders_path) as buffers:
+            vectors = list(self._get_recorder_vectors())
+            if len(buffers.files) != len(vectors):
+                raise NeuronError(
+                    "Checkpoint of node {} holds {} recordings, expected {}.".format(
+                        rank, len(buffers.files), len(vectors)
+                    )
+                )
+            for i, vector in enumerate(vectors):
+                vector.from_python(buffers[f"arr_{i}"])
+        return checkpoint["t"]
+
+    def _read_checkpoint_pointer(self, missing_ok=False):
+        path = os.path.join(self.checkpoint_path, "checkpoint.json")
+        try:
+            with open(path, "r") as f:
+                checkpoint = json.load(f)
+            checkpoint = {key: checkpoint[key] for key in ("t", "nodes", "path")}
+        except FileNotFoundError:
+            if missing_ok:
+                return None
+            raise NeuronError(
+                f"No checkpoint found in '{self.checkpoint_path}'."
+            ) from None
+        except (ValueError, KeyError, TypeError):
+            raise NeuronError(f"Checkpoint pointer '{path}' is corrupt.") from None
+        return checkpoint
+
+    def _get_recorder_vectors(self):
+        # The NEURON vectors of all recorders on this node, in the order they were
+        # registered, so that they match between a run and its resumption.
+        candidates = [self.h.time] if self.get_rank() == 0 else []
+        for recorder in self.result.recorders:
+            candidates.append(getattr(recorder, "recorder", None))
+            candidates.append(getattr(recorder, "time_recorder", None))
+            candidates.extend(getattr(recorder, "vectors", []))
+        vectors = {}
+        for vector in candidates:
+            if vector is not None and hasattr(vector, "from_python"):
+                vectors.setdefault(id(vector), vector)
+        return vectors.values()
 
     def collect_output(self, simulator):
-        import h5py, time
+        import time
 
         timestamp = str(time.time()).split(".")[0] + str(random.random()).split(".")[1]
         timestamp = self.pc.broadcast(timestamp)
         result_path = "results_" + self.name + "_" + timestamp + ".hdf5"
-        for node in range(self.get_size()):
-            self.pc.barrier()
-            if node == self.get_rank():
-                report("Node", self.get_rank(), "is writing", level=2, all_nodes=True)
-                with h5py.File(result_path, "a") as f:
-                    f.attrs["configuration_string"] = self.scaffold.configuration._raw
-                    for path, data, meta in self.result.safe_collect():
-                        try:
-                            path = "/".join(path)
-                            if path in f:
-                                data = np.concatenate((f[path][()], data))
-                                del f[path]
-                            d = f.create_dataset(path, data=data)
-                            for k, v in meta.items():
-                                d.attrs[k] = v
-                        except Exception as e:
-                            if not isinstance(data, np.ndarray):
-                                warn(
-                                    "Recorder {} numpy.ndarray expected, got {}".format(
-                                        path, type(data)
-                                    )
-                                )
-                            else:
-                                warn(
-                                    "Recorder {} processing errored out: {}\n\n{}".format(
-                                        path,
-                                        "{} {}".format(data.dtype, data.shape),
-                                        traceback.format_exc(),
-                                    )
-                                )
-            self.pc.barrier()
-        return result_path
+        writer = ResultWriter(result_path, comm=self._get_result_comm())
+        return writer.write(
+            self.result.safe_collect(),
+            attrs={"configuration_string": self.scaffold.configuration._raw},
+        )
+
+    def _get_result_comm(self):
+        # Use MPI if NEURON runs on the same ranks, otherwise the ranks of NEURON.
+        try:
+            from mpi4py.MPI import COMM_WORLD
+        except ImportError:
+            pass
+        else:
+            if (COMM_WORLD.Get_rank(), COMM_WORLD.Get_size()) == (
+                self.pc.id(),
+                self.pc.nhost(),
+            ):
+                return COMM_WORLD
+        return ParallelContextComm(self.pc)
 
     def create_transmitters(self):
         # Concatenates all the `from` locations of all intersections together and creates
@@ -404,15 +728,14 @@ class NeuronAdapter(SimulatorAdapter):
         alloc = np.empty((total, 2), dtype=int)
         ptr = 0
         for connectivity_set in sets:
-            # Get the connectivity set's intersection and slice them into the array.
-            inter = connectivity_set.intersections
-            if not len(inter):
+            # Get the connectivity set's columns and slice them into the array.
+            columns = connectivity_set.get_columns()
+            if not len(columns):
                 continue
-            alloc[ptr : (ptr + len(inter))] = [
-                (i.from_id, i.from_compartment.section_id) for i in inter
-            ]
+            alloc[ptr : (ptr + len(columns)), 0] = columns.from_ids
+            alloc[ptr : (ptr + len(columns)), 1] = columns.from_sections
             # Move up the pointer for the next slice.
-            ptr += len(inter)
+            ptr += len(columns)
         unique_transmitters = np.unique(alloc, axis=0)
         self.transmitter_map = dict(zip(map(tuple, unique_transmitters), range(total)))
         tcount = 0
@@ -420,7 +743,8 @@ class NeuronAdapter(SimulatorAdapter):
             for (cell_id, section_id), gid in self.transmitter_map.items():
                 if cell_id in self.node_cells:
                     cell = self.cells[cell_id]
-                    cell.create_transmitter(cell.sections[section_id], gid)
+                    section = self._get_section(cell, section_id, TransmitterError)
+                    cell.create_transmitter(section, gid)
                     tcount += 1
         except Exception as e:
             errr.wrap(TransmitterError, e, prepend=f"[{cell_id}] ")
@@ -436,16 +760,30 @@ class NeuronAdapter(SimulatorAdapter):
             if not connection_model.source:
                 continue
             source = connection_model.source
-            set = self._model_to_set(connection_model)
-            for inter in set.intersections:
-                cell_id = inter.from_id
-                if cell_id not in self.node_cells:
-                    continue
+            columns = self._model_to_set(connection_model).get_columns()
+            on_node = self._on_node(columns.from_ids)
+            for cell_id, section_id in zip(
+                columns.from_ids[on_node], columns.from_sections[on_node]
+            ):
                 cell = self.cells[cell_id]
-                section_id = inter.from_compartment.section_id
-                section = cell.sections[section_id]
                 gid = self.transmitter_map[(cell_id, section_id)]
-                cell.create_transmitter(cell.sections[section_id], gid, source)
+                section = self._get_section(cell, section_id, TransmitterError)
+                cell.create_transmitter(section, gid, source)
+
+    def _get_section(self, cell, section_id, error):
+        # Connections without compartment data have section id -1, which must not
+        # index the last section of the cell.
+        if section_id < 0:
+            raise error(f"Missing section data for a connection of cell {cell.ref_id}.")
+        return cell.sections[section_id]
+
+    def _node_ids(self):
+        # Sorted ids of the cells that are simulated on this node.
+        return np.sort(np.fromiter(self.node_cells, dtype=int))
+
+    def _on_node(self, ids):
+        # Mask of the ids of the cells that are simulated on this node.
+        return np.isin(ids, np.fromiter(self.node_cells, dtype=int))
 
     def _collect_transmitter_sets(self, models):
         sets = self._models_to_sets(models)
@@ -483,40 +821,37 @@ class NeuronAdapter(SimulatorAdapter):
                 # .get_locations() should offer some insights
             else:
                 synapse_types = connection_model.resolve_synapses()
-                for intersection in connectivity_set.intersections:
-                    if intersection.to_id in self.node_cells:
-                        cell = self.cells[int(intersection.to_id)]
-                        section_id = int(intersection.to_compartment.section_id)
-                        section = cell.sections[section_id]
-                        gid = self.transmitter_map[
-                            (
-                                intersection.from_id,
-                                intersection.from_compartment.section_id,
-                            )
-                        ]
-                        for synapse_type in synapse_types:
-                            try:
-                                cell.create_receiver(section, gid, synapse_type)
-                            except Exception as e:
-                                raise ScaffoldError(
-                                    "[" + connection_model.name + "] " + str(e)
-                                ) from None
+                # Read only the connections onto the cells of this node.
+                columns = connectivity_set.get_incoming_columns(self._node_ids())
+                for from_id, from_section, to_id, to_section in zip(
+                    columns.from_ids,
+                    columns.from_sections,
+                    columns.to_ids,
+                    columns.to_sections,
+                ):
+                    cell = self.cells[to_id]
+                    section = self._get_section(cell, to_section, ConnectivityError)
+                    gid = self.transmitter_map[(from_id, from_section)]
+                    for synapse_type in synapse_types:
+                        try:
+                            cell.create_receiver(section, gid, synapse_type)
+                        except Exception as e:
+                            raise ScaffoldError(
+                                "[" + connection_model.name + "] " + str(e)
+                            ) from None
 
     def create_neurons(self):
+        node_ids = self._node_ids()
         for cell_model in self.cell_models.values():
-            cell_positions = None
-            if self.scaffold.configuration.get_cell_type(cell_model.name).entity:
-                cell_data = self.scaffold.get_entities_by_type(cell_model.name)
-                cell_data = np.column_stack((cell_data, np.zeros((len(cell_data), 4))))
-            else:
-                cell_data = self.scaffold.get_cells_by_type(cell_model.name)
-            report("Placing " + str(len(cell_data)) + " " + cell_model.name)
-            for cell in cell_data:
-                cell_id = int(cell[0])
-                if not cell_id in self.node_cells:
-                    continue
+            # Read only the cells of this node from the placement set.
+            placement_set = self.scaffold.get_placement_set(cell_model.name)
+            cell_ids, positions = placement_set.select_cells(node_ids)
+            if positions is None:
+                positions = np.zeros((len(cell_ids), 3))
+            report("Placing " + str(len(cell_ids)) + " " + cell_model.name)
+            for cell_id, position in zip(cell_ids.tolist(), positions):
                 kwargs = cell_model.get_parameters()
-                kwargs["position"] = cell[2:5]
+                kwargs["position"] = position
                 if cell_model.entity or cell_model.relay:
                     kwargs["relay"] = cell_model.relay
                     instance = NeuronEntity.instantiate(**kwargs)
@@ -561,26 +896,11 @@ class NeuronAdapter(SimulatorAdapter):
 
     def index_relays(self):
         report("Indexing relays.")
-        terminal_relays = {}
-        intermediate_relays = {}
+        relay_index = RelayIndex()
+        # The to_sections and connection model of each set of terminal connections.
+        self._relay_sets = []
         output_handler = self.scaffold.output_formatter
-        cell_types = self.scaffold.get_cell_types()
-        type_lookup = {
-            ct.name: range(min(ids), max(ids) + 1)
-            for ct, ids in zip(
-                cell_types, (ct.get_placement_set().identifiers for ct in cell_types)
-            )
-        }
-
-        def lookup(i):
-            for n, t in type_lookup.items():
-                if i in t:
-                    return n
-            else:
-                return None
-
         for connection_model in self.connection_models.values():
-            name = connection_model.name
             # Get the connectivity set associated with this connection model
             connectivity_set = ConnectivitySet(output_handler, connection_model.name)
             if connectivity_set.is_orphan():
@@ -591,99 +911,48 @@ class NeuronAdapter(SimulatorAdapter):
             to_cell_model = self.cell_models[to_cell_type.name]
             if not from_cell_model.relay:
                 continue
+            relay_index.add_relays(
+                self.scaffold.get_placement_set(from_cell_type.name).identifiers
+            )
+            columns = connectivity_set.get_columns()
+            kind = "intermediate" if to_cell_model.relay else "terminal"
+            report(
+                "Adding",
+                len(connectivity_set),
+                connection_model.name,
+                "connections as " + kind + ".",
+                level=3,
+            )
             if to_cell_model.relay:
-                report(
-                    "Adding",
-                    len(connectivity_set),
-                    connection_model.name,
-                    "connections as intermediate.",
-                    level=3,
-                )
-                bin = intermediate_relays
-                connections = connectivity_set.connections
-                target = lambda c: c.to_id
+                relay_index.add_intermediate(columns.from_ids, columns.to_ids)
             else:
-                report(
-                    "Adding",
-                    len(connectivity_set),
-                    connection_model.name,
-                    "connections as terminal.",
-                    level=3,
-                )
-                bin = terminal_relays
-                connections = connectivity_set.intersections
-                target = lambda c: (
-                    c.to_id,
-                    c.to_compartment.section_id,
-                    connection_model,
-                )
-            for id in self.scaffold.get_placement_set(from_cell_type.name).identifiers:
-                if id not in bin:
-                    bin[id] = []
-            for connection in connections:
-                fid = connection.from_id
-                bin[fid].append(target(connection))
+                relay_index.add_terminal(columns.from_ids, columns.to_ids)
+                self._relay_sets.append((columns.to_sections, connection_model))
 
         report("Relays indexed, resolving intermediates.")
-
-        interm_transfer = {k: [] for k in intermediate_relays.keys()}
-        while len(intermediate_relays) > 0:
-            intermediates_to_remove = []
-            for intermediate, targets in intermediate_relays.items():
-                for target in targets:
-                    if target in intermediate_relays:
-                        # This target of this intermediary is also an
-                        # intermediary and cannot be resolved to a terminal at
-                        # this point, so we wait until a next iteration where
-                        # the intermediary target might have been resolved.
-                        continue
-                    elif target in terminal_relays:
-                        # The target is a terminal relay and can be removed from
-                        # our intermediary target list and its terminal targets
-                        # added to our terminal target list.
-                        arr = interm_transfer[intermediate]
-                        assert all(
-                            isinstance(t, tuple) for t in terminal_relays[target]
-                        ), f"Terminal relay {lookup(target)} {target} contains non-terminal targets: {terminal_relays[target]}"
-                        arr.extend(terminal_relays[target])
-                        targets.remove(target)
-                    else:
-                        raise RelayError(
-                            f"Non-relay {lookup(target)} {target} found in intermediate relay map."
-                        )
-                # If we have no more intermediary targets, we can be removed from
-                # the intermediary relay list and be moved to the terminals.
-                if not targets:
-                    intermediates_to_remove.append(intermediate)
-                    terminal_relays[intermediate] = interm_transfer.pop(intermediate)
-            for intermediate in intermediates_to_remove:
-                report(
-                    "Intermediate resolved to",
-                    len(terminal_relays[intermediate]),
-                    "targets",
-                    level=4,
-                )
-                intermediate_relays.pop(intermediate, None)
-
+        # Keep only the relays to targets on this node.
+        self.relay_scheme = relay_index.resolve(self._node_ids())
         report("Relays resolved.")
-
-        # Filter out all relays to targets not on this node.
-        self.relay_scheme = {}
-        for relay, targets in terminal_relays.items():
-            assert all(
-                isinstance(t, tuple) for t in terminal_relays[target]
-            ), f"Terminal relay {lookup(target)} {target} contains non-terminal targets: {terminal_relays[target]}"
-            node_targets = [x for x in targets if int(x[0]) in self.node_cells]
-            self.relay_scheme[relay] = node_targets
         report(
             "Node",
             self.get_rank(),
             "needs to relay",
-            len(self.relay_scheme),
+            len(self.relay_scheme.get_relays()),
             "relays.",
             level=4,
         )
 
+    def get_relay_targets(self, relay):
+        """
+        Return the cell id, section id and connection model of each terminal
+        connection on this node that the relay reaches.
+        """
+        scheme = self.relay_scheme
+        for entry in scheme.select([relay]):
+            sections, connection_model = self._relay_sets[scheme.sets[entry]]
+            row = scheme.rows[entry]
+            yield int(scheme.targets[entry]), int(sections[row]), connection_model
+
     def register_recorder(
         self, group, cell, recorder, time_recorder=None, section=None, x=None, meta=None
     ):
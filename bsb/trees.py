@@ -18,10 +18,11 @@ class TreeCollection:
     Keeps track of a collection of KDTrees in cooperation with a TreeHandler.
     """
 
-    def __init__(self, name, handler):
+    def __init__(self, name, handler, read_only=False):
         self.handler = handler
         self.name = name
         self.trees = {}
+        self.read_only = read_only
 
     def list_trees(self):
         return self.handler.list_trees(self.name)
@@ -112,4 +113,6 @@ class TreeCollection:
         return sub_tree
 
     def save(self):
-        self.handler.store_tree_collections([self])
+        # Read only collections keep the trees they make in memory.
+        if not self.read_only:
+            self.handler.store_tree_collections([self])
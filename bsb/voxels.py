@@ -1,5 +1,5 @@
 from .helpers import dimensions, origin
-import numpy as np
+import numpy as np, itertools as it
 from scipy import ndimage
 from time import sleep
 from sklearn.neighbors import KDTree
@@ -70,7 +70,7 @@ class VoxelCloud:
             tree.insert(
                 int(compartment.id), tuple([*compartment.midpoint, *compartment.midpoint])
             )
-        hit_detector = HitDetector.for_rtree(tree)
+        hit_detector = HitDetector.for_points([c.midpoint for c in compartments])
         bounds, voxels, length, error = voxelize(
             N, morphology.get_bounding_box(compartments=compartments), hit_detector
         )
@@ -116,6 +116,127 @@ class VoxelCloud:
         return box
 
 
+class CellVoxels:
+    """
+    The voxels of the voxel clouds of a collection of cells, translated to the
+    positions of the cells.
+
+    :param positions: Positions of the cells.
+    :param morphologies: Index of the morphology of each cell.
+    :param clouds: Voxel cloud of each morphology.
+    """
+
+    def __init__(self, positions, morphologies, clouds):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        morphologies = np.asarray(morphologies, dtype=int)
+        local = [cloud.get_voxels(cache=True).reshape(-1, 3) for cloud in clouds]
+        counts = np.array([len(v) for v in local], dtype=int)
+        # Offset of the first voxel of each cloud in the concatenated clouds.
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        voxels = counts[morphologies]
+        #: Index of the cell of each voxel.
+        self.cells = np.repeat(np.arange(len(morphologies)), voxels)
+        #: Index of each voxel in its concatenated cloud.
+        self.voxels = np.arange(np.sum(voxels)) - np.repeat(
+            np.cumsum(voxels) - voxels, voxels
+        )
+        self.voxels += np.repeat(offsets[morphologies], voxels)
+        local = np.concatenate(local + [np.empty((0, 3))])
+        #: Lower corner of each voxel.
+        self.lower = local[self.voxels] + np.repeat(positions, voxels, axis=0)
+        grid_sizes = np.array([cloud.grid_size for cloud in clouds], dtype=float)
+        #: Edge length of each voxel.
+        self.sizes = np.repeat(grid_sizes[morphologies], voxels)
+        # Concatenate the compartment maps of the clouds.
+        lengths = [len(m) for cloud in clouds for m in cloud.map]
+        self._map_pointers = np.cumsum([0] + lengths)
+        self._map = np.fromiter(
+            it.chain.from_iterable(it.chain.from_iterable(c.map for c in clouds)),
+            dtype=int,
+        )
+
+    def __len__(self):
+        return len(self.cells)
+
+    def get_occupancy(self, rows):
+        """
+        Return the number of compartments in the given voxels.
+        """
+        voxels = self.voxels[rows]
+        return self._map_pointers[voxels + 1] - self._map_pointers[voxels]
+
+    def sample_compartments(self, rows):
+        """
+        Return a random compartment from each of the given voxels.
+        """
+        voxels = self.voxels[rows]
+        picks = np.floor(np.random.random(len(rows)) * self.get_occupancy(rows))
+        return self._map[self._map_pointers[voxels] + picks.astype(int)]
+
+    def intersect(self, other):
+        """
+        Find the voxels that overlap with the voxels of another collection.
+
+        :returns: Pairs of overlapping voxels of this and the other collection.
+        :rtype: tuple of arrays
+        """
+        return intersect_boxes(self.lower, self.sizes, other.lower, other.sizes)
+
+
+def intersect_boxes(lower_a, sizes_a, lower_b, sizes_b):
+    """
+    Find the overlapping pairs of 2 collections of cubes, given by their lower
+    corners and edge lengths. The cubes are hashed into a sparse grid of cells as
+    large as the largest cube, and only the cubes that share a cell are compared.
+
+    :returns: Indices of the overlapping cubes of the first and second collection.
+    :rtype: tuple of arrays
+    """
+    if not len(lower_a) or not len(lower_b):
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    # Grow the grid cells a little, so that each cube spans at most 2 cells per axis.
+    cell_size = max(np.max(sizes_a), np.max(sizes_b)) * 1.001
+    origin = np.minimum(np.min(lower_a, axis=0), np.min(lower_b, axis=0))
+
+    def grid_cells(lower, sizes):
+        lo = np.floor((lower - origin) / cell_size).astype(int)
+        hi = np.floor((lower + sizes[:, None] - origin) / cell_size).astype(int)
+        return lo, hi
+
+    cells_a, cells_b = grid_cells(lower_a, sizes_a), grid_cells(lower_b, sizes_b)
+    shape = np.maximum(np.max(cells_a[1], axis=0), np.max(cells_b[1], axis=0)) + 1
+
+    def hash_cells(lo, hi):
+        # Hash each cube into every grid cell it spans.
+        keys, cubes = [], []
+        for offset in it.product((0, 1), repeat=3):
+            cell = lo + offset
+            spans = np.all(cell <= hi, axis=1)
+            keys.append(np.ravel_multi_index(cell[spans].T, shape))
+            cubes.append(np.nonzero(spans)[0])
+        return np.concatenate(keys), np.concatenate(cubes)
+
+    keys_a, cubes_a = hash_cells(*cells_a)
+    keys_b, cubes_b = hash_cells(*cells_b)
+    order = np.argsort(keys_b, kind="stable")
+    keys_b, cubes_b = keys_b[order], cubes_b[order]
+    # Join the cubes on their grid cells.
+    start = np.searchsorted(keys_b, keys_a, side="left")
+    count = np.searchsorted(keys_b, keys_a, side="right") - start
+    a = np.repeat(cubes_a, count)
+    within = np.arange(len(a)) - np.repeat(np.cumsum(count) - count, count)
+    b = cubes_b[np.repeat(start, count) + within]
+    # Cubes that span the same cells are found once for each cell.
+    pairs = np.unique(a * len(lower_b) + b)
+    a, b = pairs // len(lower_b), pairs % len(lower_b)
+    overlap = np.all(
+        (lower_a[a] <= lower_b[b] + sizes_b[b, None])
+        & (lower_b[b] <= lower_a[a] + sizes_a[a, None]),
+        axis=1,
+    )
+    return a[overlap], b[overlap]
+
+
 _class_dimensions = dimensions
 _class_origin = origin
 
@@ -172,25 +293,12 @@ def voxelize(N, box_data, hit_detector, max_iterations=80, precision_iterations=
             crossed_treshold
         ):  # Are we doing these iterations just to increase precision, or still trying to find a solution?
             precision_i += 1
-        box_count = 0  # Reset box count
-        boxes_x, boxes_y, boxes_z = m_grid(bounds, box_length)  # Create box counting grid
         # Create a voxel grid where voxels are switched on if they trigger the hit_detector
-        voxels = np.zeros(
-            (boxes_x.shape[0], boxes_x.shape[1], boxes_x.shape[2]), dtype=bool
-        )
-        # Iterate over all the boxes in the total grid.
-        for x_i in range(boxes_x.shape[0]):
-            for y_i in range(boxes_x.shape[1]):
-                for z_i in range(boxes_x.shape[2]):
-                    # Get the lower corner of the query box
-                    x = boxes_x[x_i, y_i, z_i]
-                    y = boxes_y[x_i, y_i, z_i]
-                    z = boxes_z[x_i, y_i, z_i]
-                    hit = hit_detector(
-                        np.array([x, y, z]), box_length
-                    )  # Is this box a hit? (Does it cover some part of the object?)
-                    voxels[x_i, y_i, z_i] = hit  # If its a hit, turn on the voxel
-                    box_count += int(hit)  # If its a hit, increase the box count
+        if isinstance(hit_detector, HitDetector):
+            voxels = hit_detector.detect_grid(bounds, box_length)
+        else:
+            voxels = _detect_grid(hit_detector, bounds, box_length)
+        box_count = np.count_nonzero(voxels)
         if last_box_count < N and box_count >= N:
             # We've crossed the treshold from overestimating to underestimating
             # the box_length. A solution is found, but more precise values lie somewhere in between,
@@ -215,6 +323,45 @@ def voxelize(N, box_data, hit_detector, max_iterations=80, precision_iterations=
     return best_bounds, best_voxels, best_length, best_error
 
 
+def _detect_grid(hit_detector, bounds, box_length):
+    # Query the hit detector for each box of the grid.
+    boxes_x, boxes_y, boxes_z = m_grid(bounds, box_length)  # Create box counting grid
+    voxels = np.zeros(boxes_x.shape, dtype=bool)
+    # Iterate over all the boxes in the total grid.
+    for index in np.ndindex(boxes_x.shape):
+        # Get the lower corner of the query box
+        box_origin = np.array([boxes_x[index], boxes_y[index], boxes_z[index]])
+        # Is this box a hit? (Does it cover some part of the object?)
+        voxels[index] = hit_detector(box_origin, box_length)
+    return voxels
+
+
+def _bin_points(points, bounds, box_length):
+    # Bin the points into the boxes of the grid. Boxes are closed intervals so that
+    # points on the border between 2 boxes are in both, like the rtree queries.
+    grid = [np.mgrid[bounds[axis, 0] : bounds[axis, 1] : box_length] for axis in range(3)]
+    voxels = np.zeros(tuple(map(len, grid)), dtype=bool)
+    if not voxels.size:
+        return voxels
+    candidates = []
+    for origins, coords in zip(grid, points.T):
+        upper = np.searchsorted(origins, coords, side="right") - 1
+        # Each point can lie in the last box starting before it, and on the upper
+        # border of the box before that one.
+        axis_candidates = []
+        for index in (upper, upper - 1):
+            inside = (index >= 0) & (index < len(origins))
+            safe = np.where(inside, index, 0)
+            inside &= origins[safe] <= coords
+            inside &= coords <= origins[safe] + box_length
+            axis_candidates.append((safe, inside))
+        candidates.append(axis_candidates)
+    for (x, in_x), (y, in_y), (z, in_z) in it.product(*candidates):
+        hit = in_x & in_y & in_z
+        voxels[x[hit], y[hit], z[hit]] = True
+    return voxels
+
+
 def detect_box_compartments(tree, box_origin, box_size):
     """
     Given a tree of compartment locations and a box, it will return the ids of all compartments in the outer sphere of the box
@@ -321,12 +468,24 @@ class HitDetector:
     Wrapper class for commonly used hit detectors in the voxelization process.
     """
 
-    def __init__(self, detector):
+    def __init__(self, detector, grid_detector=None):
         self.detector = detector
+        self.grid_detector = grid_detector
 
     def __call__(self, position, size):
         return self.detector(position, size)
 
+    def detect_grid(self, bounds, box_length):
+        """
+        Return a boolean grid of the boxes of the box counting grid that are a hit.
+
+        :param bounds: Lower and upper bounds of the grid along each axis.
+        :param box_length: Size of the edge of the boxes.
+        """
+        if self.grid_detector is not None:
+            return self.grid_detector(bounds, box_length)
+        return _detect_grid(self.detector, bounds, box_length)
+
     @classmethod
     def for_rtree(cls, tree):
         """
@@ -337,6 +496,7 @@ class HitDetector:
         :returns: A hit detector
         :rtype: :class:`HitDetector`
         """
+
         # Create the detector function
         def tree_detector(box_origin, box_size):
             # Report a hit if more than 0 compartments are within the box.
@@ -344,3 +504,25 @@ class HitDetector:
 
         # Return the tree detector function as the factory product
         return cls(tree_detector)
+
+    @classmethod
+    def for_points(cls, points):
+        """
+        Factory function that creates a hit detector for a collection of points, that
+        bins all points into the box counting grid at once.
+
+        :param points: Point positions.
+        :type points: Any `np.array` type of shape (N, 3).
+        :returns: A hit detector
+        :rtype: :class:`HitDetector`
+        """
+        points = np.array(points, dtype=float).reshape(-1, 3)
+
+        def point_detector(box_origin, box_size):
+            inside = (points >= box_origin) & (points <= box_origin + box_size)
+            return bool(np.any(np.all(inside, axis=1)))
+
+        def grid_detector(bounds, box_length):
+            return _bin_points(points, bounds, box_length)
+
+        return cls(point_detector, grid_detector)
@@ -0,0 +1,97 @@
+"""
+Benchmark the batched heterosynaptic plasticity connections of the ``NestAdapter``
+against the previous per postsynaptic cell ``nest.Connect`` loop, on the heterosyn
+test configuration with scaled up cell counts.
+
+Requires NEST and the ``cerebmodule`` extension module.
+
+Usage: ``python tests/profiling/nest_heterosyn.py [cells ...]``
+"""
+
+import numpy as np
+import os, sys, json, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from bsb.core import Scaffold
+from bsb.config import JSONConfig
+from bsb.reporting import set_verbosity
+
+config_file = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "configs",
+    "test_double_neuron_network_heterosyn.json",
+)
+simulation = "test_double_neuron_network_heterosyn"
+convergence = 50
+
+
+def legacy_connect_hetero(
+    adapter, connection_model, sources, targets, postsynaptic_cells, specifications
+):
+    # The previous implementation, with a Connect call per postsynaptic cell.
+    for vt_num, post_cell in enumerate(postsynaptic_cells):
+        connection_parameters = connection_model.get_connection_parameters()
+        connection_parameters["vt_num"] = float(vt_num)
+        indexes = np.where(targets == post_cell)[0]
+        adapter.nest.Connect(
+            sources[indexes], targets[indexes], specifications, connection_parameters
+        )
+
+
+def batched_connect_hetero(adapter, *args):
+    type(adapter)._connect_hetero(adapter, *args)
+
+
+def setup(cells):
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    config["output"]["file"] = "nest_heterosyn_benchmark.hdf5"
+    side = 150.0 * max(1, np.sqrt(cells / 100))
+    config["network_architecture"]["simulation_volume_x"] = side
+    config["network_architecture"]["simulation_volume_z"] = side
+    for cell_type in config["cell_types"].values():
+        cell_type["placement"]["count"] = cells
+    connection_type = config["connection_types"]["from_cell_to_cell"]
+    connection_type["convergence"] = min(convergence, cells)
+    np.random.seed(0)
+    scaffold = Scaffold(JSONConfig(stream=json.dumps(config)))
+    scaffold.compile_network()
+    return scaffold
+
+
+def run(scaffold, connect):
+    adapter = scaffold.create_adapter(simulation)
+    timing = []
+
+    def timed_connect(*args):
+        t = time.time()
+        connect(adapter, *args)
+        timing.append(time.time() - t)
+
+    adapter._connect_hetero = timed_connect
+    adapter.prepare()
+    model = adapter.suffixed("from_cell_to_cell")
+    synapses = len(adapter.nest.GetConnections(synapse_model=model))
+    adapter.delete_lock()
+    return synapses, sum(timing)
+
+
+if __name__ == "__main__":
+    set_verbosity(0)
+    counts = [int(c) for c in sys.argv[1:]] or [100, 1000, 5000]
+    row = "{:<10}{:>10}{:>10}{:>12}"
+    print(row.format("engine", "cells", "synapses", "time"))
+    try:
+        for count in counts:
+            scaffold = setup(count)
+            for name, connect in (
+                ("legacy", legacy_connect_hetero),
+                ("batched", batched_connect_hetero),
+            ):
+                synapses, runtime = run(scaffold, connect)
+                print(row.format(name, count, synapses, "%.3fs" % runtime))
+    finally:
+        if os.path.exists("nest_heterosyn_benchmark.hdf5"):
+            os.remove("nest_heterosyn_benchmark.hdf5")
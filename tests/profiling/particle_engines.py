@@ -0,0 +1,63 @@
+"""
+Benchmark the array-backed particle engine against the object-backed particle engine
+on granular-layer-like volumes, and compare their packing statistics.
+
+Usage: ``python tests/profiling/particle_engines.py [side ...]``
+"""
+import numpy as np
+import os, sys, time
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from bsb.particles import ParticleSystem, ArrayParticleSystem
+from bsb.reporting import set_verbosity
+
+# Granule cell density (µm^-3) and soma radius (µm).
+density = 3.9e-3
+radius = 2.5
+
+
+def run(engine, side, seed=0):
+    np.random.seed(seed)
+    count = int(side ** 3 * density)
+    system = engine(track_displaced=True)
+    system.fill(
+        [[[0.0, 0.0, 0.0], [side] * 3]],
+        [{"name": "granule_cell", "voxels": [0], "radius": radius, "count": count}],
+    )
+    t = time.time()
+    system.find_colliding_particles()
+    system.solve_collisions()
+    pruned, _ = system.prune(at_risk_particles=system.displaced_particles)
+    runtime = time.time() - t
+    positions = system.positions
+    distances, _ = cKDTree(positions).query(positions, k=2)
+    return {
+        "cells": count,
+        "time": runtime,
+        "pruned": pruned,
+        "min_nn": np.min(distances[:, 1]),
+        "mean_nn": np.mean(distances[:, 1]),
+    }
+
+
+if __name__ == "__main__":
+    set_verbosity(0)
+    sides = [float(s) for s in sys.argv[1:]] or [50.0, 75.0, 100.0]
+    row = "{:<22}{:>8}{:>10}{:>8}{:>9}{:>9}{:>9}"
+    print(row.format("engine", "side", "cells", "pruned", "min nn", "mean nn", "time"))
+    for side in sides:
+        for engine in (ArrayParticleSystem, ParticleSystem):
+            r = run(engine, side)
+            print(
+                row.format(
+                    engine.__name__,
+                    side,
+                    r["cells"],
+                    r["pruned"],
+                    "%.3f" % r["min_nn"],
+                    "%.3f" % r["mean_nn"],
+                    "%.2fs" % r["time"],
+                )
+            )
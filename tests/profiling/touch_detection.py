@@ -0,0 +1,113 @@
+"""
+Benchmark the batched touch detection of the ``TouchDetector`` against the previous
+per cell pair implementation, on the ``ascending_axon_to_purkinje`` connection of the
+``3_9_mouse.json`` test configuration, with its ``GranuleCell`` and ``PurkinjeCell``
+morphologies from the test morphology repository.
+
+The cells are placed at random in a 300 µm square, with a fixed number of candidate
+Purkinje cells per granule cell, so that the benchmark scales with the granule count.
+
+Usage: ``python tests/profiling/touch_detection.py [granule cells ...]``
+"""
+
+import numpy as np
+import os, sys, time
+from sklearn.neighbors import KDTree
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "tests"))
+
+from bsb.core import Scaffold
+from bsb.config import JSONConfig
+from bsb.connectivity.detailed.touch_detection import TouchInformation
+from bsb.reporting import set_verbosity
+import test_setup
+
+config = os.path.join(root, "tests", "configs", "3_9_mouse.json")
+# Purkinje cells per granule cell, in the ascending axon search radius.
+purkinje_per_granule = 4
+
+
+def legacy_intersections(detector, info, from_pos, to_pos):
+    # The previous implementation, that rebuilt the arrays and tree for every pair.
+    from_morpho, to_morpho = info.from_morphology, info.to_morphology
+    to_comps = to_morpho.get_compartments(info.to_cell_compartments)
+    to_points = np.array([c.end for c in to_comps]).reshape(-1, 3)
+    from_comps = from_morpho.get_compartments(info.from_cell_compartments)
+    from_tree = KDTree(np.array([c.end for c in from_comps]))
+    hits = from_tree.query_radius(
+        to_points + to_pos - from_pos, detector.compartment_intersection_radius
+    )
+    from_map = [c.id for c in from_comps]
+    to_map = [c.id for c in to_comps]
+    intersections = []
+    for i in range(len(hits)):
+        for j in range(len(hits[i])):
+            intersections.append([from_map[hits[i][j]], to_map[i]])
+    return intersections
+
+
+def get_detector():
+    # The scaffold opens the morphology repository of the configuration, which is
+    # prepared in the repository root.
+    os.chdir(root)
+    test_setup.prep_morphologies()
+    scaffold = Scaffold(JSONConfig(file=config))
+    return scaffold.configuration.connection_types["ascending_axon_to_purkinje"]
+
+
+def setup(detector, granules):
+    np.random.seed(0)
+    detector.morphology_cache = {}
+    detector._touch_points = {}
+    purkinjes = max(granules // 100, purkinje_per_granule)
+    info = TouchInformation(
+        detector.from_cell_types[0],
+        detector.from_cell_compartments[0],
+        detector.to_cell_types[0],
+        detector.to_cell_compartments[0],
+    )
+    info.from_positions = np.random.uniform(0, 300, (granules, 3))
+    info.from_positions[:, 1] = 0
+    info.to_positions = np.random.uniform(0, 300, (purkinjes, 3))
+    info.to_positions[:, 1] = 0
+    info.from_identifiers = np.arange(granules)
+    info.to_identifiers = np.arange(purkinjes) + granules
+    info.from_morphology = detector.get_random_morphology(info.from_cell_type)
+    info.to_morphology = detector.get_random_morphology(info.to_cell_type)
+    candidates = [
+        np.random.choice(purkinjes, purkinje_per_granule, replace=False)
+        for _ in range(granules)
+    ]
+    return info, candidates
+
+
+def run_legacy(detector, info, candidates):
+    synapses = 0
+    for i, partners in enumerate(candidates):
+        for j in partners:
+            hits = legacy_intersections(
+                detector, info, info.from_positions[i], info.to_positions[j]
+            )
+            if hits:
+                synapses += min(int(detector.synapses.sample()), len(hits))
+    return synapses
+
+
+def run_batched(detector, info, candidates):
+    return len(detector.intersect_compartments(info, candidates)[0])
+
+
+if __name__ == "__main__":
+    set_verbosity(0)
+    counts = [int(c) for c in sys.argv[1:]] or [100, 1000]
+    detector = get_detector()
+    row = "{:<10}{:>10}{:>10}{:>12}"
+    print(row.format("engine", "granules", "synapses", "time"))
+    for count in counts:
+        for name, run in (("legacy", run_legacy), ("batched", run_batched)):
+            info, candidates = setup(detector, count)
+            t = time.time()
+            synapses = run(detector, info, candidates)
+            print(row.format(name, count, synapses, "%.3fs" % (time.time() - t)))
@@ -0,0 +1,40 @@
+import unittest, os, sys, numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.models import ConnectionColumns
+from bsb.simulators.arbor.adapter import GidConnections
+
+
+class TestGidConnections(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.connections = np.random.randint(0, 30, (300, 2))
+        self.columns = ConnectionColumns(self.connections[:, 0], self.connections[:, 1])
+
+    def test_incoming(self):
+        index = GidConnections(range(10, 20))
+        index.add(self.columns, "a")
+        # Relayed connections, with the relays as presynaptic gids.
+        relayed = {5: 100, 7: 101}
+        index.add(self.columns, "b", rows=list(relayed), from_ids=[100, 101])
+        for gid in (0, 12, 19, int(self.connections[5, 1])):
+            found = sorted((f, m, r) for f, _, r, m in index.incoming(gid))
+            expected = []
+            if 10 <= gid < 20:
+                for r, (f, t) in enumerate(self.connections):
+                    if t == gid:
+                        expected.append((f, "a", r))
+                        if r in relayed:
+                            expected.append((relayed[r], "b", r))
+            self.assertEqual(found, sorted(expected))
+        self.assertTrue(all(c is self.columns for _, c, _, _ in index.incoming(12)))
+
+    def test_outgoing(self):
+        index = GidConnections()
+        index.add(self.columns, "a")
+        for gid in (3, 29, 31):
+            found = sorted((t, r) for t, _, r, _ in index.outgoing(gid))
+            expected = [(t, r) for r, (f, t) in enumerate(self.connections) if f == gid]
+            self.assertEqual(found, sorted(expected))
+        self.assertEqual(list(GidConnections().incoming(1)), [])
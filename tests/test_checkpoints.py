@@ -0,0 +1,139 @@
+import unittest, unittest.mock, os, sys, json, shutil, numpy as np
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.simulators.neuron.adapter import NeuronAdapter
+from bsb.simulation import SimulationResult
+from bsb.exceptions import NeuronError
+
+
+class FakeVector(list):
+    def from_python(self, data):
+        self[:] = list(data)
+
+
+class FakeNeuron:
+    """
+    Stand-in for the parts of NEURON that checkpoints use, with the membrane
+    potentials of the whole model as its state.
+    """
+
+    def __init__(self, rank=0, size=1):
+        self.state = {"t": 0.0, "v": [-65.0]}
+        self.time = FakeVector()
+        self.parallel = SimpleNamespace(
+            id=lambda: rank, nhost=lambda: size, barrier=lambda: None
+        )
+        neuron = self
+
+        class SaveState:
+            def save(self):
+                self.saved = json.dumps(neuron.state)
+
+            def fwrite(self, file):
+                with open(file.path, "w") as f:
+                    f.write(self.saved)
+
+            def fread(self, file):
+                with open(file.path, "r") as f:
+                    self.saved = f.read()
+
+            def restore(self):
+                neuron.state = json.loads(self.saved)
+
+        class File:
+            def wopen(self, path):
+                self.path = path
+
+            ropen = wopen
+
+        self.SaveState = SaveState
+        self.File = File
+
+
+def fake_adapter(path, rank=0, size=1):
+    adapter = NeuronAdapter()
+    adapter.checkpoint_path = path
+    adapter.h = FakeNeuron(rank, size)
+    adapter.pc = adapter.h.parallel
+    adapter.result = SimulationResult()
+    adapter.result.add(SimpleNamespace(recorder=FakeVector(), time_recorder=None))
+    adapter.result.add(SimpleNamespace(vectors=[FakeVector(), FakeVector()]))
+    adapter.result.add(SimpleNamespace())
+    return adapter
+
+
+class TestNeuronCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.path = "checkpoint_test"
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def record(self, adapter, t):
+        adapter.h.state = {"t": t, "v": [-65.0 + t]}
+        for vector in adapter._get_recorder_vectors():
+            vector.append(t)
+
+    def test_restore(self):
+        adapter = fake_adapter(self.path)
+        with self.assertRaises(NeuronError, msg="Missing checkpoint not detected"):
+            adapter.restore_checkpoint(adapter.h)
+        for t in (1.0, 2.0):
+            self.record(adapter, t)
+        adapter.write_checkpoint(adapter.h, 2.0)
+        self.record(adapter, 3.0)
+        resumed = fake_adapter(self.path)
+        self.assertEqual(resumed.restore_checkpoint(resumed.h), 2.0)
+        self.assertEqual(resumed.h.state, {"t": 2.0, "v": [-63.0]})
+        vectors = list(resumed._get_recorder_vectors())
+        self.assertEqual(len(vectors), 4, "Time, recorder and 2 vectors expected")
+        self.assertTrue(all(v == [1.0, 2.0] for v in vectors), "Buffers not restored")
+        self.assertEqual(
+            sorted(os.listdir(self.path)), ["checkpoint.json", "checkpoint_2.0"]
+        )
+
+    def test_interrupted(self):
+        adapter = fake_adapter(self.path)
+        self.record(adapter, 1.0)
+        adapter.write_checkpoint(adapter.h, 1.0)
+        self.record(adapter, 2.0)
+        adapter.write_checkpoint(adapter.h, 2.0)
+        self.assertFalse(os.path.exists(os.path.join(self.path, "checkpoint_1.0")))
+        # A node that is interrupted before the checkpoint is complete.
+        self.record(adapter, 3.0)
+        adapter.pc.barrier = unittest.mock.Mock(side_effect=KeyboardInterrupt)
+        with self.assertRaises(KeyboardInterrupt):
+            adapter.write_checkpoint(adapter.h, 3.0)
+        # Node 0 is interrupted while it switches the pointer over.
+        adapter.pc.barrier = lambda: None
+        with unittest.mock.patch("os.replace", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                adapter.write_checkpoint(adapter.h, 3.0)
+        resumed = fake_adapter(self.path)
+        self.assertEqual(resumed.restore_checkpoint(resumed.h), 2.0)
+        self.assertEqual(resumed.h.state, {"t": 2.0, "v": [-63.0]})
+        self.assertTrue(all(v == [1.0, 2.0] for v in resumed._get_recorder_vectors()))
+
+    def test_corrupt_pointer(self):
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "checkpoint.json"), "w") as f:
+            f.write('{"t": 2.')
+        adapter = fake_adapter(self.path)
+        with self.assertRaises(NeuronError):
+            adapter.restore_checkpoint(adapter.h)
+
+    def test_node_mismatch(self):
+        adapter = fake_adapter(self.path)
+        adapter.write_checkpoint(adapter.h, 5.0)
+        resumed = fake_adapter(self.path, size=2)
+        with self.assertRaises(NeuronError):
+            resumed.restore_checkpoint(resumed.h)
+
+    def test_step_progress(self):
+        adapter = NeuronAdapter()
+        steps = list(adapter.step_progress(10, 4))
+        self.assertEqual(steps, [(0, 4), (4, 8), (8, 10)])
+        steps = list(adapter.step_progress(10, 4, start=6))
+        self.assertEqual(steps, [(6, 10)])
@@ -0,0 +1,301 @@
+import unittest, os, sys, numpy as np
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.connectivity import (
+    ConnectomeGlomerulusGranule,
+    ConnectomeGapJunctions,
+    ConnectomeGapJunctionsGolgi,
+    ConnectomePFPurkinje,
+    ConnectomeBCSCPurkinje,
+    ConnectomeGolgiGlomerulus,
+    ConnectomeGolgiGranule,
+    ConnectomeAscAxonPurkinje,
+    ConnectomeIOMolecular,
+)
+from bsb.connectivity.composition import ConnectivityMatrix
+from bsb.functions import group_ranks, window_join
+from sklearn.neighbors import KDTree
+
+
+def random_cells(count, first_id=0, size=100.0):
+    cells = np.zeros((count, 5))
+    cells[:, 0] = np.arange(count) + first_id
+    cells[:, 2:5] = np.random.random((count, 3)) * size
+    return cells
+
+
+def legacy_glom_grc(glomeruli, granules, dend_len, n_conn_glom):
+    # The closest glomeruli within reach of each granule cell, one per mossy fibre.
+    pairs = set()
+    for gran in granules:
+        distance = np.sum((glomeruli[:, 2:5] - gran[2:5]) ** 2, axis=1) - dend_len ** 2
+        good = np.nonzero(distance < 0)[0]
+        for g in good[np.argsort(distance[good])][:n_conn_glom]:
+            pairs.add((glomeruli[g, 0], gran[0]))
+    return pairs
+
+
+def legacy_aa_pc(granules, purkinjes, x_pc, z_pc):
+    # Each Purkinje cell in turn takes the ascending axons in its area.
+    available = np.ones(len(granules), dtype=bool)
+    connections = []
+    for p in purkinjes:
+        inside = (np.absolute(granules[:, 4] - p[4]) <= z_pc / 2.0) & (
+            np.absolute(granules[:, 2] - p[2]) <= x_pc / 2.0
+        )
+        for g in np.nonzero(inside & available)[0]:
+            connections.append((granules[g, 0], p[0]))
+        available &= ~inside
+    return connections
+
+
+def connect_fake_scaffold(strategy, cells_by_type, from_type, to_type):
+    results = []
+    strategy.scaffold = SimpleNamespace(
+        cells_by_type=cells_by_type,
+        connect_cells=lambda strategy, result, *args, **kwargs: results.append(result),
+    )
+    strategy.from_cell_types = [from_type]
+    strategy.to_cell_types = [to_type]
+    strategy.connect()
+    return results
+
+
+class TestConnectomes(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_group_ranks(self):
+        self.assertEqual(group_ranks([3, 3, 5, 5, 5, 7]).tolist(), [0, 1, 0, 1, 2, 0])
+        self.assertEqual(group_ranks([]).tolist(), [])
+
+    def test_glomerulus_granule(self):
+        glomeruli = random_cells(300, first_id=1000)
+        granules = random_cells(200)
+        strategy = ConnectomeGlomerulusGranule()
+        tree = KDTree(glomeruli[:, 2:5])
+        # A mossy fibre per glomerulus, so that only the distance rule applies.
+        mf_to_glom = np.column_stack((np.arange(300), glomeruli[:, 0]))
+        result = strategy.connect_glomeruli(
+            tree, glomeruli, granules, 15.0, 4, mf_to_glom
+        )
+        self.assertEqual(
+            set(map(tuple, result)), legacy_glom_grc(glomeruli, granules, 15.0, 4)
+        )
+        self.assertEqual(len(result), len(set(map(tuple, result))), "Duplicates")
+        # 10 mossy fibres per glomerulus: one glomerulus per mossy fibre per granule.
+        mf_to_glom[:, 0] //= 10
+        result = strategy.connect_glomeruli(
+            tree, glomeruli, granules, 15.0, 4, mf_to_glom
+        )
+        mf = (result[:, 0].astype(int) - 1000) // 10
+        pairs = np.column_stack((result[:, 1], mf))
+        self.assertEqual(len(np.unique(pairs, axis=0)), len(pairs), "Mossy fibre reused")
+        _, counts = np.unique(result[:, 1], return_counts=True)
+        self.assertTrue(np.all(counts <= 4), "Convergence exceeded")
+
+    def test_gap_junctions(self):
+        cells = random_cells(500)
+        strategy = ConnectomeGapJunctions()
+        tree = KDTree(cells[:, 2:5])
+        result = strategy.connect_gap_junctions(tree, cells, 20.0, 10.0, 4)
+        pre, post = result[:, 0].astype(int), result[:, 1].astype(int)
+        dz = np.absolute(cells[pre, 4] - cells[post, 4])
+        dxy = np.linalg.norm(cells[pre, 2:4] - cells[post, 2:4], axis=1)
+        self.assertTrue(np.all((dz < 10.0) & (dz > 0) & (dxy < 20.0)), "Out of reach")
+        _, counts = np.unique(pre, return_counts=True)
+        self.assertTrue(np.all(counts <= 4), "Divergence exceeded")
+        self.assertEqual(len(np.unique(result, axis=0)), len(result), "Duplicates")
+        # Without divergence limit, about 1/4 of the candidates that are uniformly
+        # spread in the cylinder are accepted.
+        result = strategy.connect_gap_junctions(tree, cells, 20.0, 10.0, 10 ** 6)
+        candidates = 0
+        for cell in cells:
+            dz = np.absolute(cells[:, 4] - cell[4])
+            dxy = np.linalg.norm(cells[:, 2:4] - cell[2:4], axis=1)
+            candidates += np.count_nonzero((dz < 10.0) & (dz > 0) & (dxy < 20.0))
+        # P(ra > max(dz/d_z, r/d_xy)) = 1/4, for uniform dz and r with density 2r.
+        expected = candidates / 4
+        self.assertAlmostEqual(len(result) / expected, 1, delta=0.1)
+
+    def test_gap_junctions_golgi(self):
+        golgis = random_cells(400, first_id=50)
+        strategy = ConnectomeGapJunctionsGolgi()
+        box = np.array([10.0, 20.0, 5.0])
+        result = strategy.connect_golgi(KDTree(golgis[:, 2:5]), golgis, box)
+        expected = []
+        for i, golgi in enumerate(golgis):
+            inside = np.all(np.absolute(golgis[:, 2:5] - golgi[2:5]) <= box, axis=1)
+            inside[i] = False
+            for j in np.nonzero(inside)[0]:
+                expected.append([golgi[0], golgis[j, 0]])
+        self.assertEqual(result.tolist(), expected)
+
+    def test_window_join(self):
+        coordinates = np.round(np.random.random(200) * 50)
+        lower = np.round(np.random.random(30) * 50)
+        upper = lower + np.round(np.random.random(30) * 10)
+        for closed in (True, False):
+            pairs = window_join(coordinates, lower, upper, closed=closed)
+            if closed:
+                inside = (coordinates >= lower[:, None]) & (coordinates <= upper[:, None])
+            else:
+                inside = (coordinates > lower[:, None]) & (coordinates < upper[:, None])
+            window, point = np.nonzero(inside)
+            self.assertEqual(
+                sorted(map(tuple, pairs)), sorted(zip(point, window)), "Wrong pairs"
+            )
+            self.assertTrue(np.all(np.diff(pairs[:, 1]) >= 0), "Not grouped by window")
+
+    def test_pf_purkinje(self):
+        granules = random_cells(1000)
+        purkinjes = random_cells(20, first_id=1000)
+        purkinje_type = SimpleNamespace(
+            name="purkinje", placement=SimpleNamespace(extension_x=10.0)
+        )
+        (result,) = connect_fake_scaffold(
+            ConnectomePFPurkinje(),
+            {"granule": granules, "purkinje": purkinjes},
+            SimpleNamespace(name="granule"),
+            purkinje_type,
+        )
+        expected = set()
+        for p in purkinjes:
+            for g in granules[np.absolute(granules[:, 2] - p[2]) <= 5.0]:
+                expected.add((g[0], p[0]))
+        self.assertEqual(set(map(tuple, result)), expected)
+        self.assertEqual(len(result), len(expected))
+
+    def test_bcsc_purkinje(self):
+        strategy = ConnectomeBCSCPurkinje()
+        baskets = random_cells(500)
+        purkinjes = random_cells(30, first_id=500)
+        result = strategy.connect_interneurons(baskets, purkinjes, 20.0, 10.0, 5)
+        pre, post = result[:, 0].astype(int), result[:, 1].astype(int) - 500
+        self.assertTrue(np.all(np.absolute(baskets[pre, 4] - purkinjes[post, 4]) < 20))
+        self.assertTrue(np.all(np.absolute(baskets[pre, 2] - purkinjes[post, 2]) < 10))
+        _, counts = np.unique(post, return_counts=True)
+        self.assertTrue(np.all(counts <= 5), "Convergence exceeded")
+        self.assertTrue(np.any(counts == 5), "Convergence never reached")
+
+    def test_golgi_glomerulus(self):
+        strategy = ConnectomeGolgiGlomerulus()
+        golgis = random_cells(40)
+        glomeruli = random_cells(2000, first_id=40)
+        axon = np.array([30.0, 20.0, 40.0])
+        result = strategy.connect_glomeruli(golgis, glomeruli, axon, 1.0, 10, 150.0)
+        golgi, glom = result[:, 0].astype(int), result[:, 1].astype(int) - 40
+        self.assertEqual(len(np.unique(glom)), len(glom), "Glomerulus reused")
+        offset = np.absolute(glomeruli[glom, 2:5] - golgis[golgi, 2:5])
+        self.assertTrue(np.all(offset <= axon / 2 + 1.0), "Out of reach")
+        _, counts = np.unique(golgi, return_counts=True)
+        self.assertTrue(np.all(counts <= 10), "Divergence exceeded")
+        self.assertTrue(np.any(counts == 10), "Divergence never reached")
+
+    def test_aa_purkinje(self):
+        granules = random_cells(1000)
+        purkinjes = random_cells(30, first_id=1000)
+        result = ConnectomeAscAxonPurkinje().connect_ascending_axons(
+            granules, purkinjes, 30.0, 20.0
+        )
+        expected = legacy_aa_pc(granules, purkinjes, 30.0, 20.0)
+        self.assertEqual(list(map(tuple, result)), expected)
+        self.assertEqual(len(np.unique(result[:, 0])), len(result), "Axon reused")
+
+
+class TestConnectivityMatrix(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        # Golgi cells 0-9 to glomeruli 100-149, glomeruli to granule cells 200-299
+        self.goc_glom = np.column_stack(
+            (np.random.randint(0, 10, 80), np.random.randint(100, 150, 80))
+        )
+        self.glom_grc = np.column_stack(
+            (np.random.randint(100, 160, 300), np.random.randint(200, 300, 300))
+        )
+        self.glom_grc_comps = np.column_stack(
+            (np.full(300, -1), np.random.randint(0, 4, 300))
+        )
+
+    def legacy_join(self):
+        # The dict walk that the Golgi to granule connectome used to do.
+        targets = {}
+        for (glom, grc), comps in zip(self.glom_grc, self.glom_grc_comps):
+            targets.setdefault(glom, []).append((grc, comps[1]))
+        return [
+            (goc, grc, comp)
+            for goc, glom in self.goc_glom
+            for grc, comp in targets.get(glom, [])
+        ]
+
+    def test_join(self):
+        goc_glom = ConnectivityMatrix(self.goc_glom)
+        glom_grc = ConnectivityMatrix(self.glom_grc, self.glom_grc_comps)
+        goc_grc = goc_glom.join(glom_grc)
+        joined = np.column_stack((goc_grc.connections, goc_grc.compartments[:, 1]))
+        self.assertEqual(list(map(tuple, joined)), self.legacy_join())
+        self.assertTrue(np.all(goc_grc.compartments[:, 0] == -1), "Missing pre comps")
+
+    def test_outgoing(self):
+        matrix = ConnectivityMatrix(self.glom_grc)
+        edges = matrix.outgoing([120, 999, 101])
+        expected = [
+            i for g in (120, 101) for i in np.nonzero(self.glom_grc[:, 0] == g)[0]
+        ]
+        self.assertEqual(edges.tolist(), expected)
+        self.assertEqual(ConnectivityMatrix(np.empty((0, 2))).outgoing([1]).tolist(), [])
+
+    def test_compose(self):
+        goc_glom = ConnectivityMatrix(self.goc_glom)
+        glom_grc = ConnectivityMatrix(self.glom_grc)
+        from_ids, to_ids, paths = goc_glom.compose(glom_grc)
+        dense = np.zeros((10, 300), dtype=int)
+        for goc, grc, _ in self.legacy_join():
+            dense[goc, grc] += 1
+        self.assertTrue(np.array_equal(paths.toarray(), dense[from_ids][:, to_ids]))
+
+    def test_golgi_granule(self):
+        strategy = ConnectomeGolgiGranule()
+        strategy.detailed = True
+        strategy.axon = np.array([7, 8])
+        results = []
+        strategy.scaffold = SimpleNamespace(
+            cell_connections_by_tag={
+                "golgi_to_glomerulus": self.goc_glom,
+                "glomerulus_to_granule": self.glom_grc,
+            },
+            connection_compartments={"glomerulus_to_granule": self.glom_grc_comps},
+            connect_cells=lambda *args, **kwargs: results.append(kwargs),
+        )
+        cell_type = SimpleNamespace(list_all_morphologies=lambda: ["morpho"])
+        strategy.from_cell_types = strategy.to_cell_types = [cell_type]
+        strategy.connect()
+        compartments = results[0]["compartments"]
+        self.assertEqual(compartments[:, 1].tolist(), [c[2] for c in self.legacy_join()])
+        self.assertTrue(np.all(np.isin(compartments[:, 0], [7, 8])), "Not axonal")
+
+    def test_io_molecular(self):
+        # IO cells 0-9 and interneurons 200-299 to Purkinje cells 100-159
+        io_pc = self.goc_glom
+        mli_pc = self.glom_grc[:, ::-1]
+        strategy = ConnectomeIOMolecular()
+        strategy.common_type = "purkinje_cell"
+        results = []
+        io, pc, mli = (SimpleNamespace(name=n) for n in ("io", "pc", "mli"))
+        caches = {("mli", "pc"): [mli_pc], ("io", "pc"): [None, io_pc]}
+        strategy.scaffold = SimpleNamespace(
+            configuration=SimpleNamespace(cell_types={"purkinje_cell": pc}),
+            get_cells_by_type=lambda name: None,
+            query_connection_cache=lambda pre, post: {
+                "conn": caches[(pre.name, post.name)]
+            },
+            connect_cells=lambda strategy, result: results.append(result),
+        )
+        strategy.from_cell_types = [io]
+        strategy.to_cell_types = [mli]
+        strategy.connect()
+        # Each IO cell in turn connects to the interneurons of each of its PCs.
+        expected = [(i, m) for i, p in io_pc for m, p2 in mli_pc if p2 == p]
+        self.assertTrue(expected, "No paths to compare")
+        self.assertEqual(list(map(tuple, results[0])), expected)
@@ -5,6 +5,9 @@ from bsb.core import Scaffold
 from bsb.config import JSONConfig
 from bsb.models import Layer, CellType, ConnectivitySet
 from bsb.output import MorphologyRepository
+from bsb.morphologies import Compartment
+from bsb.networks import FiberMorphology
+from bsb.connectivity.detailed.fiber_intersection import QuiverTransform
 import test_setup
 
 
@@ -89,5 +92,119 @@ class TestFiberIntersection(unittest.TestCase):
         self.assertTrue(len(cs_transform.connections) <= num_conn)
 
 
+def fiber_compartments():
+    # An ascending axon of 3 compartments that bifurcates into 2 parallel fibers.
+    points = [[0, 0, 0], [0, 10, 0], [0, 20, 0], [0, 30, 0]]
+    comps = []
+    for i in range(3):
+        parent = comps[-1] if comps else None
+        comps.append(Compartment(points[i], points[i + 1], 1.0, id=i, parent=parent))
+    for i, direction in enumerate((1, -1)):
+        comps.append(
+            Compartment(
+                points[3], [direction * 45, 30, 0], 1.0, id=3 + i, parent=comps[2]
+            )
+        )
+    return comps
+
+
 class TestBranching(unittest.TestCase):
-    pass
+    def test_network(self):
+        fiber = FiberMorphology(fiber_compartments(), [0.0, 0.0])
+        self.assertEqual(len(fiber.root_branches), 1, "Expected a single root")
+        root = fiber.root_branches[0]
+        self.assertEqual(root.ids.tolist(), [0, 1, 2])
+        self.assertEqual([b.ids.tolist() for b in root.child_branches], [[3], [4]])
+        self.assertTrue(np.allclose(root.child_branches[0].orientation, [1, 0, 0]))
+        self.assertEqual(fiber.flatten()[2].tolist(), [0, 1, 2, 3, 4])
+
+    def test_interpolate(self):
+        fiber = FiberMorphology(fiber_compartments(), None)
+        copy = fiber.copy()
+        for branch in copy.get_branches():
+            branch.interpolate(20.0)
+        starts, ends, ids = copy.flatten()
+        self.assertEqual(ids.tolist(), [0, 1, 2, 3, 3, 3, 4, 4, 4])
+        self.assertTrue(np.allclose(starts[4], [15, 30, 0]), "Incorrect split")
+        self.assertTrue(np.allclose(ends[8], [-45, 30, 0]), "End point moved")
+        self.assertTrue(np.allclose(starts[1:3], ends[0:2]), "Segments not joined")
+        self.assertEqual(len(fiber.flatten()[2]), 5, "Copy should not share arrays")
+
+    def test_voxelize(self):
+        fiber = FiberMorphology(fiber_compartments(), None)
+        branch = fiber.root_branches[0].child_branches[1]
+        boxes = branch.voxelize(np.array([1, 1, 1]))
+        self.assertEqual(boxes.tolist(), [[-44, 31, 1, 1, 31, 1]])
+        detached = fiber.root_branches[0].detach(1)
+        self.assertEqual(detached.ids.tolist(), [1, 2])
+        self.assertEqual(fiber.root_branches[0].ids.tolist(), [0])
+
+
+def make_quiver_transform(quivers):
+    transform = QuiverTransform()
+    transform.shared = False
+    transform.quivers = quivers
+    transform.vol_res = 10.0
+    transform.vol_start = [-100.0, -100.0, -100.0]
+    return transform
+
+
+def reference_transform(transform, branch, offset):
+    # The original per compartment walk of the quiver field.
+    direction = transform.get_branch_direction(branch)
+    if direction is False:
+        return 0
+    orientation = [0, 1, 0] if branch.orientation is None else branch.orientation
+    transversal = np.cross(direction, orientation)
+    shape = np.array(transform.quivers.shape[1:])
+    length = np.linalg.norm(branch.ends[0] - branch.starts[0])
+    for comp in range(len(branch)):
+        start = branch.starts[comp] + offset - transform.vol_start
+        voxel_ind = (start / transform.vol_res).astype(int) - 1
+        if (voxel_ind < 0).all() or (voxel_ind > shape).all():
+            branch.detach(comp)
+            return 1
+        vector = transform.quivers[:, voxel_ind[0], voxel_ind[1], voxel_ind[2]]
+        if np.isnan(vector).any():
+            branch.detach(comp)
+            return 1
+        cross_prod = np.cross(vector, transversal)
+        cross_prod = cross_prod / np.linalg.norm(cross_prod)
+        branch.ends[comp] = branch.starts[comp] + cross_prod * length
+        if comp < len(branch) - 1:
+            length = np.linalg.norm(branch.ends[comp + 1] - branch.starts[comp + 1])
+            branch.starts[comp + 1] = branch.ends[comp]
+    return 0
+
+
+class TestQuiverTransform(unittest.TestCase):
+    def test_batched_transform(self):
+        np.random.seed(1)
+        quivers = np.random.normal(size=(3, 30, 30, 30))
+        # A region without orientation data that cuts the fibers crossing it.
+        quivers[:, 14:, 14:, :] = np.nan
+        template = FiberMorphology(fiber_compartments(), None)
+        for branch in template.get_branches():
+            branch.interpolate(2.0)
+        fibers, offsets = [], np.random.uniform(-30, 60, (20, 3))
+        # A fiber outside of the volume is cut at its first compartment.
+        offsets[0] = -200
+        for offset in offsets:
+            fiber = template.copy()
+            fiber.orient(np.random.uniform(0, np.pi, 2))
+            fibers.append(fiber)
+        references = [fiber.copy() for fiber in fibers]
+        transform = make_quiver_transform(quivers)
+        cut = transform.transform_fibers(fibers, offsets)
+        reference = make_quiver_transform(quivers)
+        expected = [
+            sum(reference_transform(reference, b, offset) for b in fiber.get_branches())
+            for fiber, offset in zip(references, offsets)
+        ]
+        self.assertEqual(cut.tolist(), expected, "Different cuts")
+        self.assertEqual(transform._branch_cut_num, sum(expected))
+        self.assertTrue(0 < np.count_nonzero(cut) < 20, "Expected some cut fibers")
+        for fiber, ref in zip(fibers, references):
+            for a, b in zip(fiber.flatten(), ref.flatten()):
+                self.assertEqual(a.shape, b.shape, "Detached segments differ")
+                self.assertTrue(np.allclose(a, b), "Transform differs")
@@ -0,0 +1,33 @@
+import unittest, os, sys, numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.simulators.neuron.adapter import partition_costs
+from scipy.sparse import block_diag, csr_matrix
+
+
+class TestPartitionCosts(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        # Many cheap granule-like cells and a few expensive Purkinje-like cells.
+        self.costs = np.concatenate((np.ones(1000), np.full(20, 500.0)))
+        np.random.shuffle(self.costs)
+
+    def test_lpt(self):
+        ranks, loads = partition_costs(self.costs, 8)
+        self.assertTrue(np.all(ranks >= 0), "Unassigned cells")
+        self.assertTrue(np.allclose(np.bincount(ranks, self.costs, 8), loads))
+        round_robin = np.bincount(np.arange(len(self.costs)) % 8, self.costs, 8)
+        self.assertLess(np.max(loads), np.max(round_robin), "Worse than round robin")
+        # 20 Purkinje cells over 8 ranks: the best partition puts 3 on some ranks.
+        self.assertEqual(np.max(loads), 1500, "Not the optimal partition")
+
+    def test_affinity(self):
+        # 16 groups of 20 connected cells of equal cost over 4 ranks.
+        costs = np.ones(320)
+        adjacency = block_diag([csr_matrix(np.ones((20, 20)))] * 16).tocsr()
+        ranks, loads = partition_costs(costs, 4, adjacency, tolerance=0.05)
+        self.assertLessEqual(np.max(loads), 80 * 1.05, "Tolerance exceeded")
+        split = sum(len(np.unique(ranks[g * 20 : (g + 1) * 20])) > 1 for g in range(16))
+        self.assertLessEqual(split, 4, "Connected cells should stay together")
+        ranks_again, _ = partition_costs(costs, 4, adjacency, tolerance=0.05)
+        self.assertTrue(np.array_equal(ranks, ranks_again), "Not deterministic")
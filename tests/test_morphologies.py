@@ -1,8 +1,10 @@
-import unittest, os, sys, numpy as np, h5py
+import unittest, unittest.mock, os, sys, numpy as np, h5py
+from types import SimpleNamespace
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import bsb.output, test_setup
 from bsb.morphologies import Morphology, Branch
+from bsb.models import MorphologySet
 from bsb.exceptions import *
 
 
@@ -365,3 +367,75 @@ class TestLegacy(unittest.TestCase):
         m.get_compartments(labels=["A"])
         m.get_branches()
         m.get_branches(labels=["B"])
+
+
+class TestVoxelClouds(unittest.TestCase):
+    def setUp(self):
+        v = len(Branch.vectors)
+        root = Branch(*(np.arange(5.0) * (i + 1) for i in range(v)))
+        child = Branch(*(np.arange(5.0) * (-i - 1) for i in range(v)))
+        child.label("A")
+        root.attach_child(child)
+        self.mr = bsb.output.MorphologyRepository("voxel_clouds_test.h5")
+        self.mr.get_handle("w")
+        self.mr.save_morphology("test", Morphology([root]))
+
+    def tearDown(self):
+        os.remove("voxel_clouds_test.h5")
+
+    def test_stored_cloud(self):
+        m = self.mr.get_morphology("test")
+        cloud = self.mr.get_voxel_cloud(m, 4)
+        self.assertTrue(self.mr.voxel_cloud_exists("test", "N4"), "Cloud not stored")
+        self.assertEqual(self.mr.list_all_voxelized(), ["test"])
+        loaded = self.mr.load_voxel_cloud("test", "N4")
+        self.assertTrue(np.array_equal(loaded.voxels, cloud.voxels))
+        self.assertTrue(np.allclose(loaded.bounds, cloud.bounds))
+        self.assertEqual(loaded.grid_size, cloud.grid_size)
+        self.assertEqual(loaded.map, cloud.map)
+        self.mr.get_voxel_cloud(m, 2, labels=["A"])
+        self.assertTrue(self.mr.voxel_cloud_exists("test", "N2:A"), "Labels not keyed")
+
+    def test_invalidation(self):
+        m = self.mr.get_morphology("test")
+        self.mr.get_voxel_cloud(m, 4)
+        with self.mr.load("a") as repo:
+            repo()["morphologies/test/branches/0/x"][0] = 10.0
+        self.assertIsNone(
+            self.mr.load_voxel_cloud("test", "N4"), "Changed morphology not detected"
+        )
+
+    def test_node_order(self):
+        # The master node stores the cloud before the other nodes load it.
+        for master in (True, False):
+            events = []
+            comm = SimpleNamespace(Barrier=lambda: events.append("barrier"))
+            scaffold = SimpleNamespace(
+                morphology_repository=self.mr,
+                has_mpi_installed=True,
+                is_mpi_master=master,
+                MPI=SimpleNamespace(COMM_WORLD=comm),
+                rotations={},
+            )
+            cell_type = SimpleNamespace(name="a", list_all_morphologies=lambda: ["test"])
+            get_cloud = self.mr.get_voxel_cloud
+
+            def record(*args, **kwargs):
+                events.append(("cloud", kwargs["store"]))
+                return get_cloud(*args, **kwargs)
+
+            with unittest.mock.patch.object(self.mr, "get_voxel_cloud", record):
+                MorphologySet(scaffold, cell_type, FakePlacementSet(), N=3)
+            loaded = [("cloud", master)]
+            if master:
+                self.assertEqual(events, loaded + ["barrier", "barrier"])
+            else:
+                self.assertEqual(events, ["barrier"] + loaded + ["barrier"])
+
+
+class FakePlacementSet:
+    rotation_set = SimpleNamespace(exists=lambda: False)
+    cells = [1, 2]
+
+    def __len__(self):
+        return len(self.cells)
@@ -1,11 +1,13 @@
 import unittest, os, sys, numpy as np, h5py, importlib
+from types import SimpleNamespace
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 from bsb.core import Scaffold
 from bsb.config import JSONConfig
-from bsb.simulators.nest import NestCell
+from bsb.simulators.nest import NestCell, NestAdapter, IdentifierMap
 from bsb.models import Layer, CellType
 from bsb.exceptions import *
+import bsb.simulators.nest
 
 
 def relative_to_tests_folder(path):
@@ -39,6 +41,98 @@ def neuron_installed():
     return importlib.util.find_spec("neuron")
 
 
+class TestIdentifierMap(unittest.TestCase):
+    def test_translation(self):
+        id_map = IdentifierMap([4, 5, 6], [1, 2, 3])
+        id_map.update(np.array([0, 10]), [4, 5])
+        self.assertEqual(len(id_map), 5)
+        self.assertEqual(id_map.get_nest_ids([10, 4, 0, 6]).tolist(), [5, 1, 4, 3])
+        self.assertEqual(id_map.get_scaffold_ids(np.array([5.0, 2.0])).tolist(), [10, 5])
+        for ids in ([7], [11], [-1]):
+            with self.assertRaises(KeyError) as cm:
+                id_map.get_nest_ids(ids)
+            self.assertEqual(cm.exception.args[0], ids[0])
+        self.assertEqual(IdentifierMap().get_nest_ids([]).tolist(), [])
+
+
+class TestHeterosynConnections(unittest.TestCase):
+    def test_batched_connect(self):
+        calls = []
+        adapter = NestAdapter()
+        adapter.nest = SimpleNamespace(Connect=lambda *args: calls.append(args))
+        connection_model = SimpleNamespace(
+            name="hetero", get_connection_parameters=lambda: {"weight": 9.0}
+        )
+        np.random.seed(0)
+        sources = np.random.randint(1, 20, 100)
+        targets = np.random.randint(20, 30, 100)
+        cells = np.unique(targets)
+        adapter._connect_hetero(connection_model, sources, targets, cells, {})
+        self.assertEqual(len(calls), 1, "Expected a single Connect call")
+        pre, post, _, params = calls[0]
+        # The legacy loop connected the cells one by one, with their own `vt_num`.
+        expected = [
+            (s, t, float(vt_num))
+            for vt_num, cell in enumerate(cells)
+            for s, t in zip(sources[targets == cell], targets[targets == cell])
+        ]
+        self.assertEqual(list(zip(pre, post, params["vt_num"])), expected)
+        self.assertEqual(params["weight"], 9.0)
+
+
+class FakeSpikeDetector:
+    def __init__(self, senders, times):
+        self.events = {"senders": np.array(senders), "times": np.array(times)}
+
+    def GetStatus(self, ids, key):
+        return ({"events": self.events}[key],)
+
+    def SetStatus(self, ids, status):
+        if status.get("n_events") == 0:
+            self.events = {k: v[:0] for k, v in self.events.items()}
+
+
+class TestMemorySpikeRecorder(unittest.TestCase):
+    def test_collect(self):
+        adapter = NestAdapter()
+        adapter.name, adapter.chunk_size = "memory_spikes", 2
+        adapter.nest = FakeSpikeDetector([1, 3, 1, 2], [0.5, 1.0, 1.5, 2.0])
+        adapter.global_identifier_map = IdentifierMap([10, 11, 12], [1, 2, 3])
+        cell_type = SimpleNamespace(name="cell", plotting=SimpleNamespace(color="red"))
+        adapter.scaffold = SimpleNamespace(
+            configuration=SimpleNamespace(_raw="{}"),
+            get_cell_type=lambda name: cell_type,
+        )
+        device = SimpleNamespace(
+            name="spikes", adapter=adapter, parameters={}, cell_types=["cell"]
+        )
+        device.protocol = bsb.simulators.nest.get_device_protocol(
+            SimpleNamespace(device="spike_detector")
+        )
+        device.protocol.device = device
+        adapter.devices = {"spikes": device}
+        device.protocol.before_create()
+        device.protocol.after_create((5,))
+        self.assertEqual(len(adapter.result.recorders), 1)
+        paths = [adapter.collect_output(None)]
+        adapter.nest.events = {"senders": np.array([3]), "times": np.array([3.0])}
+        paths.append(adapter.collect_output(None))
+        try:
+            with h5py.File(paths[0], "r") as f:
+                spikes = f["recorders/soma_spikes/spikes"]
+                self.assertIsNone(spikes.maxshape[0], "Spikes should be appendable")
+                self.assertEqual(spikes.dtype.names, ("id", "time"))
+                self.assertEqual(spikes["id"].tolist(), [10, 12, 10, 11])
+                self.assertEqual(spikes["time"].tolist(), [0.5, 1.0, 1.5, 2.0])
+                self.assertEqual(spikes.attrs["label"], "cell")
+            with h5py.File(paths[1], "r") as f:
+                spikes = f["recorders/soma_spikes/spikes"]
+                self.assertEqual(spikes["id"].tolist(), [12], "Spikes collected twice")
+        finally:
+            for path in paths:
+                os.remove(path)
+
+
 @unittest.skipIf(importlib.util.find_spec("nest") is None, "NEST is not importable.")
 class TestKernelManagement(unittest.TestCase):
     # TODO: Add set_threads exception tests here
@@ -0,0 +1,82 @@
+import unittest, os, sys, numpy as np
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.models import ConnectionColumns
+from bsb.simulators.neuron.adapter import NeuronAdapter, ParallelContextComm
+from bsb.exceptions import TransmitterError, ConnectivityError
+
+
+class FakeCell:
+    def __init__(self, id):
+        self.ref_id = id
+        self.sections = ["soma", "dendrite", "axon"]
+        self.transmitters = []
+
+    def create_transmitter(self, section, gid, source=None):
+        self.transmitters.append((section, gid))
+
+
+class FakeSet:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def get_columns(self):
+        return self.columns
+
+
+def fake_adapter(columns):
+    adapter = NeuronAdapter()
+    adapter.connection_models = {}
+    adapter.node_cells = {0, 1}
+    adapter.cells = {0: FakeCell(0), 1: FakeCell(1)}
+    adapter.h = SimpleNamespace(parallel=SimpleNamespace(id=lambda: 0))
+    adapter._collect_transmitter_sets = lambda models: [FakeSet(columns)]
+    return adapter
+
+
+class TestSections(unittest.TestCase):
+    def test_get_section(self):
+        adapter = NeuronAdapter()
+        cell = FakeCell(3)
+        self.assertEqual(adapter._get_section(cell, 2, ConnectivityError), "axon")
+        with self.assertRaises(ConnectivityError, msg="-1 should not be a section"):
+            adapter._get_section(cell, -1, ConnectivityError)
+
+    def test_transmitters(self):
+        columns = ConnectionColumns([0, 1, 1], [2, 2, 3])
+        columns.from_sections = np.array([2, 0, 2])
+        adapter = fake_adapter(columns)
+        adapter.create_transmitters()
+        sections = [s for c in adapter.cells.values() for s, _ in c.transmitters]
+        self.assertEqual(sorted(sections), ["axon", "axon", "soma"])
+
+    def test_missing_compartments(self):
+        # Without compartment data the sections are -1.
+        adapter = fake_adapter(ConnectionColumns([0, 1], [2, 3]))
+        with self.assertRaises(TransmitterError):
+            adapter.create_transmitters()
+        self.assertFalse(adapter.cells[0].transmitters, "Transmitter on a last section")
+
+
+class TestResultComm(unittest.TestCase):
+    def test_parallel_context(self):
+        # Without mpi4py on its ranks, NEURON's ranks write the results in turns.
+        calls = []
+        adapter = NeuronAdapter()
+        adapter.pc = SimpleNamespace(
+            id=lambda: 1,
+            nhost=lambda: 2,
+            barrier=lambda: calls.append("barrier"),
+            py_allgather=lambda data: [None, data],
+        )
+        comm = adapter._get_result_comm()
+        self.assertIsInstance(comm, ParallelContextComm)
+        self.assertEqual((comm.Get_rank(), comm.Get_size()), (1, 2))
+        self.assertEqual(comm.allgather(5), [None, 5])
+        comm.Barrier()
+        self.assertEqual(calls, ["barrier"])
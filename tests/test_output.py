@@ -0,0 +1,320 @@
+import unittest, unittest.mock, os, sys, json, h5py, numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold, from_hdf5
+from bsb.config import JSONConfig
+from bsb.reporting import set_verbosity
+from bsb.models import ConnectionColumns, ConnectionIndex, Resource, _identifier_rows
+from bsb.morphologies import Compartment
+
+
+def relative_to_tests_folder(path):
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+double_neuron_config = relative_to_tests_folder("configs/test_double_neuron.json")
+
+
+def compile_double_neuron(file, incremental):
+    with open(double_neuron_config, "r") as f:
+        config = json.load(f)
+    del config["output"]["morphology_repository"]
+    config["output"]["file"] = file
+    config["output"]["incremental"] = incremental
+    config["output"]["chunk_size"] = 16
+    scaffold = Scaffold(JSONConfig(stream=json.dumps(config)))
+    np.random.seed(2)
+    scaffold.compile_network()
+    return scaffold
+
+
+class TestIncrementalOutput(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+        cls.files = ["incremental_test.hdf5", "full_test.hdf5", "append_test.hdf5"]
+        cls.incremental = compile_double_neuron(cls.files[0], True)
+        cls.full = compile_double_neuron(cls.files[1], False)
+
+    @classmethod
+    def tearDownClass(cls):
+        for file in cls.files:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def test_same_output(self):
+        for name in ("from_cell", "to_cell"):
+            a = self.incremental.get_placement_set(name)
+            b = self.full.get_placement_set(name)
+            self.assertTrue(np.array_equal(a.identifiers, b.identifiers), "Ids differ")
+            self.assertTrue(np.allclose(a.positions, b.positions), "Positions differ")
+        a = self.incremental.get_connectivity_set("connection")
+        b = self.full.get_connectivity_set("connection")
+        self.assertTrue(np.array_equal(a.from_identifiers, b.from_identifiers))
+        self.assertTrue(np.array_equal(a.to_identifiers, b.to_identifiers))
+        with h5py.File(self.files[0], "r") as f:
+            self.assertEqual(
+                dict(f["statistics/cells_placed"].attrs), {"from_cell": 4, "to_cell": 4}
+            )
+
+    def test_chunked_datasets(self):
+        with h5py.File(self.files[0], "r") as f:
+            for path in (
+                "cells/placement/from_cell/identifiers",
+                "cells/placement/from_cell/positions",
+                "cells/connections/connection",
+            ):
+                self.assertIsNotNone(f[path].chunks, f"{path} should be chunked")
+                self.assertIsNone(f[path].maxshape[0], f"{path} should be resizable")
+
+    def test_connection_index(self):
+        for scaffold in (self.incremental, self.full):
+            cs = scaffold.get_connectivity_set("connection")
+            with h5py.File(scaffold.output_formatter.file, "r") as f:
+                group = f["cells/connection_index/connection/outgoing"]
+                self.assertEqual(group.attrs["connections"], len(cs), "Index not stored")
+                version = f["cells/connections/connection"].attrs["version"]
+                self.assertEqual(group.attrs["version"], version, "Index not versioned")
+                self.assertEqual(sorted(group), sorted(ConnectionIndex.datasets))
+            self.assertTrue(np.array_equal(cs.outgoing_index.ids, [0, 1, 2, 3]))
+
+    def test_append(self):
+        scaffold = compile_double_neuron(self.files[2], True)
+        self.assertFalse(isinstance(scaffold.cells_by_type, dict), "Not streaming")
+        cell_type = scaffold.get_cell_type("from_cell")
+        ids = scaffold.get_cells_by_type("from_cell")[:, 0]
+        ids = np.concatenate(
+            (ids, scaffold.place_cells(cell_type, None, np.ones((3, 3))))
+        )
+        ps = scaffold.get_placement_set("from_cell")
+        self.assertTrue(np.array_equal(ps.identifiers, ids), "Append lost ids")
+        self.assertEqual(len(ps.positions), 7, "Append lost positions")
+        connection_type = scaffold.get_connection_type("connection")
+        for morphologies in (["a", "b"], ["b", "c"]):
+            scaffold.connect_cells(
+                connection_type,
+                [[0, 1]],
+                tag="morpho",
+                compartments=np.array([[0, 1]]),
+                morphologies=np.array([morphologies]),
+            )
+        scaffold.compile_output()
+        morphologies = scaffold.connection_morphologies["morpho"]
+        _map = scaffold.connection_morphologies["__map_morpho"]
+        self.assertEqual(np.array(_map)[morphologies].tolist(), [["a", "b"], ["b", "c"]])
+        self.assertEqual(len(scaffold.cell_connections_by_tag["morpho"]), 2)
+
+    def test_changed_index(self):
+        scaffold = compile_double_neuron(self.files[2], True)
+        connection_type = scaffold.get_connection_type("connection")
+        scaffold.connect_cells(connection_type, [[0, 5], [1, 5]], tag="extra")
+        formatter = scaffold.output_formatter
+        with unittest.mock.patch.object(
+            formatter, "_store_connection_index", wraps=formatter._store_connection_index
+        ) as store_index:
+            scaffold.compile_output()
+            scaffold.compile_output()
+        # Only the appended tag is indexed again, and only once.
+        self.assertEqual([c.args[1] for c in store_index.call_args_list], ["extra"])
+        cs = scaffold.get_connectivity_set("extra")
+        self.assertEqual(cs.incoming([5]).tolist(), [0, 1])
+        # A rewrite of as many connections is told apart by its write count.
+        with h5py.File(formatter.file, "a") as f:
+            dataset = f["cells/connections/extra"]
+            dataset[()] = dataset[()][::-1]
+            dataset.attrs["version"] += 1
+        self.assertEqual(cs.outgoing([0]).tolist(), [1], "Stale index used")
+
+
+class TestOutputViews(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+        cls.file = "views_test.hdf5"
+        compile_double_neuron(cls.file, False)
+        cls.scaffold = from_hdf5(cls.file)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.file):
+            os.remove(cls.file)
+
+    def test_cached_views(self):
+        ps = self.scaffold.get_placement_set("from_cell")
+        self.assertIs(ps.positions, ps.positions, "Positions should be cached")
+        self.assertIs(ps.identifiers, ps.identifiers, "Identifiers should be cached")
+        self.assertNotIsInstance(ps.positions, np.memmap, "Views should be copies")
+        self.assertFalse(ps.positions.flags.writeable, "Views should be read-only")
+        self.assertEqual(ps.identifiers.tolist(), [0, 1, 2, 3])
+        self.assertEqual(len(ps), 4)
+        cs = self.scaffold.get_connectivity_set("connection")
+        self.assertIs(cs.from_identifiers.base, cs.to_identifiers.base)
+        self.assertEqual(len(cs.from_identifiers), 16)
+
+    def test_filtered_views(self):
+        ps = self.scaffold.get_placement_set("from_cell")
+        ps.set_filter(lambda: [1, 3])
+        self.assertEqual(ps.identifiers.tolist(), [1, 3], "Filter not applied")
+        self.assertIs(ps.positions, ps.positions, "Filtered view should be cached")
+        self.assertEqual(len(ps.positions), 2)
+        ps.set_filter(lambda: [0])
+        self.assertEqual(ps.identifiers.tolist(), [0], "Filter change not applied")
+
+    def test_invalidation(self):
+        ps = self.scaffold.get_placement_set("to_cell")
+        positions = ps.positions
+        with self.scaffold.output_formatter.load("a"):
+            pass
+        self.assertIsNot(ps.positions, positions, "Writes should invalidate views")
+        self.assertTrue(np.allclose(ps.positions, positions))
+
+    def test_rewritten_file(self):
+        file = "views_rewrite_test.hdf5"
+        compile_double_neuron(file, False)
+        try:
+            scaffold = from_hdf5(file)
+            ps = scaffold.get_placement_set("to_cell")
+            positions = ps.positions
+            # Writes through another handle are noticed.
+            with h5py.File(file, "a") as f:
+                f["cells/placement/to_cell/positions"][0] = [-1, -1, -1]
+                f.create_dataset("padding", data=np.zeros(1000))
+            positions = ps.positions
+            self.assertEqual(positions[0].tolist(), [-1, -1, -1], "Stale view")
+            expected = positions.copy()
+            scaffold.compile_output()
+            self.assertTrue(
+                np.array_equal(positions, expected), "Held views should not change"
+            )
+        finally:
+            os.remove(file)
+
+    def test_columns(self):
+        cs = self.scaffold.get_connectivity_set("connection")
+        columns = cs.get_columns()
+        self.assertEqual(len(columns), 16)
+        self.assertTrue(np.array_equal(columns.from_ids, cs.from_identifiers))
+        self.assertTrue(np.all(columns.from_sections == -1), "Expected nil sections")
+        self.assertEqual(columns.get_from_compartment(0).id, -1)
+
+    def test_connection_lookups(self):
+        cs = self.scaffold.get_connectivity_set("connection")
+        pre, post = cs.from_identifiers, cs.to_identifiers
+        self.assertIs(cs.outgoing_index, cs.outgoing_index, "Index should be cached")
+        for id in (0, 3, 4, 7, 99):
+            self.assertEqual(sorted(cs.outgoing([id])), np.nonzero(pre == id)[0].tolist())
+            self.assertEqual(
+                sorted(cs.incoming([id])), np.nonzero(post == id)[0].tolist()
+            )
+        self.assertEqual(cs.get_out_degrees([0, 4, 99]).tolist(), [4, 0, 0])
+        self.assertEqual(cs.get_in_degrees([0, 4, 7]).tolist(), [0, 4, 4])
+        self.assertEqual(cs.get_divergence_list().tolist(), [4, 4, 4, 4])
+        self.assertEqual(cs.get_convergence_list().tolist(), [4, 4, 4, 4])
+
+    def test_partial_reads(self):
+        ps = self.scaffold.get_placement_set("to_cell")
+        ids, positions = ps.select_cells([7, 2, 5, 5])
+        self.assertEqual(ids.tolist(), [5, 7])
+        self.assertTrue(np.array_equal(positions, ps.positions[[1, 3]]))
+        self.assertEqual(ps.get_cell_rows([4, 7, 3, 8]).tolist(), [0, 3, -1, -1])
+        cs = self.scaffold.get_connectivity_set("connection")
+        pre, post = cs.from_identifiers, cs.to_identifiers
+        queries = (
+            ("incoming", [7, 5, 0], [5, 7], [0]),
+            ("outgoing", [3, 0, 9], [0, 3], [4]),
+        )
+        for direction, ids, found, missing in queries:
+            get_columns = getattr(cs, f"get_{direction}_columns")
+            rows = getattr(cs, f"{direction}_index").select(found)
+            get_slices = unittest.mock.patch.object(
+                Resource, "get_slices", autospec=True, side_effect=Resource.get_slices
+            )
+            get_rows = unittest.mock.patch.object(
+                Resource, "get_rows", autospec=True, side_effect=Resource.get_rows
+            )
+            with get_slices as read_slices, get_rows as read_rows:
+                columns = get_columns(ids)
+            # Only the slices of the order of the found cells are read, and then
+            # only their rows of the connections.
+            self.assertEqual(
+                [c.args[0]._path for c in read_slices.call_args_list],
+                [f"/cells/connection_index/connection/{direction}/order"],
+            )
+            self.assertEqual(
+                [c.args[0]._path for c in read_rows.call_args_list],
+                ["/cells/connections/connection"],
+            )
+            self.assertEqual(read_rows.call_args.args[1].tolist(), rows.tolist())
+            self.assertTrue(np.array_equal(columns.from_ids, pre[rows]))
+            self.assertTrue(np.array_equal(columns.to_ids, post[rows]))
+            self.assertEqual(len(get_columns(missing)), 0)
+        # Without a stored index, the connections are looked up in memory instead.
+        cs.index_path = "/cells/connection_index/missing"
+        rows = cs.incoming([5, 7])
+        self.assertTrue(
+            np.array_equal(cs.get_incoming_columns([7, 5]).to_ids, post[rows])
+        )
+        with unittest.mock.patch("bsb.models._ROW_GAP", 1):
+            # Scattered rows are read in several hyperslabs, in the requested order.
+            rows = [15, 0, 7, 8, 2]
+            self.assertTrue(np.array_equal(cs.get_rows(rows), cs.get_view()[rows]))
+
+
+class TestConnectionIndex(unittest.TestCase):
+    def test_index(self):
+        np.random.seed(0)
+        connections = np.random.randint(0, 20, (200, 2))
+        index = ConnectionIndex.build(connections[:, 0], connections[:, 1])
+        ids = [5, 21, 5, 0]
+        rows = index.select(ids)
+        expected = [
+            i
+            for id in ids
+            for i in sorted(
+                np.nonzero(connections[:, 0] == id)[0], key=lambda i: connections[i, 1]
+            )
+        ]
+        self.assertEqual(connections[rows].tolist(), connections[expected].tolist())
+        degrees = [np.count_nonzero(connections[:, 0] == id) for id in ids]
+        self.assertEqual(index.degrees(ids).tolist(), degrees)
+        unique = np.unique(connections, axis=0)
+        _, partners = np.unique(unique[:, 0], return_counts=True)
+        self.assertEqual(index.partners.tolist(), partners.tolist())
+        empty = ConnectionIndex.build([], [])
+        self.assertEqual(empty.select([1]).tolist(), [])
+        self.assertEqual(empty.degrees([1]).tolist(), [0])
+
+    def test_identifier_rows(self):
+        # Cells 10-14, 30-31 and 20-22, stored in that order.
+        pairs = [10, 5, 30, 2, 20, 3]
+        rows = _identifier_rows(pairs, [20, 31, 14, 15, 9, 22, 10])
+        self.assertEqual(rows.tolist(), [7, 6, 4, -1, -1, 9, 0])
+        self.assertEqual(_identifier_rows([], [1]).tolist(), [-1])
+
+
+class TestConnectionColumns(unittest.TestCase):
+    def test_section_lookup(self):
+        class FakeMorphology:
+            def __init__(self, sections):
+                self.compartments = [
+                    Compartment(None, None, 1.0, id=i, section_id=s)
+                    for i, s in enumerate(sections)
+                ]
+
+        morphologies = {0: FakeMorphology([0, 0, 1]), 1: FakeMorphology([5, 6])}
+        columns = ConnectionColumns(
+            [0, 1, 2],
+            [3, 4, 5],
+            [2, 1, -1],
+            [0, 1, 2],
+            [0, 1, -1],
+            [1, 1, 0],
+            morphologies,
+        )
+        self.assertEqual(columns.from_sections.tolist(), [1, 6, -1])
+        self.assertEqual(columns.to_sections.tolist(), [5, 6, 1])
+        self.assertIs(columns.get_to_compartment(2), morphologies[0].compartments[2])
+        self.assertEqual(columns.get_from_compartment(2).id, -1)
+        self.assertRaises(
+            RuntimeError, ConnectionColumns, [0], [1], [-2], [0], [0], [0], morphologies
+        )
@@ -0,0 +1,114 @@
+import unittest, os, sys, json, numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.config import JSONConfig
+from bsb.particles import ParticleSystem, ArrayParticleSystem, partition_volume
+from bsb.reporting import set_verbosity
+
+
+def relative_to_tests_folder(path):
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+double_neuron_config = relative_to_tests_folder("configs/test_double_neuron.json")
+
+
+def fill(engine, count, side=40.0, radius=2.5):
+    system = engine(track_displaced=True)
+    system.fill(
+        [[[0.0, 0.0, 0.0], [side] * 3]],
+        [{"name": "test_cell", "voxels": [0], "radius": radius, "count": count}],
+    )
+    return system
+
+
+class TestArrayParticleSystem(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+
+    def test_fill(self):
+        np.random.seed(1)
+        objects = fill(ParticleSystem, 100)
+        np.random.seed(1)
+        arrays = fill(ArrayParticleSystem, 100)
+        self.assertEqual(len(arrays), 100, "Incorrect particle count")
+        self.assertTrue(
+            np.allclose(objects.positions, arrays.positions),
+            "Array engine should draw the same initial positions as the object engine",
+        )
+
+    def test_solve_collisions(self):
+        np.random.seed(2)
+        system = fill(ArrayParticleSystem, 250)
+        self.assertGreater(len(system.find_colliding_particles()), 0)
+        system.solve_collisions()
+        self.assertEqual(len(system.find_colliding_particles()), 0, "Collisions left")
+        distances, _ = cKDTree(system.positions).query(system.positions, k=2)
+        self.assertTrue(np.all(distances[:, 1] > 5.0), "Particles still overlap")
+        self.assertGreater(len(system.displaced_particles), 0)
+
+    def test_stacked_particles(self):
+        system = fill(ArrayParticleSystem, 0, side=20.0, radius=1.0)
+        system.add_particles(1.0, [[10.0, 10.0, 10.0]] * 2, type=0)
+        system.solve_collisions()
+        self.assertEqual(len(system.find_colliding_particles()), 0)
+
+    def test_prune(self):
+        np.random.seed(3)
+        system = fill(ArrayParticleSystem, 250)
+        system.solve_collisions()
+        pruned, per_type = system.prune()
+        self.assertTrue(np.all(system.positions >= 0) and np.all(system.positions <= 40))
+        self.assertEqual(len(system), 250 - pruned)
+        self.assertEqual(per_type.get("test_cell", 0), pruned)
+
+    def test_packing_statistics(self):
+        # The array engine should untangle the same volume into a packing comparable to
+        # the object engine.
+        stats = []
+        for engine in (ParticleSystem, ArrayParticleSystem):
+            np.random.seed(4)
+            system = fill(engine, 150)
+            system.solve_collisions()
+            distances, _ = cKDTree(system.positions).query(system.positions, k=2)
+            stats.append(np.mean(distances[:, 1]))
+        self.assertAlmostEqual(stats[0], stats[1], delta=0.5)
+
+
+class TestTiledPlacement(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+
+    def place(self, **kwargs):
+        with open(double_neuron_config, "r") as f:
+            config = json.load(f)
+        del config["output"]["morphology_repository"]
+        placement = config["cell_types"]["from_cell"]["placement"]
+        placement.update(count=5000, tile_size=60, seed=42)
+        placement.update(kwargs)
+        scaffold = Scaffold(JSONConfig(stream=json.dumps(config)))
+        scaffold.place_cell_type(scaffold.get_cell_type("from_cell"))
+        return scaffold.cells_by_type["from_cell"][:, 2:5]
+
+    def test_partition_volume(self):
+        tiles, grid = partition_volume([0, 0, 0], [100, 50, 30], np.array([40, 50, 40]))
+        self.assertEqual(grid, (3, 1, 1))
+        self.assertTrue(np.allclose(tiles[-1], [[80, 0, 0], [100, 50, 30]]))
+        self.assertAlmostEqual(np.sum(np.prod(tiles[:, 1] - tiles[:, 0], axis=1)), 150000)
+
+    def test_tiled_placement(self):
+        positions = self.place()
+        self.assertGreater(len(positions), 4500, "Too many cells pruned")
+        distances, _ = cKDTree(positions).query(positions, k=2)
+        self.assertTrue(np.all(distances[:, 1] > 5.0), "Cells overlap on tile borders")
+        self.assertTrue(np.all(positions >= 0) and np.all(positions[:, 1] <= 600))
+
+    def test_reproducible(self):
+        serial = self.place(workers=1)
+        self.assertTrue(np.array_equal(serial, self.place(workers=1)))
+        self.assertTrue(np.array_equal(serial, self.place(workers=2)))
+        self.assertFalse(np.array_equal(serial, self.place(seed=43)))
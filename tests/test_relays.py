@@ -0,0 +1,75 @@
+import unittest, os, sys, numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.simulation import RelayIndex
+from bsb.exceptions import RelayError
+
+
+def legacy_resolve(intermediate, terminal):
+    # Follow every chain of relays down to the terminal connections it reaches.
+    def follow(relay):
+        targets = [t for f, t in terminal if f == relay]
+        for f, t in intermediate:
+            if f == relay:
+                targets.extend(follow(t))
+        return targets
+
+    relays = {f for f, _ in intermediate} | {f for f, _ in terminal}
+    return {relay: sorted(follow(relay)) for relay in relays}
+
+
+class TestRelayIndex(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        # Mossy fibres 0-9 to glomeruli 10-59 to granule cells 100-299.
+        self.mf_glom = np.column_stack(
+            (np.random.randint(0, 10, 80), np.random.randint(10, 60, 80))
+        )
+        self.glom_grc = np.column_stack(
+            (np.random.randint(10, 60, 400), np.random.randint(100, 300, 400))
+        )
+
+    def resolve(self, node_ids=None):
+        index = RelayIndex()
+        index.add_relays(np.arange(60))
+        index.add_intermediate(self.mf_glom[:, 0], self.mf_glom[:, 1])
+        self.assertEqual(
+            index.add_terminal(self.glom_grc[:40, 0], self.glom_grc[:40, 1]), 0
+        )
+        self.assertEqual(
+            index.add_terminal(self.glom_grc[40:, 0], self.glom_grc[40:, 1]), 1
+        )
+        return index.resolve(node_ids)
+
+    def test_resolve(self):
+        scheme = self.resolve()
+        expected = legacy_resolve(self.mf_glom.tolist(), self.glom_grc.tolist())
+        for relay in range(60):
+            entries = scheme.select([relay])
+            self.assertEqual(scheme.targets[entries].tolist(), expected.get(relay, []))
+            self.assertTrue(np.all(scheme.relays[entries] == relay))
+        self.assertIn(59, scheme, "Relays without connections should be known")
+        self.assertNotIn(100, scheme)
+        # The set and row of each entry lead back to its terminal connection.
+        rows = scheme.rows + 40 * scheme.sets
+        self.assertTrue(np.array_equal(self.glom_grc[rows, 1], scheme.targets))
+
+    def test_node_targets(self):
+        node_ids = np.arange(100, 300, 3)
+        scheme = self.resolve(node_ids)
+        full = self.resolve()
+        on_node = np.isin(full.targets, node_ids)
+        self.assertEqual(scheme.targets.tolist(), full.targets[on_node].tolist())
+        self.assertEqual(scheme.relays.tolist(), full.relays[on_node].tolist())
+
+    def test_errors(self):
+        index = RelayIndex()
+        index.add_intermediate([0, 1], [1, 2])
+        with self.assertRaises(RelayError, msg="Non-relay targets should be refused"):
+            index.resolve()
+        index.add_intermediate([2], [0])
+        index.add_terminal([2], [100])
+        with self.assertRaises(RelayError, msg="Cycles should be refused"):
+            index.resolve()
+        self.assertEqual(len(RelayIndex().resolve()), 0)
@@ -0,0 +1,109 @@
+import unittest, os, sys, threading, h5py, numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.core import Scaffold
+from bsb.simulation import ResultWriter
+from bsb.reporting import set_verbosity
+
+
+class ThreadComm:
+    """
+    Communicator between threads that each play a rank.
+    """
+
+    def __init__(self, rank, size, shared):
+        self.rank, self.size, self.shared = rank, size, shared
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def Barrier(self):
+        self.shared["barrier"].wait()
+
+    def allgather(self, data):
+        self.shared["buffer"][self.rank] = data
+        self.Barrier()
+        gathered = list(self.shared["buffer"])
+        self.Barrier()
+        return gathered
+
+
+def write_ranks(path, rank_results, **kwargs):
+    size = len(rank_results)
+    shared = {"barrier": threading.Barrier(size), "buffer": [None] * size}
+    errors = []
+
+    def run(rank):
+        try:
+            writer = ResultWriter(path, comm=ThreadComm(rank, size, shared), **kwargs)
+            writer.write(rank_results[rank], attrs={"configuration_string": "{}"})
+        except Exception as e:
+            errors.append(e)
+            shared["barrier"].abort()
+
+    threads = [threading.Thread(target=run, args=(rank,)) for rank in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class TestResultWriter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+
+    def setUp(self):
+        self.file = "results_writer_test.hdf5"
+
+    def tearDown(self):
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+    def test_rank_order(self):
+        records = np.array([(3, 0.5)], dtype=[("id", np.int64), ("time", np.float64)])
+        rank_results = [
+            [
+                (("recorders", "v"), np.zeros((3, 2)), {"label": "a", "rank": 0}),
+                (("recorders", "v"), np.ones((1, 2)), {}),
+                (("only_0",), np.arange(4), {}),
+            ],
+            [
+                (("recorders", "v"), np.full((2, 2), 2.0), {"rank": 1}),
+                (("recorders", "spikes"), records, {}),
+                (("invalid",), [1, 2], {}),
+            ],
+            [],
+        ]
+        write_ranks(self.file, rank_results, chunk_size=8)
+        with h5py.File(self.file, "r") as f:
+            self.assertEqual(f.attrs["configuration_string"], "{}")
+            v = f["recorders/v"]
+            self.assertEqual(v[()].tolist(), [[0, 0]] * 3 + [[1, 1]] + [[2, 2]] * 2)
+            self.assertEqual(dict(v.attrs), {"label": "a", "rank": 1})
+            self.assertIsNone(v.maxshape[0], "Datasets should be resizable")
+            self.assertEqual(f["only_0"][()].tolist(), [0, 1, 2, 3])
+            self.assertEqual(f["recorders/spikes"].dtype.names, ("id", "time"))
+            self.assertEqual(f["recorders/spikes"]["id"].tolist(), [3])
+            self.assertNotIn("invalid", f, "Invalid data should be skipped")
+
+    def test_mismatched_shapes(self):
+        rank_results = [
+            [(("v",), np.zeros((2, 2)), {}), (("w",), np.zeros(2), {})],
+            [(("v",), np.zeros((2, 3)), {})],
+        ]
+        write_ranks(self.file, rank_results)
+        with h5py.File(self.file, "r") as f:
+            self.assertNotIn("v", f, "Mismatched data should be skipped")
+            self.assertEqual(f["w"].shape, (2,))
+
+    def test_single_process(self):
+        path = ResultWriter(self.file).write([(("v",), np.arange(3), {"a": 1})])
+        with h5py.File(path, "r") as f:
+            self.assertEqual(f["v"][()].tolist(), [0, 1, 2])
+            self.assertEqual(f["v"].attrs["a"], 1)
@@ -0,0 +1,151 @@
+import unittest, os, sys, numpy as np
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.connectivity import TouchDetector
+from bsb.connectivity.detailed.touch_detection import TouchInformation
+from bsb.helpers import DistributionConfiguration
+from bsb.morphologies import Compartment
+from bsb.reporting import set_verbosity
+
+
+class FakeMorphology:
+    def __init__(self, name, points, labels):
+        self.morphology_name = name
+        self.compartments = [
+            Compartment(None, np.array(p), 1.0, id=i, labels=[l])
+            for i, (p, l) in enumerate(zip(points, labels))
+        ]
+
+    def get_compartments(self, labels=None):
+        if labels is None:
+            return self.compartments.copy()
+        return [c for c in self.compartments if any(l in labels for l in c.labels)]
+
+
+def make_detector(synapses=1000):
+    detector = TouchDetector()
+    detector.compartment_intersection_radius = 3.0
+    detector.synapses = DistributionConfiguration.cast(synapses)
+    detector.allow_zero_synapses = False
+    detector._touch_points = {}
+    return detector
+
+
+def make_touch_info(detector, from_morpho, to_morpho, cells=10):
+    from_type, to_type = SimpleNamespace(name="from"), SimpleNamespace(name="to")
+    info = TouchInformation(from_type, ["axon"], to_type, ["dendrites"])
+    info.from_positions = np.random.random((cells, 3)) * 20
+    info.to_positions = np.random.random((cells, 3)) * 20
+    info.from_identifiers = np.arange(cells)
+    info.to_identifiers = np.arange(cells) + 100
+    morphologies = {"from": from_morpho, "to": to_morpho}
+    detector.get_random_morphology = lambda cell_type: morphologies[cell_type.name]
+    return info
+
+
+def brute_force_touches(detector, info, from_morpho, to_morpho):
+    # Reference implementation: check every pair of compartments of every cell pair.
+    touches = set()
+    from_comps = from_morpho.get_compartments(info.from_cell_compartments)
+    to_comps = to_morpho.get_compartments(info.to_cell_compartments)
+    for i, from_pos in enumerate(info.from_positions):
+        for j, to_pos in enumerate(info.to_positions):
+            for f in from_comps:
+                for t in to_comps:
+                    d = np.linalg.norm(f.end + from_pos - t.end - to_pos)
+                    if d <= detector.compartment_intersection_radius:
+                        touches.add((i, 100 + j, f.id, t.id))
+    return touches
+
+
+class TestTouchDetection(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        set_verbosity(0)
+        np.random.seed(0)
+        cls.from_morpho = FakeMorphology(
+            "granule",
+            np.random.random((30, 3)) * 10,
+            ["axon", "soma"] * 15,
+        )
+        cls.to_morpho = FakeMorphology(
+            "purkinje",
+            np.random.random((60, 3)) * 10,
+            ["dendrites", "axon", "soma"] * 20,
+        )
+
+    def test_batched_intersection(self):
+        detector = make_detector()
+        info = make_touch_info(detector, self.from_morpho, self.to_morpho)
+        candidates = [np.arange(10) for _ in range(10)]
+        (
+            connections,
+            morphologies,
+            compartments,
+            morpho_map,
+        ) = detector.intersect_compartments(info, candidates)
+        found = set(map(tuple, np.column_stack((connections, compartments)).tolist()))
+        expected = brute_force_touches(detector, info, self.from_morpho, self.to_morpho)
+        self.assertEqual(found, expected, "All touches should be found when unlimited")
+        self.assertEqual(len(found), len(connections), "Duplicate synapses")
+        self.assertEqual(morpho_map, ["granule", "purkinje"])
+        self.assertTrue(np.all(morphologies == [0, 1]), "Incorrect morphology map")
+
+    def test_synapse_sampling(self):
+        detector = make_detector(synapses=2)
+        info = make_touch_info(detector, self.from_morpho, self.to_morpho)
+        candidates = [np.arange(10) for _ in range(10)]
+        connections, _, compartments, _ = detector.intersect_compartments(
+            info, candidates
+        )
+        expected = brute_force_touches(detector, info, self.from_morpho, self.to_morpho)
+        pairs, counts = np.unique(connections, axis=0, return_counts=True)
+        self.assertTrue(np.all(counts <= 2), "Too many synapses per pair")
+        self.assertEqual(
+            len(pairs), len(set((t[0], t[1]) for t in expected)), "Pairs were lost"
+        )
+        found = map(tuple, np.column_stack((connections, compartments)).tolist())
+        self.assertTrue(set(found) <= expected, "Sampled synapses should touch")
+
+    def test_parallel_chunks(self):
+        detector = make_detector(synapses=2)
+        detector.scaffold = SimpleNamespace(has_mpi_installed=False)
+        info = make_touch_info(detector, self.from_morpho, self.to_morpho)
+        candidates = [np.arange(10) for _ in range(10)]
+        detector.seed, detector.chunk_size = 5, 3
+        results = []
+        for workers in (1, 2):
+            detector.workers = workers
+            chunks = detector.map_presynaptic(
+                lambda cells: detector.intersect_compartments(info, candidates, cells),
+                len(candidates),
+            )
+            self.assertEqual(len(chunks), 4, "Expected 4 chunks of 3 cells")
+            results.append(detector._join_chunks(chunks))
+        serial, pooled = results
+        for a, b in zip(serial[:3], pooled[:3]):
+            self.assertTrue(np.array_equal(a, b), "Results depend on the workers")
+        self.assertEqual(serial[3], pooled[3])
+        self.assertTrue(np.all(np.diff(serial[0][:, 0]) >= 0), "Chunks out of order")
+        pairs, counts = np.unique(serial[0], axis=0, return_counts=True)
+        self.assertTrue(np.all(counts <= 2), "Too many synapses per pair")
+
+    def test_seed_without_chunk_size(self):
+        detector = make_detector(synapses=2)
+        detector.scaffold = SimpleNamespace(has_mpi_installed=False)
+        detector.seed, detector.chunk_size = 5, None
+        detector.default_chunk_size = 4
+        results = []
+        for workers in (1, 2, 1):
+            detector.workers = workers
+            self.assertTrue(detector.is_parallel(), "Seeded runs should be chunked")
+            results.append(
+                detector.map_presynaptic(lambda cells: np.random.random(len(cells)), 10)
+            )
+        self.assertEqual([len(r) for r in results[0]], [4, 4, 2])
+        for result in results[1:]:
+            self.assertTrue(
+                np.array_equal(np.concatenate(results[0]), np.concatenate(result)),
+                "Seeded results should not depend on the workers",
+            )
@@ -0,0 +1,129 @@
+import unittest, os, sys, numpy as np, itertools as it
+from types import SimpleNamespace
+from rtree import index
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bsb.voxels import voxelize, HitDetector, Box, VoxelCloud
+from bsb.connectivity import VoxelIntersection
+from bsb.helpers import DistributionConfiguration
+
+
+def rtree_detector(points):
+    tree = index.Index(properties=index.Property(dimension=3))
+    for i, point in enumerate(points):
+        tree.insert(i, (*point, *point))
+    return HitDetector.for_rtree(tree)
+
+
+class TestVoxelize(unittest.TestCase):
+    def test_same_as_rtree(self):
+        np.random.seed(0)
+        # Rounded points lie on the borders between boxes of the grid.
+        for points in (
+            np.random.normal(0, 50, (500, 3)),
+            np.round(np.random.normal(0, 20, (500, 3))),
+        ):
+            box = Box.from_bounds(np.column_stack((points.min(0), points.max(0))))
+            expected = voxelize(40, box, rtree_detector(points))
+            result = voxelize(40, box, HitDetector.for_points(points))
+            self.assertTrue(np.array_equal(expected[0], result[0]), "Bounds differ")
+            self.assertTrue(np.array_equal(expected[1], result[1]), "Voxels differ")
+            self.assertEqual(expected[2], result[2], "Grid size differs")
+            self.assertEqual(expected[3], result[3], "Error differs")
+
+    def test_box_borders(self):
+        points = np.array([[1.0, 1.0, 1.0], [0.5, 0.5, 0.5]])
+        detector = HitDetector.for_points(points)
+        voxels = detector.detect_grid(np.array([[0, 3]] * 3), 1.0)
+        self.assertEqual(np.count_nonzero(voxels), 8, "Border point in all 8 boxes")
+        self.assertTrue(voxels[0, 0, 0] and voxels[1, 1, 1] and not voxels[2, 2, 2])
+        for index in np.ndindex(voxels.shape):
+            box_hit = detector(np.array(index, dtype=float), 1.0)
+            self.assertEqual(voxels[index], box_hit, "Grid and box detection differ")
+
+
+def random_cloud(grid_size, compartments=5):
+    voxels = np.random.random((4, 4, 4)) < 0.3
+    voxel_map = [
+        list(np.random.randint(100, size=np.random.randint(1, compartments)))
+        for _ in range(np.count_nonzero(voxels))
+    ]
+    bounds = np.array([[0.0, 4 * grid_size]] * 3)
+    return VoxelCloud(bounds, voxels, grid_size, voxel_map)
+
+
+def legacy_intersect_clouds(from_cloud, to_cloud, from_pos, to_pos):
+    # The per cell pair intersection that the voxel intersection used to do.
+    voxel_intersections = []
+    translation = to_pos - from_pos
+    for v, voxel in enumerate(to_cloud.get_voxels(cache=True)):
+        relative_position = np.add(voxel, translation)
+        relative_box = np.add(relative_position, to_cloud.grid_size)
+        box = np.concatenate((relative_position, relative_box))
+        voxel_intersections.append(
+            list(from_cloud.tree.intersection(tuple(box), objects=False))
+        )
+    return voxel_intersections
+
+
+class TestVoxelIntersection(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.strategy = VoxelIntersection()
+        self.strategy.affinity = 1.0
+        self.strategy.contacts = DistributionConfiguration.cast(50)
+        clouds = [[random_cloud(5.0), random_cloud(3.0)], [random_cloud(4.0)]]
+        self.sets = [
+            SimpleNamespace(
+                _cells=[
+                    SimpleNamespace(id=i, position=np.random.random(3) * 30)
+                    for i in range(20)
+                ],
+                _morphology_index=np.random.randint(len(c), size=20),
+                _morphologies=[SimpleNamespace(cloud=cloud) for cloud in c],
+            )
+            for c in clouds
+        ]
+
+    def test_intersect_voxels(self):
+        from_set, to_set = self.sets
+        cells = np.arange(20)
+        from_voxels = self.strategy.get_cell_voxels(from_set, cells)
+        to_voxels = self.strategy.get_cell_voxels(to_set, cells)
+        result = self.strategy.intersect_voxels(from_voxels, to_voxels, 20)
+        found = set(zip(result[0].tolist(), result[1].tolist()))
+        expected = {}
+        for i, j in it.product(cells, cells):
+            from_cloud = from_set._morphologies[from_set._morphology_index[i]].cloud
+            to_cloud = to_set._morphologies[to_set._morphology_index[j]].cloud
+            overlaps = legacy_intersect_clouds(
+                from_cloud,
+                to_cloud,
+                from_set._cells[i].position,
+                to_set._cells[j].position,
+            )
+            if any(overlaps):
+                expected[(i, j)] = (from_cloud, to_cloud, overlaps)
+        self.assertEqual(found, set(expected.keys()), "Touching cell pairs differ")
+        self.assertEqual(len(result[0]), 50 * len(expected), "Expected 50 contacts")
+        for i, j, from_comp, to_comp in zip(*result):
+            from_cloud, to_cloud, overlaps = expected[(i, j)]
+            candidates = set(
+                (f, t)
+                for to_voxel, from_voxels in enumerate(overlaps)
+                for from_voxel in from_voxels
+                for f in from_cloud.map[from_voxel]
+                for t in to_cloud.map[to_voxel]
+            )
+            self.assertIn((from_comp, to_comp), candidates, "Contact not in overlap")
+
+    def test_affinity(self):
+        self.strategy.affinity = 0.0
+        from_set, to_set = self.sets
+        cells = np.arange(20)
+        result = self.strategy.intersect_voxels(
+            self.strategy.get_cell_voxels(from_set, cells),
+            self.strategy.get_cell_voxels(to_set, cells),
+            20,
+        )
+        self.assertEqual(len(result[0]), 0, "Affinity 0 should not connect")